@@ -0,0 +1,103 @@
+"""
+Resumo "all day": quantos de cada prato ainda estão pendentes em todas as
+mesas abertas, por departamento.
+
+O agregado é mantido incrementalmente: cada pedido que passa por
+/print-kitchen ou /print-bar substitui a sua contribuição (custo
+proporcional aos itens do pedido) e a conta (/print-bill) a remove. Assim
+a consulta é imediata, sem reler o histórico de pedidos.
+"""
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Tuple
+
+from dotenv import load_dotenv
+
+import receipt_templates
+from printer_profiles import PrinterProfile
+
+load_dotenv()
+
+ALL_DAY_MAX_ORDERS = int(os.getenv("ALL_DAY_MAX_ORDERS", "2000"))
+
+_totals: Dict[str, Dict[str, float]] = {}
+_orders: "OrderedDict[Tuple[str, int], Dict[str, float]]" = OrderedDict()
+_lock = threading.Lock()
+
+
+def _apply(department: str, quantities: Dict[str, float], sign: int) -> None:
+    totals = _totals.setdefault(department, {})
+    for dish_name, amount in quantities.items():
+        value = totals.get(dish_name, 0) + sign * amount
+        if value > 1e-9:
+            totals[dish_name] = value
+        else:
+            totals.pop(dish_name, None)
+
+
+def update(department: str, order_id, order_dishes) -> None:
+    """Substitui a contribuição do pedido pelo estado atual dos seus pratos."""
+    quantities: Dict[str, float] = {}
+    for order_dish in order_dishes:
+        dish_name = order_dish['dish']['dish_name']
+        quantities[dish_name] = quantities.get(dish_name, 0) + order_dish['amount']
+    key = (department, order_id)
+    with _lock:
+        previous = _orders.pop(key, None)
+        if previous:
+            _apply(department, previous, -1)
+        if quantities:
+            _apply(department, quantities, 1)
+            _orders[key] = quantities
+        while len(_orders) > ALL_DAY_MAX_ORDERS:
+            (old_department, _), old_quantities = _orders.popitem(last=False)
+            _apply(old_department, old_quantities, -1)
+
+
+def close(order_id) -> None:
+    """Conta impressa: os pratos do pedido deixam de estar pendentes."""
+    with _lock:
+        for key in [key for key in _orders if key[1] == order_id]:
+            _apply(key[0], _orders.pop(key), -1)
+
+
+def reset() -> None:
+    with _lock:
+        _totals.clear()
+        _orders.clear()
+
+
+def summary(department: str) -> dict:
+    with _lock:
+        totals = dict(_totals.get(department, {}))
+        open_orders = sum(1 for key in _orders if key[0] == department)
+    items = sorted(totals.items(), key=lambda item: (-item[1], item[0]))
+    return {
+        "department": department,
+        "open_orders": open_orders,
+        "generated_at": datetime.now().isoformat(timespec="seconds"),
+        "items": [{"dish_name": dish_name, "amount": amount} for dish_name, amount in items],
+    }
+
+
+def render_summary(summary_data: dict, titulo: str, profile: PrinterProfile) -> bytes:
+    """Comanda com o total pendente de cada prato, no mesmo layout das comandas."""
+    generated_at = datetime.fromisoformat(summary_data["generated_at"]).strftime("%d-%m-%Y %H:%M:%S")
+    content = (
+        b'\x1B\x40'  # Resetar a impressora (ESC @)
+        b'\x1B\x61\x01'  # Centralizar texto (ESC a 1)
+        b'\x1B\x21\x20'  # Fonte média
+        + receipt_templates.encode_text(f'#{titulo} - all day\n')
+        + b'\x1B\x61\x00'  # Alinhar à esquerda (ESC a 0)
+        + b'\x1B\x21\x00'  # Fonte pequena (ESC ! 0)
+        + receipt_templates.encode_text(
+            f'Gerado em: {generated_at}\nPedidos abertos: {summary_data["open_orders"]}\n\n\n'
+        )
+    )
+    if not summary_data["items"]:
+        content += receipt_templates.encode_text('Nada pendente.\n')
+    for item in summary_data["items"]:
+        content += receipt_templates.render_order_dish(item["dish_name"], item["amount"], None, profile)
+    return content + b'\x1B\x21\x00\x1B\x61\x00\n----------------\n\n\n'
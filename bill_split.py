@@ -0,0 +1,155 @@
+"""
+Divisão da conta de uma mesa entre várias pessoas.
+
+Dois modos:
+- equal: N partes iguais; cada parte lista todos os itens com a fração
+  da quantidade.
+- items: cada pessoa indica os itens (posição em order_dishes) e,
+  opcionalmente, a quantidade que consumiu. Item sem quantidade explícita
+  é dividido igualmente entre quem o indicou; itens (ou sobras) que
+  ninguém indicou são divididos entre todos.
+
+Os valores são calculados em centavos e o serviço é rateado pelo
+subtotal de cada parte (maior resto). O total a pagar (final_value, que
+pode ter desconto ou arredondamento do POS) é rateado do mesmo jeito, pelo
+subtotal + serviço de cada parte, então a soma das partes fecha exatamente
+com os totais da conta; a diferença aparece como ajuste.
+"""
+from typing import Dict, List, Optional
+
+EPSILON = 1e-9
+
+
+class SplitError(ValueError):
+    pass
+
+
+def _cents(value: float) -> int:
+    return int(round(float(value or 0) * 100))
+
+
+def allocate(total_cents: int, weights: List[float]) -> List[int]:
+    """Reparte `total_cents` proporcionalmente aos pesos (método do maior resto)."""
+    if not weights:
+        return []
+    weight_sum = sum(weights)
+    if weight_sum <= EPSILON:
+        weights = [1.0] * len(weights)
+        weight_sum = float(len(weights))
+    raw = [total_cents * weight / weight_sum for weight in weights]
+    shares = [int(value) for value in raw]
+    order = sorted(range(len(raw)), key=lambda i: raw[i] - shares[i], reverse=True)
+    for i in order[: total_cents - sum(shares)]:
+        shares[i] += 1
+    return shares
+
+
+def _dish_line(order_dish: dict, amount: float) -> dict:
+    dish = order_dish.get("dish", {})
+    unit_price = float(order_dish.get("unit_price") or dish.get("price") or 0)
+    return {
+        "dish_name": dish.get("dish_name", ""),
+        "amount": amount,
+        "unit_price": unit_price,
+        "line_total": amount * unit_price,
+    }
+
+
+def _equal_lines(order_dishes: List[dict], people: int) -> List[List[dict]]:
+    lines = [_dish_line(order_dish, float(order_dish.get("amount", 0)) / people) for order_dish in order_dishes]
+    return [lines for _ in range(people)]
+
+
+def _item_lines(order_dishes: List[dict], assignments: List[dict]) -> List[List[dict]]:
+    people = len(assignments)
+    quantities: List[Dict[int, float]] = [{} for _ in range(people)]
+
+    for index, order_dish in enumerate(order_dishes):
+        amount = float(order_dish.get("amount", 0))
+        explicit = {}
+        shared = []
+        for person, assignment in enumerate(assignments):
+            for item in assignment.get("items") or []:
+                if item["index"] != index:
+                    continue
+                if item.get("amount") is None:
+                    shared.append(person)
+                else:
+                    explicit[person] = explicit.get(person, 0) + float(item["amount"])
+        remainder = max(0.0, amount - sum(explicit.values()))
+        for person, taken in explicit.items():
+            quantities[person][index] = taken
+        # Sobra vai para quem indicou o item sem quantidade; se ninguém, para todos
+        receivers = shared or (list(range(people)) if remainder > EPSILON else [])
+        for person in receivers:
+            quantities[person][index] = quantities[person].get(index, 0) + remainder / len(receivers)
+
+    return [
+        [_dish_line(order_dishes[index], amount) for index, amount in sorted(person_quantities.items())]
+        for person_quantities in quantities
+    ]
+
+
+def _validate_assignments(order_dishes: List[dict], assignments: List[dict]) -> None:
+    explicit: Dict[int, float] = {}
+    for assignment in assignments:
+        for item in assignment.get("items") or []:
+            index = item["index"]
+            if not 0 <= index < len(order_dishes):
+                raise SplitError(f"Item {index} não existe no pedido.")
+            if item.get("amount") is None:
+                continue
+            if float(item["amount"]) <= 0:
+                raise SplitError(f"Item {index}: quantidade deve ser maior que zero.")
+            explicit[index] = explicit.get(index, 0) + float(item["amount"])
+    for index, taken in explicit.items():
+        ordered = float(order_dishes[index].get("amount", 0))
+        if taken > ordered + EPSILON:
+            dish_name = _dish_line(order_dishes[index], 0)["dish_name"]
+            raise SplitError(f"Item {index} ({dish_name}): quantidade dividida ({taken:g}) maior que a pedida ({ordered:g}).")
+
+
+def compute(order_data: dict, split: dict) -> List[dict]:
+    """Partes da conta: pessoa, itens, subtotal, serviço e total (em reais)."""
+    order_dishes = order_data.get("order_dishes", [])
+    mode = split.get("mode", "equal")
+
+    if mode == "equal":
+        people = split.get("people") or len(split.get("assignments") or [])
+        if not people or people < 2:
+            raise SplitError("Informe people (2 ou mais) para dividir igualmente.")
+        names = [assignment.get("name", "") for assignment in split.get("assignments") or []]
+        lines = _equal_lines(order_dishes, people)
+        subtotals = allocate(_cents(order_data.get("subtotal")), [1.0] * people)
+    elif mode == "items":
+        assignments = split.get("assignments") or []
+        if len(assignments) < 2:
+            raise SplitError("Informe assignments com 2 ou mais pessoas.")
+        _validate_assignments(order_dishes, assignments)
+        names = [assignment.get("name", "") for assignment in assignments]
+        lines = _item_lines(order_dishes, assignments)
+        subtotals = [_cents(sum(line["line_total"] for line in person_lines)) for person_lines in lines]
+        # Garante que as partes fecham com o subtotal informado pelo POS
+        subtotals = allocate(_cents(order_data.get("subtotal")), subtotals) if order_data.get("subtotal") else subtotals
+    else:
+        raise SplitError(f"Modo de divisão desconhecido: {mode}")
+
+    fees = allocate(_cents(order_data.get("service_fee")), [float(value) for value in subtotals])
+    gross = [subtotal + fee for subtotal, fee in zip(subtotals, fees)]
+    # Desconto/arredondamento do POS: o total de cada parte fecha com final_value
+    if order_data.get("final_value") is not None:
+        totals = allocate(_cents(order_data.get("final_value")), [float(value) for value in gross])
+    else:
+        totals = gross
+    parts = []
+    for i, person_lines in enumerate(lines):
+        name: Optional[str] = names[i] if i < len(names) else ""
+        parts.append({
+            "person": name or f"Pessoa {i + 1}",
+            "items": person_lines,
+            "subtotal": subtotals[i] / 100,
+            "service_fee": fees[i] / 100,
+            "adjustment": (totals[i] - gross[i]) / 100,
+            "total": totals[i] / 100,
+        })
+    return parts
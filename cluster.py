@@ -0,0 +1,461 @@
+"""
+Modo cluster: qualquer nó aceita /print-* e o job renderizado é entregue
+ao nó que tem a impressora (USB local daquele PC).
+
+Configuração (CLUSTER_ENABLED=1):
+- CLUSTER_NODE_NAME: nome deste nó (padrão: hostname).
+- CLUSTER_LOCAL_PRINTERS: impressoras ligadas neste nó, separadas por
+  vírgula (padrão: BAR/KITCHEN/BILL/REPORT_PRINTER).
+- CLUSTER_PEERS: lista estática "nome=url,nome=url"; as impressoras de
+  cada par são aprendidas pelo heartbeat (GET /cluster/node).
+- CLUSTER_REGISTRY_PATH: alternativa em arquivo JSON
+  {"nodes": [{"name": "caixa", "url": "http://10.0.0.2:8000", "printers": ["EPSON-CONTA"]}]}
+
+O spooler passa a ser um ClusterSpooler: impressoras locais vão direto
+para o backend local; as remotas têm os bytes acumulados e, no
+EndDocPrinter, são enviadas por uma conexão HTTP/1.1 persistente
+(keep-alive) ao dono. Se o dono cair, tenta outro nó que anuncie a mesma
+impressora (failover).
+
+Para não imprimir a mesma comanda duas vezes, cada job leva um
+X-Idempotency-Key (o nó que recebe devolve o resultado já conhecido de
+uma chave repetida) e só vai para outro nó quando não chegou a ser
+enviado ou quando o par responde 404 (não é mais dono da impressora).
+Se a resposta não vier depois do envio, o job é dado como falho, sem
+reenviar. O heartbeat usa uma conexão própria, com timeout curto, e
+consulta os pares em paralelo.
+"""
+import http.client
+import json
+import os
+import secrets
+import socket
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+from urllib.parse import quote, urlparse
+
+from dotenv import load_dotenv
+
+import spooler
+
+load_dotenv()
+
+CLUSTER_ENABLED = os.getenv("CLUSTER_ENABLED", "0") == "1"
+CLUSTER_NODE_NAME = os.getenv("CLUSTER_NODE_NAME") or socket.gethostname()
+CLUSTER_PEERS = os.getenv("CLUSTER_PEERS", "")
+CLUSTER_REGISTRY_PATH = os.getenv("CLUSTER_REGISTRY_PATH", "")
+CLUSTER_HEARTBEAT_SECONDS = float(os.getenv("CLUSTER_HEARTBEAT_SECONDS", "2"))
+CLUSTER_TIMEOUT_SECONDS = float(os.getenv("CLUSTER_TIMEOUT_SECONDS", "30"))
+CLUSTER_HEARTBEAT_TIMEOUT_SECONDS = float(os.getenv("CLUSTER_HEARTBEAT_TIMEOUT_SECONDS", "2"))
+CLUSTER_PEER_DOWN_AFTER = int(os.getenv("CLUSTER_PEER_DOWN_AFTER", "2"))
+CLUSTER_IDEMPOTENCY_KEEP = int(os.getenv("CLUSTER_IDEMPOTENCY_KEEP", "1000"))
+
+
+def _default_local_printers() -> List[str]:
+    names = [
+        os.getenv("BAR_PRINTER"),
+        os.getenv("KITCHEN_PRINTER"),
+        os.getenv("BILL_PRINTER"),
+        os.getenv("REPORT_PRINTER"),
+    ]
+    return sorted({name for name in names if name})
+
+
+LOCAL_PRINTERS = [
+    name.strip() for name in os.getenv("CLUSTER_LOCAL_PRINTERS", "").split(",") if name.strip()
+] or _default_local_printers()
+
+
+class NodeMetrics:
+    """Carga deste nó: jobs em andamento (fila) e contadores."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.queue_depth = 0
+        self.jobs_local = 0
+        self.jobs_forwarded = 0
+        self.jobs_received = 0
+        self.failovers = 0
+        self.errors = 0
+
+    def incr(self, field: str, amount: int = 1) -> None:
+        with self._lock:
+            setattr(self, field, getattr(self, field) + amount)
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "queue_depth": self.queue_depth,
+                "jobs_local": self.jobs_local,
+                "jobs_forwarded": self.jobs_forwarded,
+                "jobs_received": self.jobs_received,
+                "failovers": self.failovers,
+                "errors": self.errors,
+            }
+
+
+metrics = NodeMetrics()
+
+
+class DeliveryUnknown(OSError):
+    """A requisição foi enviada, mas a resposta não chegou: não é seguro reenviar."""
+
+
+class Channel:
+    """Conexão HTTP/1.1 persistente com um par, usada por uma finalidade."""
+
+    def __init__(self, url: str, timeout: float):
+        self.url = url
+        self.timeout = timeout
+        self._conn: Optional[http.client.HTTPConnection] = None
+        self._lock = threading.Lock()
+
+    def _connection(self) -> http.client.HTTPConnection:
+        if self._conn is None:
+            parsed = urlparse(self.url)
+            conn_class = http.client.HTTPSConnection if parsed.scheme == "https" else http.client.HTTPConnection
+            self._conn = conn_class(parsed.hostname, parsed.port, timeout=self.timeout)
+        return self._conn
+
+    def _reset(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+        self._conn = None
+
+    def request(self, method: str, path: str, body: Optional[bytes] = None, headers: Optional[dict] = None):
+        """
+        Reconecta e repete uma vez só quando é seguro: a falha aconteceu
+        antes do envio, ou o par fechou a conexão keep-alive ociosa sem
+        responder nada. Outras falhas depois do envio viram DeliveryUnknown.
+        """
+        with self._lock:
+            for attempt in range(2):
+                conn = self._connection()
+                reused = conn.sock is not None
+                try:
+                    conn.request(method, path, body=body, headers=headers or {})
+                except (http.client.HTTPException, OSError):
+                    self._reset()
+                    if attempt:
+                        raise
+                    continue
+                try:
+                    response = conn.getresponse()
+                    return response.status, response.read()
+                except http.client.RemoteDisconnected as exc:
+                    self._reset()
+                    if attempt or not reused:
+                        raise DeliveryUnknown(f"{self.url} fechou a conexão sem responder: {exc}") from exc
+                except (http.client.HTTPException, OSError) as exc:
+                    self._reset()
+                    raise DeliveryUnknown(f"Sem resposta de {self.url}: {exc}") from exc
+
+
+class Peer:
+    def __init__(self, name: str, url: str, printers: Optional[List[str]] = None):
+        self.name = name
+        self.url = url.rstrip("/")
+        self.static_printers = list(printers or [])
+        self.printers: List[str] = list(printers or [])
+        self.alive = bool(printers)
+        self.failures = 0
+        self.last_seen: Optional[float] = None
+        self.latency_ms: Optional[float] = None
+        self.load: dict = {}
+        # Jobs e heartbeat em conexões separadas: um job lento não derruba o par
+        self._jobs = Channel(self.url, CLUSTER_TIMEOUT_SECONDS)
+        self._heartbeat = Channel(self.url, CLUSTER_HEARTBEAT_TIMEOUT_SECONDS)
+
+    def request(self, method: str, path: str, body: Optional[bytes] = None, headers: Optional[dict] = None):
+        return self._jobs.request(method, path, body=body, headers=headers)
+
+    def fetch_node_info(self) -> dict:
+        status, payload = self._heartbeat.request("GET", "/cluster/node")
+        if status != 200:
+            raise OSError(f"HTTP {status}")
+        return json.loads(payload)
+
+    def drop_printer(self, printer_name: str) -> None:
+        """O par respondeu que não é mais dono; o heartbeat reaprende se voltar."""
+        self.printers = [name for name in self.printers if name != printer_name]
+
+    def mark_down(self) -> None:
+        self.failures += 1
+        if self.failures >= CLUSTER_PEER_DOWN_AFTER:
+            self.alive = False
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "url": self.url,
+            "alive": self.alive,
+            "printers": self.printers,
+            "failures": self.failures,
+            "last_seen": self.last_seen,
+            "latency_ms": self.latency_ms,
+            "load": self.load,
+        }
+
+
+def _load_peers() -> Dict[str, Peer]:
+    peers: Dict[str, Peer] = {}
+    if CLUSTER_REGISTRY_PATH and os.path.exists(CLUSTER_REGISTRY_PATH):
+        with open(CLUSTER_REGISTRY_PATH, "r", encoding="utf-8") as fh:
+            registry = json.load(fh)
+        for node in registry.get("nodes", []):
+            if node.get("name") and node.get("name") != CLUSTER_NODE_NAME:
+                peers[node["name"]] = Peer(node["name"], node["url"], node.get("printers"))
+    for entry in CLUSTER_PEERS.split(","):
+        name, _, url = entry.strip().partition("=")
+        if name and url and name != CLUSTER_NODE_NAME and name not in peers:
+            peers[name] = Peer(name, url)
+    return peers
+
+
+peers: Dict[str, Peer] = _load_peers() if CLUSTER_ENABLED else {}
+_heartbeat_started = False
+
+
+def node_info() -> dict:
+    return {"name": CLUSTER_NODE_NAME, "printers": LOCAL_PRINTERS, "load": metrics.to_dict()}
+
+
+def _probe(peer: Peer) -> None:
+    started = time.perf_counter()
+    try:
+        info = peer.fetch_node_info()
+    except Exception:
+        peer.mark_down()
+        return
+    peer.latency_ms = round((time.perf_counter() - started) * 1000, 2)
+    peer.printers = sorted(set(info.get("printers", [])) | set(peer.static_printers))
+    peer.load = info.get("load", {})
+    peer.alive = True
+    peer.failures = 0
+    peer.last_seen = time.time()
+
+
+def heartbeat_once() -> None:
+    targets = list(peers.values())
+    if not targets:
+        return
+    # Em paralelo: um par fora do ar não atrasa a checagem dos outros
+    with ThreadPoolExecutor(max_workers=len(targets)) as executor:
+        list(executor.map(_probe, targets))
+
+
+def _heartbeat_loop() -> None:
+    while True:
+        heartbeat_once()
+        time.sleep(CLUSTER_HEARTBEAT_SECONDS)
+
+
+def start() -> None:
+    global _heartbeat_started
+    if not CLUSTER_ENABLED or _heartbeat_started:
+        return
+    _heartbeat_started = True
+    threading.Thread(target=_heartbeat_loop, name="cluster-heartbeat", daemon=True).start()
+    print(f"[CLUSTER] Nó {CLUSTER_NODE_NAME} com {LOCAL_PRINTERS}; pares: {list(peers)}")
+
+
+def owners(printer_name: str) -> List[Peer]:
+    """Pares vivos que anunciam a impressora, do menos carregado ao mais."""
+    candidates = [peer for peer in peers.values() if peer.alive and printer_name in peer.printers]
+    return sorted(candidates, key=lambda peer: peer.load.get("queue_depth", 0))
+
+
+def cluster_status() -> dict:
+    return {"node": node_info(), "peers": [peer.to_dict() for peer in peers.values()]}
+
+
+class IdempotentJobs:
+    """
+    Resultado dos jobs recebidos por X-Idempotency-Key. Uma chave repetida
+    (reenvio depois de conexão caída) devolve o resultado do primeiro
+    envio, esperando-o terminar se ainda estiver imprimindo.
+    """
+
+    def __init__(self, keep: int = CLUSTER_IDEMPOTENCY_KEEP):
+        self.keep = keep
+        self._entries: "OrderedDict[str, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def run(self, key: Optional[str], func: Callable[[], dict]) -> dict:
+        if not key:
+            return func()
+        with self._lock:
+            entry = self._entries.get(key)
+            first = entry is None
+            if first:
+                entry = self._entries[key] = {"done": threading.Event(), "result": None}
+                while len(self._entries) > self.keep:
+                    self._entries.popitem(last=False)
+        if not first:
+            entry["done"].wait(CLUSTER_TIMEOUT_SECONDS)
+            if entry["result"] is None:
+                return {"status": "failed", "detail": "Job repetido ainda sem resultado; não reimpresso.", "duplicate": True}
+            return {**entry["result"], "duplicate": True}
+        try:
+            result = func()
+        except Exception:
+            # Falhou antes de imprimir: permite que um reenvio tente de novo
+            with self._lock:
+                self._entries.pop(key, None)
+            entry["done"].set()
+            raise
+        entry["result"] = result
+        entry["done"].set()
+        return result
+
+
+received_jobs = IdempotentJobs()
+
+
+def forward_job(printer_name: str, doc_name: str, data: bytes) -> dict:
+    """Entrega o job ao dono da impressora, com failover entre os candidatos."""
+    candidates = owners(printer_name)
+    if not candidates:
+        raise OSError(f"Nenhum nó do cluster atende a impressora {printer_name}")
+    headers = {
+        "Content-Type": "application/octet-stream",
+        "X-Doc-Name": quote(doc_name),
+        "X-Idempotency-Key": secrets.token_hex(16),
+    }
+    path = f"/cluster/jobs/{quote(printer_name, safe='')}"
+    last_error = None
+    for index, peer in enumerate(candidates):
+        if index:
+            metrics.incr("failovers")
+        try:
+            status, payload = peer.request("POST", path, body=data, headers=headers)
+        except DeliveryUnknown as exc:
+            # Pode ter impresso: outro nó imprimiria de novo
+            metrics.incr("errors")
+            return {"status": "failed", "detail": f"{exc} (job não reenviado)", "node": peer.name}
+        except Exception as exc:
+            peer.mark_down()
+            last_error = exc
+            continue
+        try:
+            result = json.loads(payload or b"{}")
+        except ValueError:
+            result = {"detail": payload[:200].decode("utf-8", "replace")}
+        if status == 404:
+            peer.drop_printer(printer_name)
+            last_error = OSError(result.get("detail") or f"{peer.name} não atende {printer_name}")
+            continue
+        metrics.incr("jobs_forwarded")
+        result.setdefault("node", peer.name)
+        if status >= 400:
+            result["status"] = "failed"
+        return result
+    metrics.incr("errors")
+    raise OSError(f"Falha ao encaminhar job para {printer_name}: {last_error}")
+
+
+class ClusterSpooler:
+    """
+    Backend do spooler que roteia por impressora: locais vão para o
+    backend local, remotas são acumuladas e encaminhadas no EndDocPrinter.
+    """
+
+    def __init__(self, local_backend):
+        self.local = local_backend
+        self._remote = {}
+        self._lock = threading.Lock()
+        self._next = 0
+
+    def _is_local(self, printer_name) -> bool:
+        return printer_name in LOCAL_PRINTERS
+
+    def _is_remote_handle(self, handle) -> bool:
+        return isinstance(handle, tuple) and handle[0] == "remote"
+
+    def OpenPrinter(self, printer_name):
+        if self._is_local(printer_name):
+            return self.local.OpenPrinter(printer_name)
+        if not owners(printer_name):
+            raise OSError(f"Impressora {printer_name} não está em nenhum nó ativo do cluster")
+        with self._lock:
+            self._next += 1
+            handle = ("remote", self._next)
+            self._remote[handle] = {"name": printer_name, "doc": "", "chunks": []}
+        return handle
+
+    def GetPrinter(self, handle, level=2):
+        if not self._is_remote_handle(handle):
+            return self.local.GetPrinter(handle, level)
+        info = self._remote[handle]
+        peer = owners(info["name"])[0]
+        return {"pPrinterName": info["name"], "Status": 0, "Node": peer.name}
+
+    def ClosePrinter(self, handle):
+        if not self._is_remote_handle(handle):
+            return self.local.ClosePrinter(handle)
+        with self._lock:
+            self._remote.pop(handle, None)
+
+    def StartDocPrinter(self, handle, level, doc_info):
+        if not self._is_remote_handle(handle):
+            job = self.local.StartDocPrinter(handle, level, doc_info)
+            # Só conta depois de abrir: se falhar, ninguém chama End/Abort
+            metrics.incr("queue_depth")
+            return job
+        self._remote[handle]["doc"] = doc_info[0] if doc_info else ""
+        self._remote[handle]["chunks"] = []
+        return handle
+
+    def StartPagePrinter(self, handle):
+        if not self._is_remote_handle(handle):
+            return self.local.StartPagePrinter(handle)
+        return None
+
+    def WritePrinter(self, handle, data):
+        if not self._is_remote_handle(handle):
+            return self.local.WritePrinter(handle, data)
+        self._remote[handle]["chunks"].append(bytes(data))
+        return len(data)
+
+    def EndPagePrinter(self, handle):
+        if not self._is_remote_handle(handle):
+            return self.local.EndPagePrinter(handle)
+        return None
+
+    def EndDocPrinter(self, handle):
+        if not self._is_remote_handle(handle):
+            try:
+                return self.local.EndDocPrinter(handle)
+            finally:
+                metrics.incr("queue_depth", -1)
+                metrics.incr("jobs_local")
+        info = self._remote[handle]
+        try:
+            result = forward_job(info["name"], info["doc"], b"".join(info["chunks"]))
+        except OSError as exc:
+            spooler._set_job_status("failed", str(exc))
+            return None
+        spooler._set_job_status(result.get("status", "spooled"), result.get("detail"))
+        return None
+
+    def AbortPrinter(self, handle):
+        if not self._is_remote_handle(handle):
+            try:
+                return self.local.AbortPrinter(handle)
+            finally:
+                metrics.incr("queue_depth", -1)
+        # Nada foi encaminhado ainda: basta descartar o acumulado
+        self._remote[handle]["chunks"] = []
+        spooler._set_job_status("failed", "job cancelado")
+        return None
+
+    def printer_status(self, printer_name) -> dict:
+        if self._is_local(printer_name):
+            return spooler.backend_printer_status(self.local, printer_name)
+        candidates = owners(printer_name)
+        if not candidates:
+            return {"printer": printer_name, "reachable": False, "ready": False, "error": "sem nó ativo"}
+        return {"printer": printer_name, "reachable": True, "ready": True, "node": candidates[0].name}
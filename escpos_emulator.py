@@ -0,0 +1,531 @@
+"""
+Impressora ESC/POS virtual para testes locais (Linux, sem spooler Windows).
+
+- Escuta em TCP (como a porta RAW 9100 das impressoras de rede); cada
+  conexão é um job. Com --sink-dir os bytes de cada job são gravados em disco.
+- Interpreta o fluxo gerado pelos renderizadores (ESC @, ESC !, ESC a,
+  ESC E, ESC -, ESC M, GS v 0, GS ( k, ESC i / GS V, ...) e estima o
+  comprimento de papel.
+- Simula a velocidade física (mm/s) e a taxa de transferência (baud): a
+  leitura do socket é limitada, então o lado que envia sente a pressão
+  como numa impressora real.
+- Pode ficar offline, atolar, abrir a tampa ou ficar sem papel sob comando
+  (API HTTP de controle ou métodos Python) e registra o tempo de cada job.
+- Responde DLE EOT, envia ASB (GS a) quando o estado muda e confirma
+  GS ( H só depois de "imprimir" o job.
+
+Uso:
+    python escpos_emulator.py --port 9100 --control-port 9180 --speed-mm-s 150 --baud 115200
+    curl -X POST localhost:9180/state/paper_out   # ou offline, jam, cover_open, online
+    curl localhost:9180/jobs
+    python escpos_emulator.py --parse job.bin
+"""
+import argparse
+import json
+import os
+import socket
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import count
+from typing import Deque, List, Optional
+
+import escpos_status
+
+ESC = 0x1B
+GS = 0x1D
+DLE = 0x10
+FS = 0x1C
+
+DOTS_PER_MM = 8.0  # 203 dpi
+LINE_HEIGHT_MM = 4.23  # espaçamento padrão de 1/6"
+CUT_FEED_MM = 3.0
+
+STATE_ONLINE = "online"
+STATE_OFFLINE = "offline"
+STATE_JAM = "jam"
+STATE_PAPER_OUT = "paper_out"
+STATE_COVER_OPEN = "cover_open"
+STATES = (STATE_ONLINE, STATE_OFFLINE, STATE_JAM, STATE_PAPER_OUT, STATE_COVER_OPEN)
+
+# Comandos ESC com número fixo de bytes de parâmetro (após ESC x)
+_ESC_PARAMS = {
+    0x21: 1,  # ESC ! n  modo de impressão
+    0x2D: 1,  # ESC - n  sublinhado
+    0x32: 0,  # ESC 2    espaçamento padrão
+    0x33: 1,  # ESC 3 n  espaçamento
+    0x40: 0,  # ESC @    reset
+    0x45: 1,  # ESC E n  negrito
+    0x47: 1,  # ESC G n  double-strike
+    0x4A: 1,  # ESC J n  avança n pontos
+    0x4D: 1,  # ESC M n  fonte
+    0x61: 1,  # ESC a n  alinhamento
+    0x64: 1,  # ESC d n  avança n linhas
+    0x69: 0,  # ESC i    corte total
+    0x6D: 0,  # ESC m    corte parcial
+    0x70: 3,  # ESC p    gaveta
+    0x74: 1,  # ESC t n  tabela de caracteres
+    0x42: 2,  # ESC B n t buzzer
+}
+
+# Comandos GS com número fixo de bytes de parâmetro (após GS x)
+_GS_PARAMS = {
+    0x21: 1,  # GS ! n tamanho
+    0x42: 1,  # GS B n reverso
+    0x48: 1,  # GS H n HRI
+    0x61: 1,  # GS a n ASB
+    0x66: 1,  # GS f n
+    0x68: 1,  # GS h n
+    0x72: 1,  # GS r n status
+    0x77: 1,  # GS w n
+}
+
+
+class JobStats:
+    def __init__(self, job_id: int):
+        self.job_id = job_id
+        self.bytes = 0
+        self.text_bytes = 0
+        self.lines = 0
+        self.raster_images = 0
+        self.raster_dots_high = 0
+        self.qr_codes = 0
+        self.cuts = 0
+        self.resets = 0
+        self.unknown_commands = 0
+        self.paper_mm = 0.0
+        self.received_at = time.time()
+        self.transfer_done_at: Optional[float] = None
+        self.printed_at: Optional[float] = None
+        self.status = "receiving"
+        self.error: Optional[str] = None
+
+    def to_dict(self) -> dict:
+        data = {key: value for key, value in self.__dict__.items()}
+        if self.transfer_done_at:
+            data["transfer_ms"] = round((self.transfer_done_at - self.received_at) * 1000, 1)
+        if self.printed_at:
+            data["total_ms"] = round((self.printed_at - self.received_at) * 1000, 1)
+        data["paper_mm"] = round(self.paper_mm, 1)
+        return data
+
+
+class EscPosParser:
+    """
+    Parser incremental: feed() pode receber o fluxo em pedaços arbitrários.
+    Comandos incompletos ficam em buffer até chegar o resto.
+    """
+
+    def __init__(self, stats: JobStats):
+        self.stats = stats
+        self.buffer = bytearray()
+        self.double_height = False
+        self.line_has_text = False
+        self.has_content = False
+        self.queries: List[bytes] = []
+
+    def feed(self, data: bytes) -> None:
+        self.stats.bytes += len(data)
+        self.buffer += data
+        consumed = self._parse()
+        if consumed:
+            del self.buffer[:consumed]
+
+    def close(self) -> None:
+        if self.line_has_text:
+            self._newline()
+
+    def _newline(self) -> None:
+        self.stats.lines += 1
+        self.stats.paper_mm += LINE_HEIGHT_MM * (2 if self.double_height else 1)
+        self.line_has_text = False
+
+    def _parse(self) -> int:
+        buf = self.buffer
+        size = len(buf)
+        i = 0
+        while i < size:
+            byte = buf[i]
+            if byte == ESC or byte == GS or byte == DLE or byte == FS:
+                queries = len(self.queries)
+                used = self._command(i)
+                if used == 0:
+                    break  # comando incompleto, espera mais bytes
+                if len(self.queries) == queries:
+                    self.has_content = True
+                i += used
+                continue
+            self.has_content = True
+            if byte == 0x0A:
+                self._newline()
+            elif byte >= 0x20:
+                self.stats.text_bytes += 1
+                self.line_has_text = True
+            i += 1
+        return i
+
+    def _command(self, i: int) -> int:
+        buf = self.buffer
+        remaining = len(buf) - i
+        if remaining < 2:
+            return 0
+        prefix, cmd = buf[i], buf[i + 1]
+
+        if prefix == ESC:
+            params = _ESC_PARAMS.get(cmd)
+            if cmd == 0x28:  # ESC ( A etc: ESC ( fn pL pH ...
+                if remaining < 5:
+                    return 0
+                length = buf[i + 3] + buf[i + 4] * 256
+                return 5 + length if remaining >= 5 + length else 0
+            if params is None:
+                self.stats.unknown_commands += 1
+                return 2
+            if remaining < 2 + params:
+                return 0
+            arg = buf[i + 2] if params else 0
+            if cmd == 0x40:
+                self.stats.resets += 1
+                self.double_height = False
+            elif cmd == 0x21:
+                self.double_height = bool(arg & 0x10)
+            elif cmd in (0x69, 0x6D):
+                self._cut()
+            elif cmd == 0x64:
+                self.stats.paper_mm += LINE_HEIGHT_MM * arg
+            elif cmd == 0x4A:
+                self.stats.paper_mm += arg / DOTS_PER_MM
+            return 2 + params
+
+        if prefix == GS:
+            if cmd == 0x76:  # GS v 0 m xL xH yL yH d...
+                if remaining < 8:
+                    return 0
+                width_bytes = buf[i + 4] + buf[i + 5] * 256
+                height = buf[i + 6] + buf[i + 7] * 256
+                total = 8 + width_bytes * height
+                if remaining < total:
+                    return 0
+                self.stats.raster_images += 1
+                self.stats.raster_dots_high += height
+                self.stats.paper_mm += height / DOTS_PER_MM
+                return total
+            if cmd == 0x28:  # GS ( k / GS ( H / ...: GS ( fn pL pH ...
+                if remaining < 5:
+                    return 0
+                length = buf[i + 3] + buf[i + 4] * 256
+                total = 5 + length
+                if remaining < total:
+                    return 0
+                fn = buf[i + 2]
+                if fn == 0x6B and length >= 3 and buf[i + 6] == 0x51:  # imprime QR
+                    self.stats.qr_codes += 1
+                    self.stats.paper_mm += 25.0
+                elif fn == 0x48:
+                    self.queries.append(bytes(buf[i:i + total]))
+                return total
+            if cmd == 0x56:  # GS V m [n]
+                if remaining < 3:
+                    return 0
+                mode = buf[i + 2]
+                length = 4 if mode in (65, 66, 97, 98, 103, 104) else 3
+                if remaining < length:
+                    return 0
+                self._cut()
+                return length
+            params = _GS_PARAMS.get(cmd)
+            if params is None:
+                self.stats.unknown_commands += 1
+                return 2
+            if remaining < 2 + params:
+                return 0
+            if cmd in (0x61, 0x72):
+                self.queries.append(bytes(buf[i:i + 2 + params]))
+            return 2 + params
+
+        if prefix == DLE:
+            if cmd == 0x04:  # DLE EOT n
+                if remaining < 3:
+                    return 0
+                self.queries.append(bytes(buf[i:i + 3]))
+                return 3
+            if cmd == 0x05:  # DLE ENQ n
+                return 3 if remaining >= 3 else 0
+            self.stats.unknown_commands += 1
+            return 2
+
+        # FS: comandos kanji etc. Ignora o par.
+        self.stats.unknown_commands += 1
+        return 2
+
+    def _cut(self) -> None:
+        if self.line_has_text:
+            self._newline()
+        self.stats.cuts += 1
+        self.stats.paper_mm += CUT_FEED_MM
+
+
+def parse_bytes(data: bytes) -> JobStats:
+    stats = JobStats(0)
+    parser = EscPosParser(stats)
+    parser.feed(data)
+    parser.close()
+    stats.status = "parsed"
+    return stats
+
+
+class VirtualPrinter:
+    """
+    Estado da impressora + servidor TCP. Pode ser usado em processo
+    (testes) ou via linha de comando.
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 9100,
+        speed_mm_s: float = 150.0,
+        baud: int = 0,
+        sink_dir: Optional[str] = None,
+        history: int = 500,
+    ):
+        self.host = host
+        self.port = port
+        self.speed_mm_s = speed_mm_s
+        self.baud = baud
+        self.sink_dir = sink_dir
+        self.state = STATE_ONLINE
+        self.jobs: Deque[JobStats] = deque(maxlen=history)
+        self._ids = count(1)
+        self._lock = threading.Lock()
+        # Cabeça de impressão única: jobs são impressos em série
+        self._head_lock = threading.Lock()
+        self._asb_conns = set()
+        self._server: Optional[socket.socket] = None
+        self._stop = threading.Event()
+
+    # -- controle ----------------------------------------------------------
+
+    def set_state(self, state: str) -> None:
+        if state not in STATES:
+            raise ValueError(f"Estado inválido: {state}. Use um de {', '.join(STATES)}.")
+        with self._lock:
+            self.state = state
+            listeners = list(self._asb_conns)
+        print(f"[EMULADOR] Estado: {state}")
+        # ASB: avisa na hora quem estiver conectado
+        for conn in listeners:
+            self._send_asb(conn)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            jobs = [job.to_dict() for job in self.jobs]
+        done = [job for job in jobs if job["status"] == "printed"]
+        return {
+            "state": self.state,
+            "speed_mm_s": self.speed_mm_s,
+            "baud": self.baud,
+            "jobs_total": len(jobs),
+            "jobs_printed": len(done),
+            "jobs_failed": sum(1 for job in jobs if job["status"] == "failed"),
+            "paper_mm": round(sum(job["paper_mm"] for job in done), 1),
+        }
+
+    def job_list(self) -> List[dict]:
+        with self._lock:
+            return [job.to_dict() for job in self.jobs]
+
+    # -- servidor ----------------------------------------------------------
+
+    def start(self) -> "VirtualPrinter":
+        self._server = socket.create_server((self.host, self.port), reuse_port=False)
+        self.port = self._server.getsockname()[1]
+        self._server.settimeout(0.5)
+        threading.Thread(target=self._accept_loop, name="escpos-emulator", daemon=True).start()
+        print(f"[EMULADOR] Impressora virtual em {self.host}:{self.port}")
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._server:
+            self._server.close()
+
+    def _accept_loop(self) -> None:
+        while not self._stop.is_set():
+            try:
+                conn, _ = self._server.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            if self.state == STATE_OFFLINE:
+                conn.close()  # como uma impressora desligada/desconectada
+                continue
+            threading.Thread(target=self._handle_job, args=(conn,), daemon=True).start()
+
+    def _handle_job(self, conn: socket.socket) -> None:
+        stats = JobStats(0)
+        parser = EscPosParser(stats)
+        captured = bytearray() if self.sink_dir else None
+        process_ids: List[bytes] = []
+
+        with conn:
+            try:
+                conn.settimeout(30)
+                while True:
+                    if self.state == STATE_JAM:
+                        # Atolada: para de consumir; o remetente trava no envio
+                        time.sleep(0.05)
+                        continue
+                    chunk = conn.recv(4096)
+                    if not chunk:
+                        break
+                    if self.baud:
+                        time.sleep(len(chunk) * 10.0 / self.baud)
+                    parser.feed(chunk)
+                    self._answer_queries(conn, parser, process_ids)
+                    if parser.has_content and not stats.job_id:
+                        # Conexões só com consultas de status (sondas) não viram job
+                        stats.job_id = next(self._ids)
+                        with self._lock:
+                            self.jobs.append(stats)
+                    if captured is not None:
+                        captured += chunk
+                if not stats.job_id:
+                    return
+                parser.close()
+                stats.transfer_done_at = time.time()
+
+                if self.state != STATE_ONLINE:
+                    raise RuntimeError(self.state)
+                stats.status = "printing"
+                with self._head_lock:
+                    if self.speed_mm_s:
+                        time.sleep(stats.paper_mm / self.speed_mm_s)
+                    if self.state != STATE_ONLINE:
+                        raise RuntimeError(self.state)
+                stats.printed_at = time.time()
+                stats.status = "printed"
+                # GS ( H: confirma só depois de imprimir o que veio antes
+                for process_id in process_ids:
+                    conn.sendall(escpos_status.process_id_response(process_id))
+            except Exception as exc:
+                stats.status = "failed"
+                stats.error = str(exc)
+                self._send_asb(conn)
+            finally:
+                with self._lock:
+                    self._asb_conns.discard(conn)
+
+        if not stats.job_id:
+            return
+        if captured is not None:
+            os.makedirs(self.sink_dir, exist_ok=True)
+            path = os.path.join(self.sink_dir, f"job_{stats.job_id:06d}.bin")
+            with open(path, "wb") as fh:
+                fh.write(captured)
+        print(f"[EMULADOR] Job {stats.job_id}: {stats.status} {stats.bytes} bytes, {stats.paper_mm:0.1f} mm")
+
+    def printer_status(self) -> escpos_status.PrinterStatus:
+        status = escpos_status.PrinterStatus()
+        state = self.state
+        status.paper_end = state == STATE_PAPER_OUT
+        status.cover_open = state == STATE_COVER_OPEN
+        status.autocutter_error = status.error = state == STATE_JAM
+        status.offline = state != STATE_ONLINE
+        return status
+
+    def _send_asb(self, conn: socket.socket) -> None:
+        with self._lock:
+            enabled = conn in self._asb_conns
+        if not enabled:
+            return
+        try:
+            conn.sendall(self.printer_status().to_asb())
+        except OSError:
+            pass
+
+    def _answer_queries(self, conn: socket.socket, parser: EscPosParser, process_ids: List[bytes]) -> None:
+        for query in parser.queries:
+            if query[0] == DLE:  # DLE EOT n: responde na hora
+                conn.sendall(bytes([self.printer_status().to_dle_eot(query[2])]))
+            elif query[1] == 0x61:  # GS a n: liga/desliga ASB e envia o status atual
+                with self._lock:
+                    if query[2] & 0x0F:
+                        self._asb_conns.add(conn)
+                    else:
+                        self._asb_conns.discard(conn)
+                self._send_asb(conn)
+            elif query[1] == 0x28 and query[2] == 0x48 and len(query) >= 11:  # GS ( H fn=48
+                process_ids.append(query[7:11])
+        parser.queries.clear()
+
+
+class _ControlHandler(BaseHTTPRequestHandler):
+    printer: VirtualPrinter = None
+
+    def _reply(self, status: int, payload) -> None:
+        body = json.dumps(payload, indent=2).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/status":
+            return self._reply(200, self.printer.snapshot())
+        if self.path == "/jobs":
+            return self._reply(200, self.printer.job_list())
+        return self._reply(404, {"detail": "not found"})
+
+    def do_POST(self):
+        if self.path.startswith("/state/"):
+            try:
+                self.printer.set_state(self.path.rsplit("/", 1)[1])
+            except ValueError as exc:
+                return self._reply(400, {"detail": str(exc)})
+            return self._reply(200, self.printer.snapshot())
+        return self._reply(404, {"detail": "not found"})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_control_server(printer: VirtualPrinter, host: str, port: int) -> ThreadingHTTPServer:
+    handler = type("ControlHandler", (_ControlHandler,), {"printer": printer})
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, name="escpos-emulator-control", daemon=True).start()
+    print(f"[EMULADOR] Controle HTTP em {host}:{server.server_address[1]}")
+    return server
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Impressora ESC/POS virtual.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--control-port", type=int, default=9180)
+    parser.add_argument("--speed-mm-s", type=float, default=150.0, help="Velocidade de impressão (0 = instantânea).")
+    parser.add_argument("--baud", type=int, default=0, help="Taxa de transferência simulada (0 = sem limite).")
+    parser.add_argument("--sink-dir", help="Grava os bytes de cada job neste diretório.")
+    parser.add_argument("--parse", metavar="ARQUIVO", help="Apenas interpreta um arquivo ESC/POS e sai.")
+    args = parser.parse_args(argv)
+
+    if args.parse:
+        with open(args.parse, "rb") as fh:
+            print(json.dumps(parse_bytes(fh.read()).to_dict(), indent=2))
+        return 0
+
+    printer = VirtualPrinter(args.host, args.port, args.speed_mm_s, args.baud, args.sink_dir).start()
+    start_control_server(printer, args.host, args.control_port)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        printer.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
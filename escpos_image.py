@@ -0,0 +1,242 @@
+"""
+Pipeline de imagem para impressoras ESC/POS.
+
+Converte qualquer imagem (logo, promoções, foto de prato) em comandos
+raster GS v 0, usando NumPy para redimensionar, aplicar limiar/dither e
+empacotar os bits. Imagens altas são emitidas em faixas (várias GS v 0
+seguidas) para que a impressora comece a imprimir antes do fim da imagem
+e a memória por faixa fique limitada.
+"""
+import base64
+import io
+import os
+from typing import Iterator, Optional, Union
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DITHER_THRESHOLD = "threshold"
+DITHER_ORDERED = "ordered"
+DITHER_FLOYD_STEINBERG = "floyd-steinberg"
+DITHER_MODES = (DITHER_THRESHOLD, DITHER_ORDERED, DITHER_FLOYD_STEINBERG)
+
+DEFAULT_MAX_WIDTH_DOTS = int(os.getenv("IMAGE_MAX_WIDTH_DOTS", "512"))
+DEFAULT_BAND_HEIGHT_DOTS = int(os.getenv("IMAGE_BAND_HEIGHT_DOTS", "128"))
+DEFAULT_THRESHOLD = 128
+
+# Matriz de Bayer 8x8 normalizada para 0..255 (dither ordenado)
+_BAYER_2 = np.array([[0, 2], [3, 1]])
+_BAYER_4 = np.block([[4 * _BAYER_2, 4 * _BAYER_2 + 2], [4 * _BAYER_2 + 3, 4 * _BAYER_2 + 1]])
+_BAYER_8 = np.block([[4 * _BAYER_4, 4 * _BAYER_4 + 2], [4 * _BAYER_4 + 3, 4 * _BAYER_4 + 1]])
+BAYER_THRESHOLDS = ((_BAYER_8 + 0.5) * (256.0 / 64.0)).astype(np.float32)
+
+ImageSource = Union[str, bytes, "os.PathLike[str]", np.ndarray]
+
+
+class ImageDecodeError(ValueError):
+    pass
+
+
+def load_grayscale(source: ImageSource) -> np.ndarray:
+    """
+    Abre a imagem (caminho, bytes ou array) e devolve uma matriz float32
+    em escala de cinza (0 = preto, 255 = branco). Transparência vira branco.
+    """
+    if isinstance(source, np.ndarray):
+        gray = source.astype(np.float32)
+        if gray.ndim == 3:
+            gray = gray[..., :3].mean(axis=2)
+        return gray
+
+    try:
+        from PIL import Image
+    except Exception as exc:
+        raise ImageDecodeError("Biblioteca Pillow não instalada.") from exc
+
+    try:
+        if isinstance(source, (bytes, bytearray)):
+            img = Image.open(io.BytesIO(source))
+        else:
+            img = Image.open(source)
+        img.load()
+    except Exception as exc:
+        raise ImageDecodeError(f"Imagem inválida: {exc}") from exc
+
+    if img.mode in ("RGBA", "LA", "P"):
+        img = img.convert("RGBA")
+        rgba = np.asarray(img, dtype=np.float32)
+        alpha = rgba[..., 3:4] / 255.0
+        rgb = rgba[..., :3] * alpha + 255.0 * (1.0 - alpha)
+        return rgb @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+    return np.asarray(img.convert("L"), dtype=np.float32)
+
+
+def decode_base64_image(data: str) -> bytes:
+    """Aceita base64 puro ou data URL (data:image/png;base64,...)."""
+    if data.startswith("data:") and "," in data:
+        data = data.split(",", 1)[1]
+    try:
+        return base64.b64decode(data, validate=False)
+    except Exception as exc:
+        raise ImageDecodeError(f"Base64 inválido: {exc}") from exc
+
+
+def _box_weights(src: int, dst: int) -> np.ndarray:
+    """
+    Matriz (dst x src) de média por área: cada pixel de saída é a média
+    ponderada dos pixels de entrada que ele cobre.
+    """
+    scale = src / float(dst)
+    starts = np.arange(dst, dtype=np.float64) * scale
+    ends = starts + scale
+    edges = np.arange(src + 1, dtype=np.float64)
+    overlap = np.clip(
+        np.minimum(ends[:, None], edges[None, 1:]) - np.maximum(starts[:, None], edges[None, :-1]),
+        0.0,
+        None,
+    )
+    return (overlap / scale).astype(np.float32)
+
+
+def scale_to_width(gray: np.ndarray, max_width: int) -> np.ndarray:
+    """
+    Reduz a imagem para caber em max_width pontos mantendo a proporção.
+    A redução é feita por média de área (duas multiplicações de matriz),
+    o que evita o serrilhado do resize padrão. Imagens menores não são ampliadas.
+    """
+    height, width = gray.shape
+    if width <= max_width:
+        return gray
+    new_height = max(1, int(round(height * max_width / float(width))))
+    rows = _box_weights(height, new_height)
+    cols = _box_weights(width, max_width)
+    return rows @ gray @ cols.T
+
+
+def pad_to_byte_width(gray: np.ndarray) -> np.ndarray:
+    """Completa a largura com branco até um múltiplo de 8 pontos."""
+    width = gray.shape[1]
+    padded = (width + 7) // 8 * 8
+    if padded == width:
+        return gray
+    return np.pad(gray, ((0, 0), (0, padded - width)), constant_values=255.0)
+
+
+def threshold(gray: np.ndarray, level: int = DEFAULT_THRESHOLD) -> np.ndarray:
+    """Retorna máscara booleana: True = ponto preto."""
+    return gray < level
+
+
+def ordered_dither(gray: np.ndarray) -> np.ndarray:
+    height, width = gray.shape
+    reps = (height + 7) // 8, (width + 7) // 8
+    tiles = np.tile(BAYER_THRESHOLDS, reps)[:height, :width]
+    return gray < tiles
+
+
+def floyd_steinberg(gray: np.ndarray, level: int = DEFAULT_THRESHOLD) -> np.ndarray:
+    """
+    Difusão de erro Floyd-Steinberg. O erro para a linha de baixo é
+    propagado de forma vetorizada; só o erro horizontal é sequencial.
+    """
+    work = gray.astype(np.float32).copy()
+    height, width = work.shape
+    out = np.zeros((height, width), dtype=bool)
+
+    for y in range(height):
+        row = work[y].tolist()
+        black = [False] * width
+        errors = [0.0] * width
+        carry = 0.0
+        for x in range(width):
+            value = row[x] + carry
+            is_black = value < level
+            black[x] = is_black
+            err = value - (0.0 if is_black else 255.0)
+            errors[x] = err
+            carry = err * (7.0 / 16.0)
+        out[y] = black
+        if y + 1 < height:
+            err = np.asarray(errors, dtype=np.float32)
+            below = err * (5.0 / 16.0)
+            below[:-1] += err[1:] * (3.0 / 16.0)  # abaixo à esquerda
+            below[1:] += err[:-1] * (1.0 / 16.0)  # abaixo à direita
+            work[y + 1] += below
+
+    return out
+
+
+def to_mask(gray: np.ndarray, dither: str = DITHER_THRESHOLD, level: int = DEFAULT_THRESHOLD) -> np.ndarray:
+    if dither == DITHER_THRESHOLD:
+        return threshold(gray, level)
+    if dither == DITHER_ORDERED:
+        return ordered_dither(gray)
+    if dither == DITHER_FLOYD_STEINBERG:
+        return floyd_steinberg(gray, level)
+    raise ValueError(f"Dither desconhecido: {dither}. Use um de {', '.join(DITHER_MODES)}.")
+
+
+def pack_rows(mask: np.ndarray) -> bytes:
+    """Empacota a máscara (largura múltipla de 8) em bytes MSB-first."""
+    return np.packbits(mask, axis=1).tobytes()
+
+
+def raster_header(width_dots: int, height_dots: int) -> bytes:
+    row_bytes = width_dots // 8
+    return b"\x1D\x76\x30\x00" + bytes(
+        [row_bytes % 256, row_bytes // 256, height_dots % 256, height_dots // 256]
+    )
+
+
+def iter_raster_bands(mask: np.ndarray, band_height: int = DEFAULT_BAND_HEIGHT_DOTS) -> Iterator[bytes]:
+    """
+    Gera um comando GS v 0 por faixa horizontal de até band_height linhas.
+    """
+    height, width = mask.shape
+    band_height = max(1, int(band_height))
+    for top in range(0, height, band_height):
+        band = mask[top:top + band_height]
+        yield raster_header(width, band.shape[0]) + pack_rows(band)
+
+
+def prepare_mask(
+    source: ImageSource,
+    max_width: int = DEFAULT_MAX_WIDTH_DOTS,
+    dither: str = DITHER_THRESHOLD,
+    level: int = DEFAULT_THRESHOLD,
+) -> np.ndarray:
+    gray = load_grayscale(source)
+    gray = scale_to_width(gray, max_width)
+    gray = pad_to_byte_width(gray)
+    return to_mask(gray, dither, level)
+
+
+def iter_image_escpos(
+    source: ImageSource,
+    max_width: int = DEFAULT_MAX_WIDTH_DOTS,
+    dither: str = DITHER_THRESHOLD,
+    band_height: int = DEFAULT_BAND_HEIGHT_DOTS,
+    level: int = DEFAULT_THRESHOLD,
+) -> Iterator[bytes]:
+    mask = prepare_mask(source, max_width, dither, level)
+    return iter_raster_bands(mask, band_height)
+
+
+def image_to_escpos(
+    source: ImageSource,
+    max_width: int = DEFAULT_MAX_WIDTH_DOTS,
+    dither: str = DITHER_THRESHOLD,
+    band_height: Optional[int] = DEFAULT_BAND_HEIGHT_DOTS,
+    level: int = DEFAULT_THRESHOLD,
+) -> bytes:
+    """
+    Converte a imagem inteira em bytes ESC/POS. band_height=None emite
+    um único GS v 0 (comportamento antigo do logo).
+    """
+    mask = prepare_mask(source, max_width, dither, level)
+    if band_height is None:
+        band_height = mask.shape[0]
+    return b"".join(iter_raster_bands(mask, band_height))
@@ -0,0 +1,196 @@
+"""
+Status em tempo real da impressora pelo próprio canal ESC/POS.
+
+- DLE EOT n (n = 1..4): consulta de status em tempo real, 1 byte de resposta.
+- GS a n: Automatic Status Back (ASB); a impressora envia 4 bytes sempre
+  que o status muda (papel, tampa, erro, online/offline).
+- GS ( H fn=48: pede um "process ID"; a impressora responde
+  `37 22 d1 d2 d3 d4 00` só depois de imprimir tudo o que veio antes,
+  o que confirma que o job saiu de fato.
+
+Usado pelo backend TCP do spooler e respondido pelo emulador.
+"""
+from typing import List, Optional, Tuple
+
+DLE_EOT = b"\x10\x04"
+PROCESS_ID_HEADER = b"\x37\x22"
+
+# GS a n: bit1 online/offline, bit2 erro, bit3 sensor de papel
+ASB_MASK = 0x0E
+
+
+def dle_eot(n: int) -> bytes:
+    return DLE_EOT + bytes([n])
+
+
+QUERY_ALL = dle_eot(1) + dle_eot(2) + dle_eot(3) + dle_eot(4)
+
+
+def enable_asb(mask: int = ASB_MASK) -> bytes:
+    return b"\x1D\x61" + bytes([mask])
+
+
+def process_id_request(process_id: bytes) -> bytes:
+    """GS ( H pL pH fn m d1..d4 com fn=48, m=48."""
+    if len(process_id) != 4:
+        raise ValueError("Process ID deve ter 4 bytes.")
+    return b"\x1D\x28\x48\x06\x00\x30\x30" + process_id
+
+
+def process_id_response(process_id: bytes) -> bytes:
+    return PROCESS_ID_HEADER + process_id + b"\x00"
+
+
+def make_process_id(counter: int) -> bytes:
+    # d1..d4 em ASCII '0'..'9' (faixa aceita pelas Epson TM)
+    return f"{counter % 10000:04d}".encode("ascii")
+
+
+class PrinterStatus:
+    __slots__ = ("offline", "cover_open", "paper_end", "paper_near_end", "error", "autocutter_error", "unrecoverable")
+
+    def __init__(self):
+        self.offline = False
+        self.cover_open = False
+        self.paper_end = False
+        self.paper_near_end = False
+        self.error = False
+        self.autocutter_error = False
+        self.unrecoverable = False
+
+    @property
+    def ready(self) -> bool:
+        return not (self.offline or self.cover_open or self.paper_end or self.error)
+
+    def problem(self) -> Optional[str]:
+        if self.paper_end:
+            return "sem papel"
+        if self.cover_open:
+            return "tampa aberta"
+        if self.autocutter_error:
+            return "erro na guilhotina"
+        if self.unrecoverable:
+            return "erro irrecuperável"
+        if self.error:
+            return "erro na impressora"
+        if self.offline:
+            return "impressora offline"
+        return None
+
+    def to_dict(self) -> dict:
+        data = {name: getattr(self, name) for name in self.__slots__}
+        data["ready"] = self.ready
+        return data
+
+    # -- respostas DLE EOT ---------------------------------------------------
+
+    def apply_dle_eot(self, n: int, value: int) -> None:
+        if n == 1:
+            self.offline = bool(value & 0x08)
+        elif n == 2:
+            self.cover_open = bool(value & 0x04)
+            self.paper_end = self.paper_end or bool(value & 0x20)
+            self.error = bool(value & 0x40)
+        elif n == 3:
+            self.autocutter_error = bool(value & 0x08)
+            self.unrecoverable = bool(value & 0x20)
+            self.error = self.error or bool(value & 0x48)
+        elif n == 4:
+            self.paper_near_end = bool(value & 0x0C)
+            self.paper_end = bool(value & 0x60)
+
+    def to_dle_eot(self, n: int) -> int:
+        value = 0x12  # bits fixos 1 e 4
+        if n == 1 and self.offline:
+            value |= 0x08
+        elif n == 2:
+            value |= (0x04 if self.cover_open else 0) | (0x20 if self.paper_end else 0) | (0x40 if self.error else 0)
+        elif n == 3:
+            value |= (0x08 if self.autocutter_error else 0) | (0x20 if self.unrecoverable else 0)
+        elif n == 4:
+            value |= (0x0C if self.paper_near_end else 0) | (0x60 if self.paper_end else 0)
+        return value
+
+    # -- ASB -----------------------------------------------------------------
+
+    def apply_asb(self, data: bytes) -> None:
+        b1, b2, b3 = data[0], data[1], data[2]
+        self.offline = bool(b1 & 0x08)
+        self.cover_open = bool(b1 & 0x20)
+        self.autocutter_error = bool(b2 & 0x08)
+        self.unrecoverable = bool(b2 & 0x20)
+        self.error = bool(b2 & 0x6C)
+        self.paper_near_end = bool(b3 & 0x03)
+        self.paper_end = bool(b3 & 0x0C)
+
+    def to_asb(self) -> bytes:
+        b1 = 0x10 | (0x08 if self.offline else 0) | (0x20 if self.cover_open else 0)
+        b2 = (0x08 if self.autocutter_error else 0) | (0x20 if self.unrecoverable else 0) | (0x40 if self.error else 0)
+        b3 = (0x03 if self.paper_near_end else 0) | (0x0C if self.paper_end else 0)
+        return bytes([b1, b2, b3, 0x0F])
+
+
+def _is_asb_first(byte: int) -> bool:
+    return (byte & 0x93) == 0x10
+
+
+def _is_dle_eot(byte: int) -> bool:
+    return (byte & 0x93) == 0x12
+
+
+class StatusReader:
+    """
+    Interpreta o fluxo de volta da impressora, que mistura respostas de
+    DLE EOT (1 byte), blocos ASB (4 bytes) e respostas de process ID.
+    As respostas de DLE EOT são associadas às consultas em ordem.
+    """
+
+    def __init__(self):
+        self.status = PrinterStatus()
+        self.buffer = bytearray()
+        self.pending_queries: List[int] = []
+        self.completed_ids: List[bytes] = []
+        self.asb_received = 0
+
+    def expect(self, queries: bytes) -> None:
+        for i in range(0, len(queries) - 2, 3):
+            if queries[i:i + 2] == DLE_EOT:
+                self.pending_queries.append(queries[i + 2])
+
+    def feed(self, data: bytes) -> None:
+        self.buffer += data
+        buf = self.buffer
+        i = 0
+        while i < len(buf):
+            byte = buf[i]
+            if buf[i:i + 2] == PROCESS_ID_HEADER:
+                end = buf.find(b"\x00", i + 2)
+                if end < 0:
+                    break
+                self.completed_ids.append(bytes(buf[i + 2:end]))
+                i = end + 1
+            elif self.pending_queries and _is_dle_eot(byte):
+                self.status.apply_dle_eot(self.pending_queries.pop(0), byte)
+                i += 1
+            elif _is_asb_first(byte):
+                if len(buf) - i < 4:
+                    break
+                self.status.apply_asb(bytes(buf[i:i + 4]))
+                self.asb_received += 1
+                i += 4
+            elif byte == 0x37 and i + 1 == len(buf):
+                break  # pode ser o início de uma resposta de process ID
+            else:
+                i += 1  # byte desconhecido
+        del buf[:i]
+
+    @property
+    def complete(self) -> bool:
+        return not self.pending_queries
+
+
+def parse_query_responses(queries: bytes, data: bytes) -> Tuple[PrinterStatus, bool]:
+    reader = StatusReader()
+    reader.expect(queries)
+    reader.feed(data)
+    return reader.status, reader.complete
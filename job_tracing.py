@@ -0,0 +1,241 @@
+"""
+Rastreamento por job de impressão.
+
+Cada requisição /print-* abre um trace com spans (recebimento, validação,
+checagem offline, render, logo, QR e cada chamada ao spooler). Traces
+finalizados vão para um ring buffer em memória consultado em /debug/jobs,
+com exportação opcional no formato JSON do OpenTelemetry (OTLP).
+
+Fora de um trace, span() não faz nada, então o custo sem instrumentação é
+só a leitura de um ContextVar.
+"""
+import os
+import secrets
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+JOB_TRACE_BUFFER = int(os.getenv("JOB_TRACE_BUFFER", "500"))
+SERVICE_NAME = "galley-ops-driver"
+
+_current_trace: ContextVar[Optional["Trace"]] = ContextVar("job_trace", default=None)
+_current_span: ContextVar[Optional["Span"]] = ContextVar("job_span", default=None)
+
+_buffer: Deque["Trace"] = deque(maxlen=JOB_TRACE_BUFFER)
+_buffer_lock = threading.Lock()
+
+
+def _now_ns() -> int:
+    return time.time_ns()
+
+
+class Span:
+    __slots__ = ("span_id", "parent_id", "name", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, name: str, parent_id: Optional[str], start_ns: Optional[int] = None, **attributes):
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.start_ns = start_ns or _now_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes: Dict[str, Any] = attributes
+        self.error: Optional[str] = None
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.end_ns or _now_ns()
+        return (end - self.start_ns) / 1e6
+
+    def to_dict(self) -> dict:
+        return {
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_ns": self.start_ns,
+            "duration_ms": round(self.duration_ms, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class Trace:
+    def __init__(self, name: str, start_ns: Optional[int] = None, **attributes):
+        self.trace_id = secrets.token_hex(16)
+        self.root = Span(name, None, start_ns, **attributes)
+        self.spans: List[Span] = [self.root]
+        self.status = "running"
+        self._lock = threading.Lock()
+
+    @property
+    def attributes(self) -> Dict[str, Any]:
+        return self.root.attributes
+
+    @property
+    def duration_ms(self) -> float:
+        return self.root.duration_ms
+
+    def add(self, span: Span) -> None:
+        with self._lock:
+            self.spans.append(span)
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            spans = [span.to_dict() for span in self.spans]
+        return {
+            "trace_id": self.trace_id,
+            "name": self.root.name,
+            "status": self.status,
+            "started_at": self.root.start_ns / 1e9,
+            "duration_ms": round(self.duration_ms, 3),
+            "attributes": self.root.attributes,
+            "error": self.root.error,
+            "spans": spans,
+        }
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+@contextmanager
+def start_trace(name: str, start_ns: Optional[int] = None, **attributes):
+    """Abre um trace para o job atual e o guarda no ring buffer ao final."""
+    trace = Trace(name, start_ns, **attributes)
+    trace_token = _current_trace.set(trace)
+    span_token = _current_span.set(trace.root)
+    try:
+        yield trace
+        if trace.status == "running":
+            trace.status = "ok"
+    except BaseException as exc:
+        trace.status = "error"
+        trace.root.error = str(exc) or exc.__class__.__name__
+        raise
+    finally:
+        trace.root.end_ns = _now_ns()
+        _current_span.reset(span_token)
+        _current_trace.reset(trace_token)
+        with _buffer_lock:
+            _buffer.append(trace)
+
+
+@contextmanager
+def _span(trace: Trace, name: str, attributes: Dict[str, Any]):
+    parent = _current_span.get()
+    span = Span(name, parent.span_id if parent else None, **attributes)
+    trace.add(span)
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as exc:
+        span.error = str(exc) or exc.__class__.__name__
+        raise
+    finally:
+        span.end_ns = _now_ns()
+        _current_span.reset(token)
+
+
+def span(name: str, **attributes):
+    trace = _current_trace.get()
+    if trace is None:
+        return nullcontext()
+    return _span(trace, name, attributes)
+
+
+def record_span(name: str, start_ns: int, end_ns: Optional[int] = None, **attributes) -> None:
+    """Registra um span já medido (ex.: validação, que acontece antes do handler)."""
+    trace = _current_trace.get()
+    if trace is None:
+        return
+    parent = _current_span.get()
+    recorded = Span(name, parent.span_id if parent else None, start_ns, **attributes)
+    recorded.end_ns = end_ns or _now_ns()
+    trace.add(recorded)
+
+
+def set_attributes(**attributes) -> None:
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.root.attributes.update(attributes)
+
+
+def recent(
+    printer: Optional[str] = None,
+    table: Optional[int] = None,
+    min_ms: Optional[float] = None,
+    limit: int = 100,
+) -> List[Trace]:
+    with _buffer_lock:
+        traces = list(_buffer)
+    selected = []
+    for trace in reversed(traces):
+        attrs = trace.attributes
+        if printer is not None and attrs.get("printer") != printer:
+            continue
+        if table is not None and str(attrs.get("table")) != str(table):
+            continue
+        if min_ms is not None and trace.duration_ms < min_ms:
+            continue
+        selected.append(trace)
+        if len(selected) >= limit:
+            break
+    return selected
+
+
+def find(trace_id: str) -> Optional[Trace]:
+    with _buffer_lock:
+        for trace in _buffer:
+            if trace.trace_id == trace_id:
+                return trace
+    return None
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": "" if value is None else str(value)}
+
+
+def _otlp_attributes(attributes: Dict[str, Any]) -> List[dict]:
+    return [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items()]
+
+
+def to_otlp(traces: List[Trace]) -> dict:
+    """Converte para o JSON de ExportTraceServiceRequest do OpenTelemetry."""
+    spans = []
+    for trace in traces:
+        with trace._lock:
+            trace_spans = list(trace.spans)
+        for item in trace_spans:
+            otlp_span = {
+                "traceId": trace.trace_id,
+                "spanId": item.span_id,
+                "name": item.name,
+                "kind": 2 if item.parent_id is None else 1,  # SERVER / INTERNAL
+                "startTimeUnixNano": str(item.start_ns),
+                "endTimeUnixNano": str(item.end_ns or _now_ns()),
+                "attributes": _otlp_attributes(item.attributes),
+                "status": {"code": 2, "message": item.error} if item.error else {"code": 1},
+            }
+            if item.parent_id:
+                otlp_span["parentSpanId"] = item.parent_id
+            spans.append(otlp_span)
+    return {
+        "resourceSpans": [
+            {
+                "resource": {"attributes": _otlp_attributes({"service.name": SERVICE_NAME})},
+                "scopeSpans": [{"scope": {"name": "job_tracing"}, "spans": spans}],
+            }
+        ]
+    }
@@ -0,0 +1,201 @@
+"""
+Saída para telas de cozinha (KDS) em paralelo às comandas de papel.
+
+Cada comanda da copa/cozinha vira um evento estruturado publicado num
+pub/sub em memória, por departamento. As telas assinam via Server-Sent
+Events em /kds/{department}/stream.
+
+- Cada comanda é publicada uma vez por mudança, independente do papel:
+  a tela guarda o próprio estado por pedido (order_state, chave
+  "kds:<departamento>"). Um reenvio do POS depois de uma impressão com
+  falha não duplica o evento e a tela recebe mesmo com a impressora offline.
+- Cada departamento guarda os últimos KDS_HISTORY eventos; quem reconecta
+  com `Last-Event-ID` recebe o que perdeu.
+- Cada assinante tem um buffer limitado (KDS_SUBSCRIBER_BUFFER). Publicar
+  nunca bloqueia: se a tela não acompanha, a conexão dela é encerrada e o
+  EventSource reconecta pelo último id, sem segurar a impressão.
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import deque
+from itertools import count
+from typing import AsyncIterator, Deque, Dict, List, Optional, Set
+
+from dotenv import load_dotenv
+
+import order_state
+
+load_dotenv()
+
+KDS_HISTORY = int(os.getenv("KDS_HISTORY", "200"))
+KDS_SUBSCRIBER_BUFFER = int(os.getenv("KDS_SUBSCRIBER_BUFFER", "100"))
+KDS_KEEPALIVE_SECONDS = float(os.getenv("KDS_KEEPALIVE_SECONDS", "15"))
+
+DEPARTMENTS = ("kitchen", "bar")
+
+
+class KdsEvent:
+    __slots__ = ("event_id", "department", "data")
+
+    def __init__(self, event_id: int, department: str, data: dict):
+        self.event_id = event_id
+        self.department = department
+        self.data = data
+
+    def encode(self) -> bytes:
+        payload = json.dumps(self.data, ensure_ascii=False, separators=(",", ":"))
+        return f"id: {self.event_id}\nevent: {self.data['type']}\ndata: {payload}\n\n".encode("utf-8")
+
+
+class Subscriber:
+    def __init__(self, department: str, loop: asyncio.AbstractEventLoop):
+        self.department = department
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=KDS_SUBSCRIBER_BUFFER)
+        self.dropped = False
+
+    def offer(self, event: Optional[KdsEvent]) -> None:
+        # Roda no loop do assinante
+        if self.dropped:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Tela lenta: descarta o buffer e encerra; ela reconecta pelo Last-Event-ID
+            self.dropped = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+
+class KdsBroker:
+    def __init__(self, history: int = KDS_HISTORY):
+        self._ids = count(1)
+        self._history: Dict[str, Deque[KdsEvent]] = {dep: deque(maxlen=history) for dep in DEPARTMENTS}
+        self._subscribers: Dict[str, Set[Subscriber]] = {dep: set() for dep in DEPARTMENTS}
+        self._lock = threading.Lock()
+        self.published = 0
+        self.dropped_subscribers = 0
+
+    def publish(self, department: str, data: dict) -> Optional[KdsEvent]:
+        """Thread-safe e não bloqueante; chamado pelos módulos de impressão."""
+        if department not in self._history:
+            return None
+        with self._lock:
+            event = KdsEvent(next(self._ids), department, data)
+            self._history[department].append(event)
+            subscribers = list(self._subscribers[department])
+            self.published += 1
+        for subscriber in subscribers:
+            try:
+                subscriber.loop.call_soon_threadsafe(subscriber.offer, event)
+            except RuntimeError:
+                pass  # loop encerrado
+        return event
+
+    def subscribe(self, department: str, last_event_id: Optional[int] = None) -> Subscriber:
+        subscriber = Subscriber(department, asyncio.get_running_loop())
+        with self._lock:
+            self._subscribers[department].add(subscriber)
+            missed = [event for event in self._history[department] if last_event_id is not None and event.event_id > last_event_id]
+        for event in missed[-(KDS_SUBSCRIBER_BUFFER - 1):]:
+            subscriber.offer(event)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        with self._lock:
+            self._subscribers[subscriber.department].discard(subscriber)
+            if subscriber.dropped:
+                self.dropped_subscribers += 1
+
+    def history(self, department: str, since: Optional[int] = None) -> List[dict]:
+        with self._lock:
+            events = list(self._history.get(department, ()))
+        return [
+            {"id": event.event_id, **event.data}
+            for event in events
+            if since is None or event.event_id > since
+        ]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "published": self.published,
+                "dropped_subscribers": self.dropped_subscribers,
+                "subscribers": {dep: len(subs) for dep, subs in self._subscribers.items()},
+            }
+
+
+broker = KdsBroker()
+_publish_lock = threading.Lock()
+
+
+def ticket_event(order_data: dict, department: str, ticket: str, lines: List[dict]) -> dict:
+    """Mesmos dados que imprimir_cozinha/imprimir_copa percorrem, em JSON."""
+    return {
+        "type": "ticket",
+        "ticket": ticket,
+        "department": department,
+        "order_id": order_data.get("id"),
+        "table_number": order_data.get("table_number"),
+        "is_outside": bool(order_data.get("is_outside")),
+        "waiter": order_data.get("waiter"),
+        "date_time": order_data.get("date_time"),
+        "order_note": order_data.get("order_note") or "",
+        "items": lines,
+        "published_at": time.time(),
+    }
+
+
+def publish_ticket(order_data: dict, department: str, order_dishes, delta: Optional[List[dict]] = None) -> None:
+    if delta is not None:
+        lines = delta
+        ticket = "delta"
+    else:
+        lines = [
+            {
+                "dish_name": order_dish["dish"]["dish_name"],
+                "amount": order_dish["amount"],
+                "dish_note": order_dish.get("dish_note"),
+            }
+            for order_dish in order_dishes
+        ]
+        ticket = "full"
+    broker.publish(department, ticket_event(order_data, department, ticket, lines))
+
+
+def publish_order(order_data: dict, department: str, order_dishes) -> Optional[str]:
+    """
+    Publica o que mudou no pedido desde o último evento deste departamento
+    (comanda completa na primeira vez). Devolve o tipo publicado ou None.
+    """
+    state_key = f"kds:{department}"
+    order_id = order_data.get("id")
+    with _publish_lock:
+        delta = order_state.diff(state_key, order_id, order_dishes)
+        if delta == [] or (delta is None and not order_dishes):
+            return None
+        publish_ticket(order_data, department, order_dishes, delta)
+        order_state.commit(state_key, order_id, order_dishes)
+    return "full" if delta is None else "delta"
+
+
+async def stream(department: str, last_event_id: Optional[int] = None) -> AsyncIterator[bytes]:
+    """Corpo SSE: eventos perdidos, depois eventos novos e comentários de keep-alive."""
+    subscriber = broker.subscribe(department, last_event_id)
+    try:
+        yield f"retry: 1000\n: kds {department}\n\n".encode("utf-8")
+        while True:
+            try:
+                event = await asyncio.wait_for(subscriber.queue.get(), KDS_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield b": keep-alive\n\n"
+                continue
+            if event is None:
+                return
+            yield event.encode()
+    finally:
+        broker.unsubscribe(subscriber)
@@ -0,0 +1,408 @@
+"""
+Gerador de carga que simula um rush de jantar contra a API.
+
+Por padrão roda tudo no mesmo processo: importa `main:app` com o spooler
+em memória (PRINTER_BACKEND=stub) e chama o app via ASGI, sem rede nem
+impressora; com --emulator os jobs vão para `escpos_emulator.py` via TCP.
+Com --url envia HTTP para uma instância já rodando (que pode estar
+apontada para um emulador local).
+
+As chegadas são em malha aberta (Poisson): a latência é medida a partir do
+instante agendado da requisição, então fila acumulada aparece no p99.
+
+Exemplos:
+    python loadgen.py --rate 120 --duration 60
+    python loadgen.py --mix bar=3,kitchen=5,bill=2,dashboard=0 --burst-factor 4
+    python loadgen.py --ramp 60,120,240,480 --stage-seconds 20 --slo-p99-ms 500
+    python loadgen.py --emulator 127.0.0.1:9100 --rate 60
+    python loadgen.py --url http://localhost:8000 --rate 60
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import sys
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+ENDPOINTS = {
+    "bar": "/print-bar",
+    "kitchen": "/print-kitchen",
+    "bill": "/print-bill",
+    "dashboard": "/print-dashboard-service-fee",
+}
+
+MENU = {
+    "bar": [
+        ("Cerveja", 9.5), ("Caipirinha", 22.0), ("Suco de Laranja", 11.0),
+        ("Refrigerante", 7.0), ("Agua com gas", 5.5), ("Vinho taça", 28.0),
+    ],
+    "kitchen": [
+        ("Hamburguer", 28.0), ("Pizza Margherita", 54.0), ("File à parmegiana", 62.0),
+        ("Risoto de cogumelos", 58.0), ("Batata frita", 24.0), ("Salada Caesar", 32.0),
+        ("Moqueca de peixe", 89.0), ("Pudim", 16.0),
+    ],
+}
+NOTES = [None, None, None, "sem cebola", "bem passado", "sem gelo", "para viagem"]
+WAITERS = ["Joao", "Maria", "Ana", "Carlos"]
+
+
+class PayloadFactory:
+    def __init__(self, dishes_min: int, dishes_max: int, seed: Optional[int] = None):
+        self.dishes_min = dishes_min
+        self.dishes_max = dishes_max
+        self.random = random.Random(seed)
+        self.next_id = 1
+
+    def _order_base(self) -> dict:
+        order_id = self.next_id
+        self.next_id += 1
+        now = datetime.now().strftime("%Y-%m-%dT%H:%M:%S.000Z")
+        return {
+            "id": order_id,
+            "date_time": now,
+            "table_number": self.random.randint(1, 40),
+            "order_note": self.random.choice(["", "", "aniversario"]),
+            "waiter": self.random.choice(WAITERS),
+            "is_outside": self.random.random() < 0.15,
+        }
+
+    def _dishes(self, departments, with_price: bool) -> List[dict]:
+        dishes = []
+        for _ in range(self.random.randint(self.dishes_min, self.dishes_max)):
+            department = self.random.choice(departments)
+            name, price = self.random.choice(MENU[department])
+            dish = {
+                "dish": {"dish_name": name, "department": department},
+                "amount": self.random.choice([1, 1, 1, 2, 3, 0.5, 1.5]),
+                "dish_note": self.random.choice(NOTES),
+            }
+            if with_price:
+                dish["unit_price"] = price
+            dishes.append(dish)
+        return dishes
+
+    def order(self, department: str) -> dict:
+        payload = self._order_base()
+        payload["order_dishes"] = self._dishes([department], with_price=False)
+        return payload
+
+    def bill(self) -> dict:
+        payload = self._order_base()
+        payload["order_dishes"] = self._dishes(["bar", "kitchen"], with_price=True)
+        subtotal = sum(d["amount"] * d["unit_price"] for d in payload["order_dishes"])
+        service = round(subtotal * 0.1, 2)
+        payload.update({
+            "company_name": "Restaurante Exemplo LTDA",
+            "company_address": "Rua das Flores, 123 - Centro - Cidade/UF",
+            "company_cnpj": "00.000.000/0001-00",
+            "company_ie": "123456789",
+            "subtotal": round(subtotal, 2),
+            "service_fee": service,
+            "final_value": round(subtotal + service, 2),
+            "access_key_url": "https://sat.sef.sc.gov.br/nfce/consulta",
+            "access_key": "".join(self.random.choice("0123456789") for _ in range(44)),
+            "qr_url": "https://sat.sef.sc.gov.br/nfce/consulta?p="
+            + "".join(self.random.choice("0123456789") for _ in range(44)) + "|2|1|1|ABCDEF",
+            "nfce_number": str(payload["id"]),
+            "nfce_series": "1",
+            "emission_datetime": payload["date_time"],
+            "authorization_protocol": "242251682270691",
+            "authorization_datetime": payload["date_time"],
+        })
+        return payload
+
+    def dashboard(self) -> dict:
+        days = self.random.choice([1, 7, 30, 365])
+        end = datetime.now().date()
+        start = end - timedelta(days=days - 1)
+        breakdown = [
+            {
+                "date": (start + timedelta(days=i)).isoformat(),
+                "total_additions": round(self.random.uniform(100, 900), 2),
+                "total_tables": self.random.randint(5, 60),
+            }
+            for i in range(days)
+        ]
+        return {
+            "start_date": start.isoformat(),
+            "end_date": end.isoformat(),
+            "total_additions": round(sum(d["total_additions"] for d in breakdown), 2),
+            "total_tables": sum(d["total_tables"] for d in breakdown),
+            "daily_breakdown": breakdown,
+            "printed_by": "loadgen",
+        }
+
+    def build(self, kind: str) -> dict:
+        if kind in ("bar", "kitchen"):
+            return self.order(kind)
+        if kind == "bill":
+            return self.bill()
+        return self.dashboard()
+
+
+# ---------------------------------------------------------------------------
+# Clientes
+# ---------------------------------------------------------------------------
+
+class AsgiClient:
+    """Chama o app ASGI diretamente (sem socket)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def post(self, path: str, payload: dict) -> int:
+        body = json.dumps(payload).encode("utf-8")
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": "POST",
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": b"",
+            "root_path": "",
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+            ],
+            "client": ("127.0.0.1", 0),
+            "server": ("loadgen", 80),
+        }
+        sent = False
+        status = 0
+
+        async def receive():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            await asyncio.sleep(3600)
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+
+        await self.app(scope, receive, send)
+        return status
+
+
+class HttpClient:
+    def __init__(self, base_url: str, timeout: float = 30.0):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+    def _post_blocking(self, path: str, payload: dict) -> int:
+        request = urllib.request.Request(
+            self.base_url + path,
+            data=json.dumps(payload).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as exc:
+            return exc.code
+        except Exception:
+            return 0
+
+    async def post(self, path: str, payload: dict) -> int:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._post_blocking, path, payload)
+
+
+# ---------------------------------------------------------------------------
+# Execução e relatório
+# ---------------------------------------------------------------------------
+
+def parse_mix(value: str) -> Dict[str, float]:
+    mix = {}
+    for part in value.split(","):
+        if not part.strip():
+            continue
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise argparse.ArgumentTypeError(f"Endpoint desconhecido no mix: {name}")
+        mix[name] = float(weight or 1)
+    if not any(mix.values()):
+        raise argparse.ArgumentTypeError("Mix sem nenhum peso positivo.")
+    return mix
+
+
+def rate_at(elapsed: float, base_rate: float, args) -> float:
+    """Taxa (req/min) no instante: base com rajadas periódicas."""
+    if args.burst_every > 0 and (elapsed % args.burst_every) < args.burst_length:
+        return base_rate * args.burst_factor
+    return base_rate
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    # Nearest-rank: ceil(p/100 * n)-ésimo valor (1-based)
+    index = min(len(sorted_values) - 1, max(0, math.ceil(pct * len(sorted_values) / 100.0) - 1))
+    return sorted_values[index]
+
+
+async def run_stage(client, factory: PayloadFactory, base_rate: float, duration: float, args) -> Tuple[dict, float]:
+    kinds = [k for k, w in args.mix.items() if w > 0]
+    weights = [args.mix[k] for k in kinds]
+    results: Dict[str, List[Tuple[float, int]]] = {k: [] for k in kinds}
+    semaphore = asyncio.Semaphore(args.concurrency)
+    rng = random.Random(args.seed)
+    tasks = []
+
+    async def fire(kind: str, scheduled: float):
+        payload = factory.build(kind)
+        async with semaphore:
+            status = await client.post(ENDPOINTS[kind], payload)
+        results[kind].append((time.perf_counter() - scheduled, status))
+
+    start = time.perf_counter()
+    next_at = start
+    while True:
+        rate = rate_at(next_at - start, base_rate, args)
+        next_at += rng.expovariate(rate / 60.0)
+        if next_at - start >= duration:
+            break
+        delay = next_at - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        kind = rng.choices(kinds, weights)[0]
+        tasks.append(asyncio.ensure_future(fire(kind, next_at)))
+
+    if tasks:
+        await asyncio.gather(*tasks)
+    return results, time.perf_counter() - start
+
+
+def summarize(results: dict, elapsed: float) -> dict:
+    report = {}
+    all_latencies = []
+    for kind, samples in results.items():
+        latencies = sorted(lat for lat, _ in samples)
+        errors = sum(1 for _, status in samples if not 200 <= status < 300)
+        all_latencies.extend(latencies)
+        report[kind] = {
+            "requests": len(samples),
+            "errors": errors,
+            "per_min": len(samples) / elapsed * 60.0 if elapsed else 0.0,
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p95_ms": percentile(latencies, 95) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000,
+            "max_ms": (latencies[-1] * 1000) if latencies else 0.0,
+        }
+    all_latencies.sort()
+    report["total"] = {
+        "requests": len(all_latencies),
+        "errors": sum(r["errors"] for r in report.values()),
+        "per_min": len(all_latencies) / elapsed * 60.0 if elapsed else 0.0,
+        "p50_ms": percentile(all_latencies, 50) * 1000,
+        "p95_ms": percentile(all_latencies, 95) * 1000,
+        "p99_ms": percentile(all_latencies, 99) * 1000,
+        "max_ms": (all_latencies[-1] * 1000) if all_latencies else 0.0,
+    }
+    return report
+
+
+def print_report(title: str, report: dict, slo_p99_ms: Optional[float]) -> bool:
+    print(f"\n== {title} ==")
+    print(f"{'endpoint':<10} {'req':>6} {'err':>5} {'req/min':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for kind, row in report.items():
+        print(
+            f"{kind:<10} {row['requests']:>6} {row['errors']:>5} {row['per_min']:>9.1f} "
+            f"{row['p50_ms']:>9.1f} {row['p95_ms']:>9.1f} {row['p99_ms']:>9.1f} {row['max_ms']:>9.1f}"
+        )
+    if slo_p99_ms is None:
+        return True
+    ok = report["total"]["p99_ms"] <= slo_p99_ms and report["total"]["errors"] == 0
+    print(f"SLO p99 <= {slo_p99_ms:.0f} ms: {'OK' if ok else 'VIOLADO'}")
+    return ok
+
+
+def build_client(args):
+    if args.url:
+        return HttpClient(args.url)
+
+    # Modo local: spooler em memória (ou emulador TCP) e nomes de impressora fictícios
+    if args.emulator:
+        os.environ["PRINTER_BACKEND"] = "tcp"
+        os.environ["PRINTER_TCP_DEFAULT"] = args.emulator
+    else:
+        os.environ["PRINTER_BACKEND"] = "stub"
+    os.environ["STUB_PRINTER_BYTES_PER_SEC"] = str(args.printer_bytes_per_sec)
+    os.environ["STUB_PRINTER_JOB_MS"] = str(args.printer_job_ms)
+    for env_name in ("BAR_PRINTER", "KITCHEN_PRINTER", "BILL_PRINTER", "REPORT_PRINTER"):
+        os.environ.setdefault(env_name, f"STUB-{env_name.split('_')[0]}")
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import main
+
+    return AsgiClient(main.app)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Gerador de carga (rush de jantar) para a API de impressão.")
+    parser.add_argument("--url", help="URL de uma instância rodando; sem isso roda em processo com spooler stub.")
+    parser.add_argument("--emulator", metavar="HOST:PORTA", help="Em processo, envia os jobs para o emulador TCP em vez do stub.")
+    parser.add_argument("--rate", type=float, default=60.0, help="Requisições por minuto (taxa base).")
+    parser.add_argument("--duration", type=float, default=30.0, help="Duração em segundos.")
+    parser.add_argument("--ramp", help="Lista de taxas (req/min) para rodar em estágios, ex.: 60,120,240.")
+    parser.add_argument("--stage-seconds", type=float, default=20.0, help="Duração de cada estágio do --ramp.")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("bar=4,kitchen=4,bill=2,dashboard=0.2"))
+    parser.add_argument("--dishes", default="1-6", help="Faixa de pratos por pedido, ex.: 1-6.")
+    parser.add_argument("--burst-every", type=float, default=0.0, help="Período das rajadas em segundos (0 desliga).")
+    parser.add_argument("--burst-length", type=float, default=5.0, help="Duração de cada rajada em segundos.")
+    parser.add_argument("--burst-factor", type=float, default=3.0, help="Multiplicador da taxa durante a rajada.")
+    parser.add_argument("--concurrency", type=int, default=64, help="Máximo de requisições em voo.")
+    parser.add_argument("--printer-bytes-per-sec", type=float, default=0.0, help="Velocidade simulada do stub (0 = instantâneo).")
+    parser.add_argument("--printer-job-ms", type=float, default=0.0, help="Latência fixa simulada por job no stub.")
+    parser.add_argument("--slo-p99-ms", type=float, help="Marca o estágio como violado se p99 passar deste valor.")
+    parser.add_argument("--seed", type=int, help="Semente para reprodutibilidade.")
+    parser.add_argument("--json", action="store_true", help="Imprime o relatório também em JSON.")
+    args = parser.parse_args(argv)
+    low, _, high = args.dishes.partition("-")
+    args.dishes_min = max(1, int(low))
+    args.dishes_max = max(args.dishes_min, int(high or low))
+    return args
+
+
+async def main_async(args) -> int:
+    client = build_client(args)
+    factory = PayloadFactory(args.dishes_min, args.dishes_max, args.seed)
+    stages = [float(r) for r in args.ramp.split(",")] if args.ramp else [args.rate]
+    duration = args.stage_seconds if args.ramp else args.duration
+
+    reports = []
+    all_ok = True
+    for rate in stages:
+        results, elapsed = await run_stage(client, factory, rate, duration, args)
+        report = summarize(results, elapsed)
+        ok = print_report(f"{rate:.0f} req/min por {duration:.0f}s", report, args.slo_p99_ms)
+        reports.append({"rate_per_min": rate, "ok": ok, "report": report})
+        all_ok = all_ok and ok
+        if args.ramp and not ok:
+            print("Parando rampa: SLO violado.")
+            break
+
+    if args.ramp and args.slo_p99_ms is not None:
+        sustained = [r["rate_per_min"] for r in reports if r["ok"]]
+        print(f"\nMaior taxa sustentada dentro do SLO: {max(sustained):.0f} req/min" if sustained else "\nNenhuma taxa dentro do SLO.")
+
+    if args.json:
+        print(json.dumps(reports, indent=2))
+    return 0 if all_ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main_async(parse_args())))
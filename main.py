@@ -1,13 +1,30 @@
-from typing import List, Optional
+from typing import List, Literal, Optional
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
+from urllib.parse import unquote
 from pydantic import BaseModel, Field
 from rest_framework.exceptions import APIException
 
+import all_day
+import bill_split
+import cluster
+import job_tracing
+import kds
 import print_bar
 import print_kitchen
 import print_bill
 import print_dashboard
+import print_image
+import profiling
+import qr_raster
+import render_pool
+import shared_cache
+import spooler
+import ticket_archive
+import warmup
+from printer_profiles import get_profile
 
 
 class Dish(BaseModel):
@@ -29,6 +46,7 @@ class Order(BaseModel):
     order_note: Optional[str] = ""
     waiter: str
     is_outside: Optional[bool] = False
+    full_reprint: Optional[bool] = Field(default=False, description="Reimprime a comanda inteira mesmo se o pedido ja foi impresso")
 
 
 class BillDish(OrderDish):
@@ -54,6 +72,27 @@ class BillOrder(Order):
     authorization_datetime: str = Field("", description="Data/hora autorizacao")
 
 
+class SplitItem(BaseModel):
+    index: int = Field(..., ge=0, description="Posicao do item em order_dishes")
+    amount: Optional[float] = Field(default=None, gt=0.0, description="Quantidade desta pessoa; vazio divide igualmente")
+
+
+class SplitPerson(BaseModel):
+    name: str = ""
+    items: List[SplitItem] = Field(default_factory=list)
+
+
+class BillSplit(BaseModel):
+    mode: Literal["equal", "items"] = "equal"
+    people: Optional[int] = Field(default=None, ge=2, le=50, description="Numero de partes no modo equal")
+    assignments: Optional[List[SplitPerson]] = None
+
+
+class SplitBillPayload(BaseModel):
+    order: BillOrder
+    split: BillSplit
+
+
 class DashboardDailyEntry(BaseModel):
     date: Optional[str] = None
     total_additions: float
@@ -68,11 +107,67 @@ class DashboardSummaryPayload(BaseModel):
     printed_at: Optional[str] = None
     daily_breakdown: Optional[List[DashboardDailyEntry]] = None
     printed_by: Optional[str] = None
+    image_base64: Optional[str] = Field(default=None, description="Foto opcional em base64 (ex.: prato)")
+
+
+class ImagePayload(BaseModel):
+    image_base64: str = Field(..., description="Imagem em base64 ou data URL")
+    printer: Literal["bar", "kitchen", "bill", "report"] = "bill"
+    max_width_dots: Optional[int] = Field(default=None, gt=0, le=1024, description="Largura maxima em pontos")
+    band_height_dots: Optional[int] = Field(default=None, gt=0, le=2048, description="Altura de cada faixa GS v 0")
+    dither: Literal["threshold", "ordered", "floyd-steinberg"] = "floyd-steinberg"
+    cut: bool = True
 
 
 app = FastAPI(title="Printer API", version="1.0.0")
 
 
+@app.middleware("http")
+async def trace_print_jobs(request: Request, call_next):
+    if not request.url.path.startswith("/print-"):
+        return await call_next(request)
+    with job_tracing.start_trace(
+        f"{request.method} {request.url.path}", endpoint=request.url.path
+    ) as trace:
+        response = await call_next(request)
+        job_tracing.set_attributes(status_code=response.status_code)
+        if response.status_code >= 400:
+            trace.status = "error"
+        return response
+
+
+if profiling.PROFILING_ENABLED:
+    profiling.install(app)
+
+
+def _trace_received(order_id=None, table_number=None) -> None:
+    # Tudo entre a chegada da requisição e o handler é leitura do corpo + validação
+    trace = job_tracing.current_trace()
+    if trace is None:
+        return
+    job_tracing.record_span("validation", trace.root.start_ns)
+    job_tracing.set_attributes(order_id=order_id, table=table_number)
+
+
+def _job_result(message: str, ticket: Optional[str] = None) -> dict:
+    """
+    Resposta padrão dos /print-*. Com o backend TCP o status pode chegar a
+    "printed" (confirmado pela impressora); falha confirmada vira 503.
+    """
+    job = spooler.last_job_status() or {"status": "spooled", "detail": None}
+    if job["status"] == "failed":
+        raise HTTPException(status_code=503, detail=f"Impressão não confirmada: {job['detail']}")
+    if ticket == "unchanged":
+        return {"message": message, "job_status": "skipped", "ticket": ticket}
+    result = {"message": message, "job_status": job["status"]}
+    if ticket is not None:
+        result["ticket"] = ticket
+    trace = job_tracing.current_trace()
+    if trace is not None and trace.attributes.get("archive_job_id"):
+        result["job_id"] = trace.attributes["archive_job_id"]
+    return result
+
+
 def _handle_print_error(exc: Exception) -> None:
     if isinstance(exc, APIException):
         status_code = getattr(exc, "status_code", 500)
@@ -81,32 +176,38 @@ def _handle_print_error(exc: Exception) -> None:
     raise HTTPException(status_code=500, detail=str(exc))
 
 
+# Os endpoints de impressão são síncronos: o FastAPI os roda no threadpool,
+# então a espera pela confirmação da impressora (GS ( H) e pelo pool de
+# renderização não trava o event loop (SSE do KDS, /ready, /health).
 @app.post("/print-bar", status_code=202)
-async def print_bar_endpoint(order: Order):
+def print_bar_endpoint(order: Order):
+    _trace_received(order.id, order.table_number)
     try:
         # Printa o body
         print("📥 Recebido em /print-bar:")
         print(order.model_dump())
-        print_bar.print_order_bar(order.model_dump())
+        ticket = print_bar.print_order_bar(order.model_dump())
     except Exception as exc:
         _handle_print_error(exc)
-    return {"message": "Sent to bar printer"}
+    return _job_result("Sent to bar printer", ticket)
 
 
 @app.post("/print-kitchen", status_code=202)
-async def print_kitchen_endpoint(order: Order):
+def print_kitchen_endpoint(order: Order):
+    _trace_received(order.id, order.table_number)
     try:
         # Printa o body
         print("📥 Recebido em /print-kitchen:")
         print(order.model_dump())
-        print_kitchen.print_order_kitchen(order.model_dump())
+        ticket = print_kitchen.print_order_kitchen(order.model_dump())
     except Exception as exc:
         _handle_print_error(exc)
-    return {"message": "Sent to kitchen printer"}
+    return _job_result("Sent to kitchen printer", ticket)
 
 
 @app.post("/print-bill", status_code=202)
-async def print_bill_endpoint(order: BillOrder):
+def print_bill_endpoint(order: BillOrder):
+    _trace_received(order.id, order.table_number)
     try:
         # Printa o body
         print("📥 Recebido em /print-bill:")
@@ -114,20 +215,257 @@ async def print_bill_endpoint(order: BillOrder):
         print_bill.print_order_bill(order.model_dump())
     except Exception as exc:
         _handle_print_error(exc)
-    return {"message": "Bill sent to bill printer"}
+    return _job_result("Bill sent to bill printer")
+
+
+@app.post("/print-bill-split", status_code=202)
+def print_bill_split_endpoint(payload: SplitBillPayload):
+    _trace_received(payload.order.id, payload.order.table_number)
+    try:
+        print(f"📥 Recebido em /print-bill-split: pedido {payload.order.id} ({payload.split.mode})")
+        parts = print_bill.print_split_bill(payload.order.model_dump(), payload.split.model_dump())
+    except bill_split.SplitError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    except Exception as exc:
+        _handle_print_error(exc)
+    result = _job_result("Split bill sent to bill printer")
+    result["parts"] = [{key: part[key] for key in ("person", "subtotal", "service_fee", "adjustment", "total")} for part in parts]
+    return result
 
 
 @app.post("/print-dashboard-service-fee", status_code=202)
-async def print_dashboard_service_fee(payload: DashboardSummaryPayload):
+def print_dashboard_service_fee(payload: DashboardSummaryPayload):
+    _trace_received()
     try:
         print("📥 Recebido em /print-dashboard-service-fee:")
         print(payload.model_dump())
         print_dashboard.print_dashboard_summary(payload.model_dump())
     except Exception as exc:
         _handle_print_error(exc)
-    return {"message": "Dashboard summary sent to printer"}
+    return _job_result("Dashboard summary sent to printer")
+
+
+@app.post("/print-image", status_code=202)
+def print_image_endpoint(payload: ImagePayload):
+    _trace_received()
+    try:
+        print(f"📥 Recebido em /print-image: printer={payload.printer} dither={payload.dither}")
+        print_image.print_image(payload.model_dump())
+    except Exception as exc:
+        _handle_print_error(exc)
+    return _job_result("Image sent to printer")
+
+
+@app.get("/debug/jobs")
+async def debug_jobs(
+    printer: Optional[str] = None,
+    table: Optional[int] = None,
+    min_ms: Optional[float] = None,
+    limit: int = 100,
+    format: Literal["json", "otlp"] = "json",
+):
+    traces = job_tracing.recent(printer=printer, table=table, min_ms=min_ms, limit=limit)
+    if format == "otlp":
+        return job_tracing.to_otlp(traces)
+    return {"jobs": [trace.to_dict() for trace in traces]}
+
+
+@app.get("/debug/jobs/{trace_id}")
+async def debug_job(trace_id: str):
+    trace = job_tracing.find(trace_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail="Job não encontrado no buffer.")
+    return trace.to_dict()
+
+
+def _configured_printers() -> dict:
+    return {
+        "bar": print_bar.default_printer,
+        "kitchen": print_kitchen.default_printer,
+        "bill": print_bill.default_printer,
+        "report": print_dashboard.REPORT_PRINTER,
+    }
+
+
+@app.get("/debug/cache")
+async def debug_cache():
+    return {
+        "shared_cache": shared_cache.stats(),
+        "render_pool": render_pool.stats(),
+        "qr_raster": qr_raster.cache_info(),
+    }
+
+
+@app.get("/printers/status")
+def printers_status():
+    return {
+        role: spooler.printer_status(name) if name else {"printer": None, "reachable": False, "ready": False}
+        for role, name in _configured_printers().items()
+    }
+
+
+def _kds_department(department: str) -> str:
+    if department not in kds.DEPARTMENTS:
+        raise HTTPException(status_code=404, detail=f"Departamento desconhecido: {department}")
+    return department
+
+
+@app.get("/kds/{department}/stream")
+async def kds_stream(department: str, request: Request, last_event_id: Optional[int] = None):
+    """Server-Sent Events com as comandas do departamento (kitchen ou bar)."""
+    _kds_department(department)
+    header = request.headers.get("Last-Event-ID")
+    if header and header.isdigit():
+        last_event_id = int(header)
+    return StreamingResponse(
+        kds.stream(department, last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/kds/{department}/events")
+async def kds_events(department: str, since: Optional[int] = None):
+    return {"events": kds.broker.history(_kds_department(department), since), "stats": kds.broker.stats()}
+
+
+@app.get("/all-day/{department}")
+async def all_day_summary(department: str):
+    """Pratos pendentes nas mesas abertas (pedidos enviados e conta ainda não impressa)."""
+    return all_day.summary(_kds_department(department))
+
+
+@app.post("/print-all-day/{department}", status_code=202)
+def print_all_day(department: str):
+    printer_name = _configured_printers()[_kds_department(department)]
+    job_tracing.set_attributes(printer=printer_name)
+    # Mesma checagem offline das comandas da cozinha/copa
+    with job_tracing.span("offline_check"):
+        if department == "kitchen":
+            offline = print_kitchen.is_printer_offline_kitchen()
+        else:
+            offline = print_bar.is_printer_offline_all()
+    if offline:
+        _handle_print_error(print_kitchen.PrinterOfflineException())
+    summary = all_day.summary(department)
+    data = all_day.render_summary(summary, "Cozinha" if department == "kitchen" else "Copa", get_profile(printer_name))
+    try:
+        spooler.print_raw(printer_name, f"all_day_{department}", data)
+    except Exception as exc:
+        raise HTTPException(status_code=503, detail=f"Erro durante a impressão: {exc}")
+    result = _job_result("All-day summary sent to printer")
+    result["summary"] = summary
+    return result
+
+
+@app.delete("/all-day")
+async def all_day_reset():
+    all_day.reset()
+    return {"status": "ok"}
+
+
+def _get_archive() -> ticket_archive.TicketArchive:
+    archive = ticket_archive.get_archive()
+    if archive is None:
+        raise HTTPException(status_code=404, detail="Arquivo de tickets desabilitado (TICKET_ARCHIVE_DIR).")
+    return archive
+
+
+@app.get("/archive")
+async def archive_search(
+    order_id: Optional[str] = None,
+    table: Optional[str] = None,
+    date: Optional[str] = None,
+    access_key: Optional[str] = None,
+    printer: Optional[str] = None,
+    limit: int = 50,
+):
+    archive = _get_archive()
+    entries = archive.search(
+        limit=limit, order_id=order_id, table=table, date=date, access_key=access_key, printer=printer
+    )
+    return {"stats": archive.stats(), "jobs": entries}
+
+
+@app.post("/reprint/{job_or_order_id}", status_code=202)
+def reprint(job_or_order_id: str, printer: Optional[str] = None, source_printer: Optional[str] = None):
+    """
+    Reenvia os bytes arquivados, sem renderizar de novo. Aceita o job_id
+    devolvido pelos /print-* ou o id do pedido (usa o documento mais recente,
+    opcionalmente filtrado pela impressora de origem). `printer` pode ser um
+    papel (bar, kitchen, bill, report) ou o nome da impressora; sem ele,
+    imprime na mesma impressora do original.
+    """
+    archive = _get_archive()
+    roles = _configured_printers()
+    entry = archive.resolve(job_or_order_id, printer=roles.get(source_printer, source_printer))
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Documento não encontrado no arquivo.")
+    target = roles.get(printer, printer) if printer else entry["printer"]
+    if not target:
+        raise HTTPException(status_code=400, detail="Impressora de destino não definida.")
+    try:
+        job = spooler.print_raw(
+            target, f"reimpressao_{entry['doc_name']}", archive.iter_document(entry), archive=False
+        )
+    except Exception as exc:
+        raise HTTPException(status_code=503, detail=f"Erro durante a impressão: {exc}")
+    if job["status"] == "failed":
+        raise HTTPException(status_code=503, detail=f"Impressão não confirmada: {job['detail']}")
+    return {"message": f"Reprinted on {target}", "job_id": entry["job_id"], "job_status": job["status"]}
+
+
+@app.on_event("startup")
+async def start_cluster():
+    cluster.start()
+
+
+@app.on_event("startup")
+async def start_warmup():
+    warmup.start(_configured_printers())
+
+
+@app.on_event("shutdown")
+async def stop_render_pool():
+    render_pool.shutdown()
+
+
+@app.get("/cluster/node")
+async def cluster_node():
+    return cluster.node_info()
+
+
+@app.get("/cluster/status")
+async def cluster_status():
+    if not cluster.CLUSTER_ENABLED:
+        raise HTTPException(status_code=404, detail="Modo cluster desabilitado.")
+    return cluster.cluster_status()
+
+
+@app.post("/cluster/jobs/{printer_name}", status_code=202)
+async def cluster_receive_job(printer_name: str, request: Request):
+    if printer_name not in cluster.LOCAL_PRINTERS:
+        raise HTTPException(status_code=404, detail=f"Impressora {printer_name} não é local deste nó.")
+    data = await request.body()
+    doc_name = unquote(request.headers.get("X-Doc-Name", "cluster_job"))
+    cluster.metrics.incr("jobs_received")
+    try:
+        job = await run_in_threadpool(
+            cluster.received_jobs.run,
+            request.headers.get("X-Idempotency-Key"),
+            lambda: spooler.print_raw(printer_name, doc_name, data, archive=False),
+        )
+    except Exception as exc:
+        raise HTTPException(status_code=503, detail=f"Erro durante a impressão: {exc}")
+    return {**job, "node": cluster.CLUSTER_NODE_NAME}
 
 
 @app.get("/health")
 async def health_check():
     return {"status": "ok"}
+
+
+@app.get("/ready")
+async def ready_check():
+    """200 só depois do aquecimento (renderizadores, logo, impressoras e transportes)."""
+    return JSONResponse(status_code=200 if warmup.state.ready else 503, content=warmup.state.to_dict())
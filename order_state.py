@@ -0,0 +1,99 @@
+"""
+Estado por pedido para comandas incrementais.
+
+Quando o POS reenvia um pedido já impresso (mesa pediu mais pratos), só
+as linhas novas, alteradas ou canceladas vão para a impressora. Guarda
+apenas quantidade por (prato, observação) de cada pedido e departamento,
+num LRU limitado por ORDER_STATE_MAX_ORDERS; a conta (/print-bill) encerra
+o pedido e libera o estado.
+"""
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+ORDER_DELTA_ENABLED = os.getenv("ORDER_DELTA_ENABLED", "1") == "1"
+ORDER_STATE_MAX_ORDERS = int(os.getenv("ORDER_STATE_MAX_ORDERS", "1000"))
+
+ADDED = "added"
+INCREASED = "increased"
+DECREASED = "decreased"
+CANCELLED = "cancelled"
+
+DishKey = Tuple[str, Optional[str]]
+
+_state: "OrderedDict[Tuple[str, int], Dict[DishKey, float]]" = OrderedDict()
+_lock = threading.Lock()
+
+
+def _quantities(order_dishes) -> Dict[DishKey, float]:
+    quantities: Dict[DishKey, float] = {}
+    for order_dish in order_dishes:
+        key = (order_dish['dish']['dish_name'], order_dish.get('dish_note') or None)
+        quantities[key] = quantities.get(key, 0) + order_dish['amount']
+    return quantities
+
+
+def diff(department: str, order_id, order_dishes) -> Optional[List[dict]]:
+    """
+    Linhas que mudaram desde a última impressão do pedido neste
+    departamento. None quando o pedido ainda não foi impresso (comanda
+    completa); lista vazia quando nada mudou.
+    """
+    if not ORDER_DELTA_ENABLED:
+        return None
+    with _lock:
+        previous = _state.get((department, order_id))
+    if previous is None:
+        return None
+
+    current = _quantities(order_dishes)
+    lines = []
+    for key in list(current) + [key for key in previous if key not in current]:
+        amount = current.get(key, 0)
+        before = previous.get(key, 0)
+        if amount == before:
+            continue
+        if not before:
+            change = ADDED
+        elif not amount:
+            change = CANCELLED
+        else:
+            change = INCREASED if amount > before else DECREASED
+        lines.append({
+            "dish_name": key[0],
+            "dish_note": key[1],
+            "change": change,
+            "amount": amount,
+            "previous": before,
+            "difference": abs(amount - before),
+        })
+    return lines
+
+
+def commit(department: str, order_id, order_dishes) -> None:
+    """Registra o que foi impresso; chamado só depois do envio ao spooler."""
+    if not ORDER_DELTA_ENABLED:
+        return
+    quantities = _quantities(order_dishes)
+    with _lock:
+        _state[(department, order_id)] = quantities
+        _state.move_to_end((department, order_id))
+        while len(_state) > ORDER_STATE_MAX_ORDERS:
+            _state.popitem(last=False)
+
+
+def close(order_id) -> None:
+    """Conta impressa: a mesa fechou, o estado do pedido não é mais necessário."""
+    with _lock:
+        for key in [key for key in _state if key[1] == order_id]:
+            del _state[key]
+
+
+def stats() -> dict:
+    with _lock:
+        return {"orders": len(_state), "max_orders": ORDER_STATE_MAX_ORDERS, "enabled": ORDER_DELTA_ENABLED}
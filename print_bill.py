@@ -1,14 +1,27 @@
 from datetime import datetime
-from typing import Any, Dict, List, Optional
-from win32 import win32print
+from functools import lru_cache
+from typing import Any, Dict, Iterator, List, Optional, Union
+from spooler import win32print
 from rest_framework.exceptions import APIException
 from unidecode import unidecode
 import os
 from dotenv import load_dotenv
 
+import all_day
+import bill_split
+import escpos_image
+import job_tracing
+import order_state
+import qr_raster
+import render_pool
+import shared_cache
+from printer_profiles import PrinterProfile, get_profile
+from receipt_templates import CompiledTemplate, Slot, chunked, compile_template, sliced
+
 load_dotenv()
 
 default_printer = os.getenv('BILL_PRINTER')
+PROFILE = get_profile(default_printer)
 
 CUT = b"\x1B\x69"  # corte total Epson ESC/POS
 BEEP_TIMES = 1
@@ -36,7 +49,10 @@ def print_order_bill(order_data):
     Imprime uma conta detalhada: cabeçalho e mensagens centralizadas,
     itens e totais alinhados à esquerda.
     """
-    if is_printer_offline_all():
+    job_tracing.set_attributes(printer=default_printer, access_key=order_data.get("access_key") or None)
+    with job_tracing.span("offline_check"):
+        offline = is_printer_offline_all()
+    if offline:
         raise PrinterOfflineException()
 
     hPrinter = None
@@ -44,24 +60,42 @@ def print_order_bill(order_data):
     page_started = False
 
     try:
-        payload = build_bill_payload(order_data)
+        items = len(order_data.get("order_dishes", []))
+        if render_pool.should_offload(items):
+            # Contas grandes vão para o pool de processos (render_pool.py)
+            with job_tracing.span("render", items=items):
+                payload = render_pool.render(render_bill_document, order_data, size=items)
+            parts = [align_center(), payload["logo"]] if payload["logo"] else []
+            parts += [payload["content"], CUT]
+            # Documento já pronto: envia fatias do buffer do pool, sem recopiar
+            chunks = sliced(parts)
+        else:
+            # Renderiza enquanto imprime: logo e itens saem em chunks à medida que ficam prontos
+            chunks = chunked(iter_bill_document(order_data))
+        # Logo e cabeçalho são renderizados antes de abrir o job: um erro aqui não chega à impressora
+        with job_tracing.span("render_head"):
+            first = next(chunks, b"")
 
         hPrinter = win32print.OpenPrinter(default_printer)
-        win32print.StartDocPrinter(hPrinter, 1, (payload["title"], None, "RAW"))
+        win32print.StartDocPrinter(hPrinter, 1, (bill_title(order_data), None, "RAW"))
         doc_started = True
         win32print.StartPagePrinter(hPrinter)
         page_started = True
 
-        logo_bytes = build_logo()
-        if logo_bytes:
-            win32print.WritePrinter(hPrinter, align_center())
-            win32print.WritePrinter(hPrinter, logo_bytes)
-
-        win32print.WritePrinter(hPrinter, payload["content"])
-        win32print.WritePrinter(hPrinter, CUT)
+        with job_tracing.span("render_stream", items=items):
+            win32print.WritePrinter(hPrinter, first)
+            for chunk in chunks:
+                win32print.WritePrinter(hPrinter, chunk)
         # emitir_beep(hPrinter)
 
     except Exception as e:
+        if doc_started and hPrinter:
+            # Documento incompleto: cancela o job em vez de finalizar (sem corte e sem arquivar)
+            try:
+                win32print.AbortPrinter(hPrinter)
+            except Exception:
+                pass
+            doc_started = page_started = False
         raise APIException(f"Erro durante a impressão: {str(e)}")
     finally:
         if page_started and hPrinter:
@@ -80,8 +114,50 @@ def print_order_bill(order_data):
             except Exception:
                 pass
 
+    release_table(order_data)
+
+
+def release_table(order_data) -> None:
+    """Mesa fechada: libera o estado das comandas incrementais e o all day do pedido."""
+    order_state.close(order_data.get("id"))
+    all_day.close(order_data.get("id"))
+
+
+def bill_title(order_data) -> str:
+    order_id = order_data.get("id", "sem_id")
+    table_number = order_data.get("table_number", "sem_mesa")
+    return f"conta_{order_id}_mesa_{table_number}"
+
+
+def render_bill_document(order_data):
+    """Conta completa (texto + logo) sem I/O; roda na thread ou no pool."""
+    payload = build_bill_payload(order_data)
+    with job_tracing.span("logo"):
+        logo = logo_escpos()
+    # O cache compartilhado devolve memoryview; o resultado do pool precisa ser picklable
+    payload["logo"] = bytes(logo) if logo is not None else None
+    return payload
+
+
+def iter_bill_document(order_data) -> Iterator[bytes]:
+    """Documento inteiro (logo, conta e corte) como gerador de pedaços ESC/POS."""
+    with job_tracing.span("logo"):
+        logo_bytes = logo_escpos()
+    if logo_bytes:
+        yield align_center()
+        yield logo_bytes
+    yield from iter_bill_content(order_data)
+    yield CUT
+
 
 def build_bill_payload(order_data):
+    return {
+        "title": bill_title(order_data),
+        "content": b"".join(iter_bill_content(order_data)),
+    }
+
+
+def iter_bill_content(order_data) -> Iterator[bytes]:
     company_name = order_data.get("company_name", "")
     company_address = order_data.get("company_address", "")
     company_cnpj = order_data.get("company_cnpj", "")
@@ -99,76 +175,233 @@ def build_bill_payload(order_data):
     authorization_protocol = order_data.get("authorization_protocol", "")
     authorization_datetime = order_data.get("authorization_datetime", "")
 
-    content = b""
+    with job_tracing.span("qr"):
+        qr = escpos_qr(qr_url, PROFILE)
 
-    # resetar impressora e centralizar
-    content += reset_and_center()
-    content += text_smallest(company_name + "\n")
-    content += text_smallest(company_address + "\n")
-    content += text_smallest(f"CNPJ: {company_cnpj}  IE: {company_ie}\n")
-    content += text_smallest("Documento Auxiliar da Nota Fiscal de Consumidor Eletronica\n\n")
+    template = bill_template(company_name, company_address, company_cnpj, company_ie, PROFILE)
 
-    content += b"\n"
-    
-    content += align_left()
-    content += render_item_line(
+    totals = (
+        render_item_line("Subtotal:", f"R$ {subtotal:0.2f}", PROFILE.line_width, text_small)
+        + render_item_line("Serviço:", f"R$ {service_fee:0.2f}", PROFILE.line_width, text_small)
+        + render_item_line("Valor total:", f"R$ {final_value:0.2f}", PROFILE.line_width, text_medium)
+    )
+
+    yield from template.iter_render(
+        items=iter_items(order_dishes, PROFILE.line_width),
+        totals=totals,
+        access_key_url=access_key_url,
+        access_key=access_key,
+        nfce_number=nfce_number,
+        nfce_series=nfce_series,
+        emission_datetime=emission_datetime,
+        authorization_protocol=authorization_protocol,
+        authorization_datetime=authorization_datetime,
+        # Gera QR CODE a partir da chave de acesso se existir
+        qr=qr,
+    )
+
+
+def bill_header_parts(company_name: str, company_address: str, company_cnpj: str, company_ie: str) -> List[bytes]:
+    return [
+        # resetar impressora e centralizar
+        reset_and_center(),
+        text_smallest(company_name + "\n"),
+        text_smallest(company_address + "\n"),
+        text_smallest(f"CNPJ: {company_cnpj}  IE: {company_ie}\n"),
+    ]
+
+
+def items_header(profile: PrinterProfile) -> bytes:
+    return render_item_line(
         "Item  |  Quantidade  |  Valor Unitario",
         "Soma",
+        width=profile.line_width,
         formatter=text_smallest,
     )
-    content += render_items(order_dishes)
-    
-    content += b"\n"
-    content += b"\n"
-    
-    content += render_item_line(
-        "Subtotal:",
-        f"R$ {subtotal:0.2f}",
-        formatter=text_small,
-    )
-    content += render_item_line(
-        "Serviço:",
-        f"R$ {service_fee:0.2f}",
-        formatter=text_small,
-    )
-    content += render_item_line(
-        "Valor total:",
-        f"R$ {final_value:0.2f}",
-        formatter=text_medium,
-    )
 
-    content += align_center()
-    content += text_smallest("\nConsulte pela chave de acesso em\n")
-    content += text_smallest(f"{access_key_url}\n")
-    content += text_smallest(f"{access_key}\n")
-    content += text_smallest("CONSUMIDOR NAO IDENTIFICADO\n\n")
 
-    content += text_smallest(
-        f"NFC-e n {nfce_number} Serie {nfce_series} | Data Emissao: {emission_datetime}\n"
-    )
-    content += text_smallest(f"Protocolo de Autorizacao: {authorization_protocol}\n")
-    content += text_smallest(f"Data Autorizacao: {authorization_datetime}\n")
+@lru_cache(maxsize=16)
+def bill_template(
+    company_name: str,
+    company_address: str,
+    company_cnpj: str,
+    company_ie: str,
+    profile: PrinterProfile,
+) -> CompiledTemplate:
+    """
+    Layout da conta compilado uma vez por empresa/perfil: cabeçalho,
+    colunas e bloco da chave de acesso já saem codificados.
+    """
+    return compile_template([
+        *bill_header_parts(company_name, company_address, company_cnpj, company_ie),
+        text_smallest("Documento Auxiliar da Nota Fiscal de Consumidor Eletronica\n\n"),
+        b"\n",
+        align_left(),
+        items_header(profile),
+        Slot("items"),
+        b"\n\n",
+        Slot("totals"),
+        align_center(),
+        text_smallest("\nConsulte pela chave de acesso em\n"),
+        Slot("access_key_url", lambda value: text_smallest(f"{value}\n")),
+        Slot("access_key", lambda value: text_smallest(f"{value}\n")),
+        text_smallest("CONSUMIDOR NAO IDENTIFICADO\n\n"),
+        text_smallest("NFC-e n "),
+        Slot("nfce_number", format_bytes),
+        format_bytes(" Serie "),
+        Slot("nfce_series", format_bytes),
+        format_bytes(" | Data Emissao: "),
+        Slot("emission_datetime", format_bytes),
+        format_bytes("\n"),
+        text_smallest("Protocolo de Autorizacao: "),
+        Slot("authorization_protocol", format_bytes),
+        format_bytes("\n"),
+        text_smallest("Data Autorizacao: "),
+        Slot("authorization_datetime", format_bytes),
+        format_bytes("\n"),
+        align_center(),
+        Slot("qr"),
+        # umas linhas em branco no final antes do corte
+        b"\n\n\n\n",
+    ])
+
+
+@lru_cache(maxsize=16)
+def split_bill_template(
+    company_name: str,
+    company_address: str,
+    company_cnpj: str,
+    company_ie: str,
+    profile: PrinterProfile,
+) -> CompiledTemplate:
+    """Conta parcial (divisão por pessoa): mesmo cabeçalho da conta, sem bloco fiscal."""
+    return compile_template([
+        *bill_header_parts(company_name, company_address, company_cnpj, company_ie),
+        b"\n",
+        Slot("part", lambda value: text_medium(f"{value}\n")),
+        Slot("person", lambda value: text_small(f"{value}\n")),
+        b"\n",
+        align_left(),
+        items_header(profile),
+        Slot("items"),
+        b"\n\n",
+        Slot("totals"),
+        align_center(),
+        text_smallest("\nConta parcial - nao e documento fiscal\n"),
+        Slot("footer", lambda value: text_smallest(f"{value}\n")),
+        b"\n\n\n\n",
+    ])
+
+
+def print_split_bill(order_data, split_data):
+    """
+    Imprime a conta dividida por pessoa num único job: uma checagem
+    offline, logo e cabeçalho codificados uma vez e corte entre as partes.
+    """
+    parts = bill_split.compute(order_data, split_data)
 
-    content += align_center()
+    job_tracing.set_attributes(printer=default_printer, split_parts=len(parts))
+    with job_tracing.span("offline_check"):
+        offline = is_printer_offline_all()
+    if offline:
+        raise PrinterOfflineException()
 
-    # Gera QR CODE a partir da chave de acesso se existir
-    content += escpos_qr(qr_url)
-    
-    # umas linhas em branco no final antes do corte
-    content += b"\n\n\n\n"
+    hPrinter = None
+    doc_started = False
+    page_started = False
 
-    order_id = order_data.get("id", "sem_id")
-    table_number = order_data.get("table_number", "sem_mesa")
+    try:
+        order_id = order_data.get("id", "sem_id")
+        table_number = order_data.get("table_number", "sem_mesa")
+        chunks = chunked(iter_split_document(order_data, parts))
+        with job_tracing.span("render_head"):
+            first = next(chunks, b"")
+        hPrinter = win32print.OpenPrinter(default_printer)
+        win32print.StartDocPrinter(hPrinter, 1, (f"conta_dividida_{order_id}_mesa_{table_number}", None, "RAW"))
+        doc_started = True
+        win32print.StartPagePrinter(hPrinter)
+        page_started = True
 
-    return {
-        "title": f"conta_{order_id}_mesa_{table_number}",
-        "content": content,
-    }
+        with job_tracing.span("render_stream", parts=len(parts)):
+            win32print.WritePrinter(hPrinter, first)
+            for chunk in chunks:
+                win32print.WritePrinter(hPrinter, chunk)
 
+    except Exception as e:
+        if doc_started and hPrinter:
+            # Documento incompleto: cancela o job em vez de finalizar (sem corte e sem arquivar)
+            try:
+                win32print.AbortPrinter(hPrinter)
+            except Exception:
+                pass
+            doc_started = page_started = False
+        raise APIException(f"Erro durante a impressão: {str(e)}")
+    finally:
+        if page_started and hPrinter:
+            try:
+                win32print.EndPagePrinter(hPrinter)
+            except Exception:
+                pass
+        if doc_started and hPrinter:
+            try:
+                win32print.EndDocPrinter(hPrinter)
+            except Exception:
+                pass
+        if hPrinter:
+            try:
+                win32print.ClosePrinter(hPrinter)
+            except Exception:
+                pass
 
-def build_logo() -> Optional[bytes]:
+    release_table(order_data)
+    return parts
+
+
+def iter_split_document(order_data, parts) -> Iterator[bytes]:
+    with job_tracing.span("logo"):
+        logo_bytes = logo_escpos()
+    template = split_bill_template(
+        order_data.get("company_name", ""),
+        order_data.get("company_address", ""),
+        order_data.get("company_cnpj", ""),
+        order_data.get("company_ie", ""),
+        PROFILE,
+    )
+    footer = f"Pedido {order_data.get('id', '')} - Mesa {order_data.get('table_number', '')}"
+    for number, part in enumerate(parts, start=1):
+        if logo_bytes:
+            yield align_center()
+            yield logo_bytes
+        totals = (
+            render_item_line("Subtotal:", f"R$ {part['subtotal']:0.2f}", PROFILE.line_width, text_small)
+            + render_item_line("Serviço:", f"R$ {part['service_fee']:0.2f}", PROFILE.line_width, text_small)
+            + (
+                render_item_line("Ajuste:", f"R$ {part['adjustment']:0.2f}", PROFILE.line_width, text_small)
+                if part["adjustment"] else b""
+            )
+            + render_item_line("Valor total:", f"R$ {part['total']:0.2f}", PROFILE.line_width, text_medium)
+        )
+        yield from template.iter_render(
+            part=f"Parte {number} de {len(parts)}",
+            person=part["person"],
+            items=iter_split_items(part["items"], PROFILE.line_width),
+            totals=totals,
+            footer=footer,
+        )
+        yield CUT
+
+
+def iter_split_items(lines: List[Dict[str, Any]], width: int = 48) -> Iterator[bytes]:
+    for line in lines:
+        left = f"{line['dish_name']} - {round(line['amount'], 2):g} UN x R$ {line['unit_price']:0.2f}"
+        right = f"R$ {line['line_total']:0.2f}"
+        yield render_item_line(left, right, width, formatter=text_small)
+
+
+def load_logo_mask():
     """
-    Gera bytes ESC/POS do logo e registra logs de diagnóstico.
+    Carrega o logo já redimensionado e com dithering (máscara 1 bit) e
+    registra logs de diagnóstico. None se não houver logo utilizável.
     """
     logo_path = os.getenv("BILL_LOGO_PATH")
 
@@ -187,62 +420,67 @@ def build_logo() -> Optional[bytes]:
     max_width = int(os.getenv("BILL_LOGO_MAX_WIDTH_DOTS", "256"))
     print(f"[LOGO] Largura máxima definida: {max_width} dots")
 
-    try:
-        from PIL import Image
-    except Exception:
-        print("[LOGO] ERRO: Biblioteca Pillow não instalada.")
-        return None
+    dither = os.getenv("BILL_LOGO_DITHER", escpos_image.DITHER_FLOYD_STEINBERG)
 
     try:
-        img = Image.open(logo_path)
-        print(f"[LOGO] Imagem carregada com sucesso: {img.size} px")
-
-        # Converter para escala cinza
-        img = img.convert("L")
+        mask = escpos_image.prepare_mask(logo_path, max_width, dither)
+        print(f"[LOGO] Dimensão final do logo: {mask.shape[1]}x{mask.shape[0]} ({dither})")
+        return mask
 
-        # Redimensionar
-        if img.width > max_width:
-            ratio = max_width / float(img.width)
-            new_height = int(img.height * ratio)
-            print(f"[LOGO] Redimensionando imagem para: {max_width}x{new_height}")
-            img = img.resize((max_width, new_height))
-
-        # Ajustar largura para múltiplo de 8
-        width = (img.width + 7) // 8 * 8
-        if width != img.width:
-            print(f"[LOGO] Ajustando largura para múltiplo de 8: {width}")
-            img = img.resize((width, int(img.height)))
+    except Exception as e:
+        print(f"[LOGO] ERRO AO PROCESSAR IMAGEM: {e}\n")
+        return None
 
-        # Converter para 1-bit
-        img = img.convert("1")
-        print(f"[LOGO] Dimensão final do logo: {img.size}")
 
-        # ESC/POS: raster bit image (GS v 0)
-        row_bytes = width // 8
-        xL = row_bytes % 256
-        xH = row_bytes // 256
-        yL = img.height % 256
-        yH = img.height // 256
+def logo_escpos() -> Optional[Union[bytes, memoryview]]:
+    """
+    Logo pronto em ESC/POS, lido do cache compartilhado entre workers
+    (shared_cache.py) quando o mesmo arquivo já foi processado.
+    """
+    logo_path = os.getenv("BILL_LOGO_PATH")
+    if not logo_path or not os.path.exists(logo_path):
+        return build_logo()  # registra o motivo nos logs
+    stat = os.stat(logo_path)
+    key = shared_cache.cache_key(
+        "logo",
+        os.path.abspath(logo_path),
+        stat.st_mtime_ns,
+        stat.st_size,
+        int(os.getenv("BILL_LOGO_MAX_WIDTH_DOTS", "256")),
+        os.getenv("BILL_LOGO_DITHER", escpos_image.DITHER_FLOYD_STEINBERG),
+        escpos_image.DEFAULT_BAND_HEIGHT_DOTS,
+    )
+    return shared_cache.get_or_create(key, build_logo)
 
-        print("[LOGO] Gerando header ESC/POS raster...")
-        header = b"\x1D\x76\x30\x00" + bytes([xL, xH, yL, yH])
 
-        data = img.tobytes()
-        print(f"[LOGO] Bytes de imagem gerados: {len(data)} bytes")
+def build_logo() -> Optional[bytes]:
+    """
+    Gera bytes ESC/POS do logo e registra logs de diagnóstico.
+    """
+    mask = load_logo_mask()
+    if mask is None:
+        return None
 
-        print("[LOGO] LOGO preparado com sucesso!\n")
-        return header + data + b"\n"  # ← importante para TM-T20X
+    # ESC/POS: raster bit image (GS v 0) em faixas
+    data = b"".join(escpos_image.iter_raster_bands(mask))
+    print(f"[LOGO] Bytes de imagem gerados: {len(data)} bytes")
 
-    except Exception as e:
-        print(f"[LOGO] ERRO AO PROCESSAR IMAGEM: {e}\n")
-        return None
+    print("[LOGO] LOGO preparado com sucesso!\n")
+    return data + b"\n"  # ← importante para TM-T20X
 
 
-def escpos_qr(data: str) -> bytes:
+def escpos_qr(data: str, profile: PrinterProfile = PROFILE) -> bytes:
     """
     Gera um QR Code real usando comandos ESC/POS nativos Epson.
     Compatível com TM-T20X.
+
+    Com qr_mode "raster" no perfil, o QR é rasterizado no servidor e vai
+    como imagem GS v 0 (cache LRU em qr_raster).
     """
+    if profile.qr_mode == "raster":
+        if not data:
+            return b"\n"
+        return qr_raster.qr_raster_escpos(data, profile.qr_module_dots, "M", profile.width_dots) + b"\n"
 
     qr_bytes = data.encode("utf-8")
     length = len(qr_bytes)
@@ -269,8 +507,11 @@ def escpos_qr(data: str) -> bytes:
     return cmd + b"\n"
 
 
-def render_items(order_dishes: List[Dict[str, Any]]) -> bytes:
-    buffer = b""
+def render_items(order_dishes: List[Dict[str, Any]], width: int = 48) -> bytes:
+    return b"".join(iter_items(order_dishes, width))
+
+
+def iter_items(order_dishes: List[Dict[str, Any]], width: int = 48) -> Iterator[bytes]:
     for order_dish in order_dishes:
         dish = order_dish.get("dish", {})
         dish_name = dish.get("dish_name", "")
@@ -280,9 +521,7 @@ def render_items(order_dishes: List[Dict[str, Any]]) -> bytes:
 
         left = f"{dish_name} - {amount} UN x R$ {float(unit_price):0.2f}"
         right = f"R$ {line_total:0.2f}"
-        buffer += render_item_line(left, right, formatter=text_small)
-
-    return buffer
+        yield render_item_line(left, right, width, formatter=text_small)
 
 
 def reset_and_center():
@@ -332,6 +571,10 @@ def align_current_size(size_cmd: bytes, text: str) -> bytes:
     return size_cmd + format_text(text, "").encode("utf-8")
 
 
+def format_bytes(text: str) -> bytes:
+    return format_text(text, "").encode("utf-8")
+
+
 def format_text(text: str, other: str) -> str:
     # mantém quebras de linha e remove acentos
     # (unidecode não remove '\n', então é safe)
@@ -1,10 +1,16 @@
 import os
 from datetime import datetime
+from typing import Iterator
 
 from dotenv import load_dotenv
 from rest_framework.exceptions import APIException
 from unidecode import unidecode
-from win32 import win32print
+
+import escpos_image
+import job_tracing
+import render_pool
+from receipt_templates import chunked
+from spooler import win32print
 
 load_dotenv()
 
@@ -56,7 +62,10 @@ def is_printer_offline() -> bool:
 
 def print_dashboard_summary(report_data):
     printer_name = _require_printer()
-    if is_printer_offline():
+    job_tracing.set_attributes(printer=printer_name)
+    with job_tracing.span("offline_check"):
+        offline = is_printer_offline()
+    if offline:
         raise PrinterOfflineException()
 
     hPrinter = None
@@ -64,7 +73,20 @@ def print_dashboard_summary(report_data):
     page_started = False
 
     try:
-        payload = build_summary_payload(report_data)
+        size = len(report_data.get("daily_breakdown") or [])
+        if report_data.get("image_base64"):
+            size += render_pool.RENDER_POOL_MIN_ITEMS  # foto sempre conta como documento pesado
+        if render_pool.should_offload(size):
+            with job_tracing.span("render", entries=size):
+                payload = render_pool.render(build_summary_payload, report_data, size=size)
+            parts = [payload, CUT]
+        else:
+            # Relatório longo sai em chunks enquanto os próximos dias são renderizados
+            parts = iter_summary_document(report_data)
+        chunks = chunked(parts)
+        # Cabeçalho renderizado antes de abrir o job: um erro aqui não chega à impressora
+        with job_tracing.span("render_head"):
+            first = next(chunks, b"")
         hPrinter = win32print.OpenPrinter(printer_name)
         win32print.StartDocPrinter(
             hPrinter, 1, ("relatorio_dashboard", None, "RAW")
@@ -73,9 +95,18 @@ def print_dashboard_summary(report_data):
         win32print.StartPagePrinter(hPrinter)
         page_started = True
 
-        win32print.WritePrinter(hPrinter, payload)
-        win32print.WritePrinter(hPrinter, CUT)
+        with job_tracing.span("render_stream", entries=size):
+            win32print.WritePrinter(hPrinter, first)
+            for chunk in chunks:
+                win32print.WritePrinter(hPrinter, chunk)
     except Exception as exc:
+        if doc_started and hPrinter:
+            # Documento incompleto: cancela o job em vez de finalizar (sem corte e sem arquivar)
+            try:
+                win32print.AbortPrinter(hPrinter)
+            except Exception:
+                pass
+            doc_started = page_started = False
         raise APIException(f"Erro durante a impressão: {exc}")
     finally:
         if page_started and hPrinter:
@@ -96,6 +127,15 @@ def print_dashboard_summary(report_data):
 
 
 def build_summary_payload(report_data) -> bytes:
+    return b"".join(iter_summary_payload(report_data))
+
+
+def iter_summary_document(report_data) -> Iterator[bytes]:
+    yield from iter_summary_payload(report_data)
+    yield CUT
+
+
+def iter_summary_payload(report_data) -> Iterator[bytes]:
     start_label = format_date_label(report_data.get("start_date"))
     end_label = format_date_label(
         report_data.get("end_date") or report_data.get("start_date")
@@ -113,33 +153,48 @@ def build_summary_payload(report_data) -> bytes:
     else:
         period_line = f"Periodo: {start_label} a {end_label}"
 
-    content = b""
-    content += reset_printer()
-    content += align_center()
-    content += text_big("Relatório de serviço\n")
-    content += text_small("\n")
-    content += align_left()
-    content += text_small(period_line + "\n")
+    yield reset_printer()
+    yield align_center()
+    yield text_big("Relatório de serviço\n")
+    yield text_small("\n")
+    if report_data.get("image_base64"):
+        yield from iter_image(report_data["image_base64"])
+    yield align_left()
+    yield text_small(period_line + "\n")
     if printed_at:
-        content += text_small(f"Gerado em: {printed_at}\n")
+        yield text_small(f"Gerado em: {printed_at}\n")
     if printed_by:
-        content += text_small(f"Por: {printed_by}\n")
-    content += text_small("\n")
+        yield text_small(f"Por: {printed_by}\n")
+    yield text_small("\n")
 
     if not daily_entries:
-        content += text_medium("Sem movimentacao no periodo.\n")
-        content += text_small("\n")
+        yield text_medium("Sem movimentacao no periodo.\n")
+        yield text_small("\n")
     else:
         for entry in daily_entries:
             weekday_label, day_month_label = format_weekday_day_label(entry.get("date"))
-            content += text_medium(
+            yield text_medium(
                 f"{weekday_label} {day_month_label}: R$ {entry['total_additions']:0.2f}\n"
             )
-            content += text_small(f"Mesas atendidas: {entry['total_tables']}\n\n")
+            yield text_small(f"Mesas atendidas: {entry['total_tables']}\n\n")
+
+    yield text_big(f"Total no periodo:\nR$ {total_additions:0.2f}\n")
+    yield b"\n\n\n\n"
 
-    content += text_big(f"Total no periodo:\nR$ {total_additions:0.2f}\n")
-    content += b"\n\n\n\n"
-    return content
+
+def iter_image(image_base64: str) -> Iterator[bytes]:
+    """Foto opcional (ex.: prato do periodo) centralizada abaixo do titulo."""
+    try:
+        raw = escpos_image.decode_base64_image(image_base64)
+        mask = escpos_image.prepare_mask(
+            raw, dither=escpos_image.DITHER_FLOYD_STEINBERG
+        )
+    except (escpos_image.ImageDecodeError, ValueError) as exc:
+        print(f"[RELATORIO] Imagem ignorada: {exc}")
+        return
+    yield align_center()
+    yield from escpos_image.iter_raster_bands(mask)
+    yield b"\n"
 
 
 def format_weekday_day_label(value):
@@ -0,0 +1,126 @@
+import os
+
+from dotenv import load_dotenv
+from rest_framework.exceptions import APIException
+
+import escpos_image
+import job_tracing
+from spooler import win32print
+
+load_dotenv()
+
+CUT = b"\x1B\x69"
+
+PRINTERS = {
+    "bar": os.getenv("BAR_PRINTER"),
+    "kitchen": os.getenv("KITCHEN_PRINTER"),
+    "bill": os.getenv("BILL_PRINTER"),
+    "report": os.getenv("REPORT_PRINTER") or os.getenv("BILL_PRINTER"),
+}
+
+
+class PrinterOfflineException(APIException):
+    status_code = 503
+    default_detail = "A impressora está offline ou não está acessível."
+    default_code = "printer_offline"
+
+
+class PrinterNotConfiguredException(APIException):
+    status_code = 500
+    default_detail = "Impressora de destino não configurada."
+    default_code = "printer_not_configured"
+
+
+class InvalidImageException(APIException):
+    status_code = 400
+    default_detail = "Imagem inválida."
+    default_code = "invalid_image"
+
+
+def _resolve_printer(target: str) -> str:
+    printer_name = PRINTERS.get(target)
+    if not printer_name:
+        raise PrinterNotConfiguredException(
+            f"Impressora '{target}' não configurada. Use uma de: {', '.join(PRINTERS)}."
+        )
+    return printer_name
+
+
+def is_printer_offline(printer_name: str) -> bool:
+    try:
+        handle = win32print.OpenPrinter(printer_name)
+        win32print.GetPrinter(handle, 2)
+        win32print.ClosePrinter(handle)
+        return False
+    except Exception:
+        return True
+
+
+def print_image(image_data):
+    """
+    Imprime uma imagem avulsa (promoção, foto de prato) enviando cada
+    faixa GS v 0 assim que fica pronta.
+    """
+    printer_name = _resolve_printer(image_data.get("printer") or "bill")
+    job_tracing.set_attributes(printer=printer_name)
+    with job_tracing.span("offline_check"):
+        offline = is_printer_offline(printer_name)
+    if offline:
+        raise PrinterOfflineException()
+
+    dither = image_data.get("dither") or escpos_image.DITHER_FLOYD_STEINBERG
+    max_width = int(image_data.get("max_width_dots") or escpos_image.DEFAULT_MAX_WIDTH_DOTS)
+    band_height = int(image_data.get("band_height_dots") or escpos_image.DEFAULT_BAND_HEIGHT_DOTS)
+
+    try:
+        with job_tracing.span("render", dither=dither):
+            raw = escpos_image.decode_base64_image(image_data.get("image_base64") or "")
+            bands = escpos_image.iter_image_escpos(raw, max_width, dither, band_height)
+            # Primeira faixa antes de abrir o job: imagem inválida não chega à impressora
+            first = next(bands, b"")
+    except (escpos_image.ImageDecodeError, ValueError) as exc:
+        raise InvalidImageException(str(exc))
+
+    hPrinter = None
+    doc_started = False
+    page_started = False
+
+    try:
+        hPrinter = win32print.OpenPrinter(printer_name)
+        win32print.StartDocPrinter(hPrinter, 1, ("imagem", None, "RAW"))
+        doc_started = True
+        win32print.StartPagePrinter(hPrinter)
+        page_started = True
+
+        win32print.WritePrinter(hPrinter, b"\x1B\x40\x1B\x61\x01")  # reset + centralizar
+        win32print.WritePrinter(hPrinter, first)
+        for band in bands:
+            win32print.WritePrinter(hPrinter, band)
+        win32print.WritePrinter(hPrinter, b"\n\n\n\n")
+        if image_data.get("cut", True):
+            win32print.WritePrinter(hPrinter, CUT)
+    except Exception as exc:
+        if doc_started and hPrinter:
+            # Raster incompleto: cancela o job em vez de finalizar (sem corte e sem arquivar)
+            try:
+                win32print.AbortPrinter(hPrinter)
+            except Exception:
+                pass
+            doc_started = page_started = False
+        raise APIException(f"Erro durante a impressão: {exc}")
+    finally:
+        if page_started and hPrinter:
+            try:
+                win32print.EndPagePrinter(hPrinter)
+            except Exception:
+                pass
+        if doc_started and hPrinter:
+            try:
+                win32print.EndDocPrinter(hPrinter)
+            except Exception:
+                pass
+        if hPrinter:
+            try:
+                win32print.ClosePrinter(hPrinter)
+            except Exception:
+                pass
@@ -1,14 +1,22 @@
 from datetime import datetime
-from win32 import win32print
+from spooler import last_job_status, win32print
 from rest_framework.exceptions import APIException
 from unidecode import unidecode
 import os
 from dotenv import load_dotenv
 
+import all_day
+import job_tracing
+import kds
+import order_state
+import receipt_templates
+from printer_profiles import get_profile
+
 load_dotenv()
 
 # dish_name da impressora (substitua com o dish_name da sua impressora ESC/P)
 default_printer = os.getenv('KITCHEN_PRINTER')
+PROFILE = get_profile(default_printer)
 
 class PrinterOfflineException(APIException):
     status_code = 503
@@ -27,7 +35,16 @@ def is_printer_offline_kitchen():
         return True
 
 def print_order_kitchen(order_data):
-    if is_printer_offline_kitchen():
+    job_tracing.set_attributes(printer=default_printer)
+    # Tela da cozinha (KDS): uma vez por mudança, antes e independente do papel
+    # (inclusive com a impressora offline); publicar não bloqueia
+    kds.publish_order(order_data, 'kitchen', [
+        order_dish for order_dish in order_data.get('order_dishes', [])
+        if order_dish.get('dish', {}).get('department') == 'kitchen'
+    ])
+    with job_tracing.span("offline_check"):
+        offline = is_printer_offline_kitchen()
+    if offline:
         raise PrinterOfflineException()
 
     hPrinter = None
@@ -46,6 +63,20 @@ def print_order_kitchen(order_data):
         waiter = order_data['waiter']
         is_outside = order_data['is_outside']
 
+        kitchen_dishes = [
+            order_dish for order_dish in order_dishes
+            if order_dish.get('dish', {}).get('department') == 'kitchen'
+        ]
+        hasKitchenOrder = bool(kitchen_dishes)
+
+        # Pedido reenviado: só o que mudou desde a última comanda
+        delta = None
+        if not order_data.get('full_reprint'):
+            delta = order_state.diff('kitchen', order_id, kitchen_dishes)
+        if delta == []:
+            job_tracing.set_attributes(ticket="unchanged")
+            return "unchanged"
+
         hPrinter = win32print.OpenPrinter(default_printer)
         win32print.StartDocPrinter(
             hPrinter, 1, (f'pedido_{order_id}_mesa_{table_number}', None, "RAW")
@@ -54,19 +85,24 @@ def print_order_kitchen(order_data):
         win32print.StartPagePrinter(hPrinter)
         page_started = True
 
-        hasKitchenOrder = any(
-            order_dish.get('dish', {}).get('department') == 'kitchen'
-            for order_dish in order_dishes
-        )
-
-        if hasKitchenOrder:
-            win32print.WritePrinter(
-                hPrinter, cabecalho_pedido(order_id, date_time, waiter, "Cozinha")
-            )
-            imprimir_cozinha(hPrinter, order_dishes)
-            win32print.WritePrinter(
-                hPrinter, rodape_pedido(order_note, table_number, is_outside)
-            )
+        if delta is not None:
+            with job_tracing.span("render", department="kitchen", delta_lines=len(delta)):
+                win32print.WritePrinter(
+                    hPrinter, cabecalho_pedido(order_id, date_time, waiter, "Cozinha - alteracao")
+                )
+                imprimir_alteracoes(hPrinter, delta)
+                win32print.WritePrinter(
+                    hPrinter, rodape_pedido(order_note, table_number, is_outside)
+                )
+        elif hasKitchenOrder:
+            with job_tracing.span("render", department="kitchen"):
+                win32print.WritePrinter(
+                    hPrinter, cabecalho_pedido(order_id, date_time, waiter, "Cozinha")
+                )
+                imprimir_cozinha(hPrinter, order_dishes)
+                win32print.WritePrinter(
+                    hPrinter, rodape_pedido(order_note, table_number, is_outside)
+                )
 
     except Exception as e:
         raise APIException(f"Erro durante a impressão: {str(e)}")
@@ -87,59 +123,28 @@ def print_order_kitchen(order_data):
             except Exception:
                 pass
 
+    # Só registra o estado se a comanda saiu; senão o reenvio imprime tudo de novo
+    job = last_job_status() or {}
+    if (hasKitchenOrder or delta is not None) and job.get("status") != "failed":
+        order_state.commit('kitchen', order_id, kitchen_dishes)
+        all_day.update('kitchen', order_id, kitchen_dishes)
+    ticket = "full" if delta is None else "delta"
+    job_tracing.set_attributes(ticket=ticket)
+    return ticket
+
 def cabecalho_pedido(order_id, data_time, waiter, titulo):
-    comandos = (
-        b'\x1B\x40'  # Resetar a impressora (ESC @)
-        b'\x1B\x61\x01'  # Centralizar texto (ESC a 1)
-        b'\x1B\x21\x20'  # Fonte média
-        +
-        format_text(f'#{titulo} {order_id}\n', 'medium').encode('utf-8')
-        +
-        b'\x1B\x61\x00'  # Alinhar à esquerda (ESC a 0)
-        b'\x1B\x21\x00'  # Fonte pequena (ESC ! 0)
-        +
-        format_text(f'Data: {data_time}\n', 'small').encode('utf-8')
-        +
-        format_text(f'Atendente: {waiter}\n\n\n', 'small').encode('utf-8')
-    )
-    return comandos
+    return receipt_templates.render_order_header(order_id, data_time, waiter, titulo, PROFILE)
 
 def dishes_pedido(dish_name, amount, dish_note):
-    comandos = (
-        b'\x1B\x21\x30'  # Fonte muito grande (ESC ! 48)
-        b'\x1B\x45\x01'  # Ativar negrito (ESC E 1)
-        +
-        format_text(f" {'Meio' if amount == 0.5 else str(int(amount)) + ' e meio' if amount > 0.5 and amount % 1 != 0 else int(amount)} - {dish_name}\n\n", 'big').encode('utf-8')
-
-        +
-        b'\x1B\x45\x00'  # Desativar negrito (ESC E 0)
-        b'\x1B\x21\x20'  # Fonte média
-        b'\x1B\x61\x01'  # Centralizar texto (ESC a 1)
-        +
-        format_text(f'{dish_note + '\n\n' if dish_note != None else ''}', 'medium').encode('utf-8')
-    )
-    return comandos
+    return receipt_templates.render_order_dish(dish_name, amount, dish_note, PROFILE)
 
 def rodape_pedido(order_note, table_number, is_outside):
-    comandos = (
-        b'\x1B\x61\x01'  # Centralizar texto (ESC a 1)
-        +
-        format_text(f'====\n\n{order_note + '\n\n' if order_note != '' else '\n'}', 'medium').encode('utf-8')
-        +
-        b'\x1B\x45\x01'  # Ativar negrito (ESC E 1)
-        b'\x1B\x2D\x01'  # Ativa sublinhado
-        b'\x1B\x21\x30'  # Fonte muito grande (ESC ! 48)
-        +
-        format_text(f"* Mesa {'R' + str(table_number) if is_outside else str(table_number)} *\n\n\n", 'big').encode('utf-8')
-        +
-        b'\x1B\x2D\x00'  # Desativa sublinhado
-        b'\x1B\x45\x00'  # Desativar negrito (ESC E 0)
-        b'\x1B\x61\x00'  # Alinhar à esquerda (ESC a 0)
-        +
-        format_text(f'\n----------------\n\n\n', 'medium').encode('utf-8')
-    )
-    return comandos
+    return receipt_templates.render_order_footer(order_note, table_number, is_outside, PROFILE)
+
 
+def imprimir_alteracoes(hPrinter, delta):
+    for line in delta:
+        win32print.WritePrinter(hPrinter, receipt_templates.render_order_delta_dish(line, PROFILE))
 
 def imprimir_copa(hPrinter, order_dishes):
     for order_dish in order_dishes:
@@ -0,0 +1,49 @@
+"""
+Perfis de impressora: características físicas que afetam a renderização
+(colunas por linha, largura em pontos, como imprimir o QR). Configurável
+por nome de impressora via PRINTER_PROFILES (JSON), por exemplo:
+
+PRINTER_PROFILES='{"EPSON-CONTA": {"line_width": 48, "width_dots": 512}}'
+
+qr_mode: "native" usa o comando GS ( k da impressora; "raster" gera o QR
+no servidor e envia como imagem GS v 0 (impressoras sem QR nativo),
+com módulos de qr_module_dots pontos.
+"""
+import json
+import os
+from functools import lru_cache
+from typing import NamedTuple, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+class PrinterProfile(NamedTuple):
+    name: str = ""
+    line_width: int = 48
+    width_dots: int = 512
+    qr_mode: str = "native"
+    qr_module_dots: int = 6
+
+
+DEFAULT_PROFILE = PrinterProfile()
+
+
+def _load_profiles() -> dict:
+    raw = os.getenv("PRINTER_PROFILES", "")
+    if not raw:
+        return {}
+    try:
+        profiles = json.loads(raw)
+    except ValueError as exc:
+        print(f"[PERFIL] PRINTER_PROFILES inválido, usando padrão: {exc}")
+        return {}
+    return profiles if isinstance(profiles, dict) else {}
+
+
+@lru_cache(maxsize=None)
+def get_profile(printer_name: Optional[str]) -> PrinterProfile:
+    options = _load_profiles().get(printer_name or "", {})
+    fields = {key: options[key] for key in PrinterProfile._fields if key in options}
+    return PrinterProfile(**{**DEFAULT_PROFILE._asdict(), **fields, "name": printer_name or ""})
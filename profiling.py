@@ -0,0 +1,338 @@
+"""
+Profiling sob demanda para requisições reais.
+
+Desligado por padrão (PROFILING_ENABLED=0): nesse caso main.py nem instala
+o middleware nem as rotas, então não há custo algum.
+
+Com PROFILING_ENABLED=1:
+- Uma requisição com o header `X-Profile: <modo>` (ou `?profile=<modo>`)
+  é perfilada sozinha. Modos: `sample` (amostragem da thread que atende a
+  requisição), `trace` (determinístico via sys.setprofile, pilhas exatas)
+  e `cprofile` (cProfile, pilhas reconstruídas do grafo de chamadores).
+  A resposta volta normal, com o header
+  `X-Profile-Id`; o resultado fica em GET /debug/profiles/{id}.
+- POST /debug/profile?seconds=N amostra todas as threads do processo por
+  N segundos e devolve o resultado.
+
+O profiler é ligado dentro do próprio endpoint (ProfiledRoute), na thread
+que o executa: o event loop para `async def` e a thread do threadpool para
+os endpoints `def` (/print-bill etc.). Só um profiling roda por vez; um
+segundo pedido enquanto outro está em andamento recebe 409.
+
+A saída é no formato "collapsed stacks" (`a;b;c <peso>` por linha),
+pronta para flamegraph.pl / speedscope / inferno.
+"""
+import asyncio
+import contextvars
+import cProfile
+import functools
+import os
+import pstats
+import re
+import secrets
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Callable, Dict, Iterable, Optional
+
+from dotenv import load_dotenv
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
+from fastapi.routing import APIRoute
+
+load_dotenv()
+
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "0") == "1"
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN", "")
+PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "2"))
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+PROFILE_KEEP = 20
+CPROFILE_MAX_DEPTH = 64
+
+MODES = ("sample", "trace", "cprofile")
+
+_results: "OrderedDict[str, str]" = OrderedDict()
+_results_lock = threading.Lock()
+# Um profiling por vez: sys.setprofile/cProfile não suportam sessões concorrentes
+_session_lock = threading.Lock()
+
+
+def _frame_label(code) -> str:
+    module = os.path.splitext(os.path.basename(code.co_filename))[0]
+    return f"{module}:{code.co_name}"
+
+
+def _stack_of(frame) -> str:
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame.f_code))
+        frame = frame.f_back
+    labels.reverse()
+    return ";".join(labels)
+
+
+def collapse(counts: Dict[str, float]) -> str:
+    lines = [f"{stack} {int(round(weight))}" for stack, weight in counts.items() if weight >= 0.5]
+    lines.sort()
+    return "\n".join(lines) + ("\n" if lines else "")
+
+
+class Sampler:
+    """Amostra periodicamente as pilhas das threads indicadas (ou de todas)."""
+
+    def __init__(self, thread_ids: Optional[Iterable[int]] = None, interval_ms: float = PROFILE_SAMPLE_INTERVAL_MS):
+        self.thread_ids = set(thread_ids) if thread_ids is not None else None
+        self.interval = max(0.0005, interval_ms / 1000.0)
+        self.counts: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiling-sampler", daemon=True)
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        names = {}
+        while not self._stop.is_set():
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                if self.thread_ids is not None and thread_id not in self.thread_ids:
+                    continue
+                if self.thread_ids is None:
+                    if thread_id not in names:
+                        names = {t.ident: t.name for t in threading.enumerate()}
+                    prefix = f"thread:{names.get(thread_id, thread_id)};"
+                else:
+                    prefix = ""
+                self.counts[prefix + _stack_of(frame)] += 1
+            self.samples += 1
+            self._stop.wait(self.interval)
+
+    def start(self) -> "Sampler":
+        self._thread.start()
+        return self
+
+    def stop(self) -> str:
+        self._stop.set()
+        self._thread.join()
+        return collapse(self.counts)
+
+
+class StackTracer:
+    """
+    Profiler determinístico com pilhas completas: soma o tempo próprio
+    (microssegundos) de cada pilha, só na thread que o iniciou.
+    """
+
+    def __init__(self):
+        self.counts: Counter = Counter()
+        self._stack = []
+        self._last = 0
+
+    def _profile(self, frame, event, arg):
+        now = time.perf_counter_ns()
+        if self._stack:
+            self.counts[";".join(self._stack)] += (now - self._last) / 1000.0
+        if event in ("call", "c_call"):
+            label = _frame_label(frame.f_code) if event == "call" else f"builtin:{getattr(arg, '__qualname__', arg)}"
+            self._stack.append(label)
+        elif event in ("return", "c_return", "c_exception") and self._stack:
+            self._stack.pop()
+        self._last = time.perf_counter_ns()
+
+    def start(self) -> "StackTracer":
+        self._last = time.perf_counter_ns()
+        sys.setprofile(self._profile)
+        return self
+
+    def stop(self) -> str:
+        sys.setprofile(None)
+        return collapse(self.counts)
+
+
+def _cprofile_label(func) -> str:
+    filename, _, name = func
+    if filename == "~":
+        # "<built-in method time.sleep>", "<method 'join' of 'str' objects>"
+        name = name.strip("<>")
+        method = re.fullmatch(r"method '(.+)' of '(.+)' objects", name)
+        if method:
+            name = f"{method.group(2)}.{method.group(1)}"
+        return "builtin:" + re.sub(r"^built-in (method|function) ", "", name)
+    return f"{os.path.splitext(os.path.basename(filename))[0]}:{name}"
+
+
+def cprofile_collapsed(stats: pstats.Stats) -> str:
+    """
+    Collapsed stacks a partir do grafo do cProfile, em microssegundos.
+
+    O cProfile só guarda o chamador imediato de cada função, então a pilha
+    é reconstruída subindo pelos chamadores: o tempo próprio vai para cada
+    chamador na proporção do tempo próprio da aresta e, dali para cima, na
+    proporção do tempo acumulado. É uma aproximação (funções chamadas de
+    vários lugares misturam os custos), mas com o overhead do cProfile.
+    """
+    table = stats.stats
+    counts: Counter = Counter()
+
+    def walk(func, path, weight, edge_field):
+        callers = [
+            (caller, edge[edge_field]) for caller, edge in table[func][4].items()
+            if caller in table and caller not in path
+        ]
+        total = sum(share for _, share in callers)
+        if total <= 0 or len(path) >= CPROFILE_MAX_DEPTH or weight < 1:
+            counts[";".join(_cprofile_label(f) for f in reversed(path))] += weight
+            return
+        for caller, share in callers:
+            walk(caller, path + (caller,), weight * share / total, 3)
+
+    for func, (_, _, own_time, _, _) in table.items():
+        if own_time > 0:
+            walk(func, (func,), own_time * 1e6, 2)
+    return collapse(counts)
+
+
+class CProfileRunner:
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def start(self) -> "CProfileRunner":
+        self.profile.enable()
+        return self
+
+    def stop(self) -> str:
+        self.profile.disable()
+        return cprofile_collapsed(pstats.Stats(self.profile))
+
+
+def _start(mode: str):
+    if mode == "sample":
+        return Sampler([threading.get_ident()]).start()
+    if mode == "trace":
+        return StackTracer().start()
+    return CProfileRunner().start()
+
+
+class ProfileSession:
+    """Profiling de uma requisição; ligado na thread que executa o endpoint."""
+
+    def __init__(self, mode: str):
+        self.mode = mode
+        self.result = ""
+        self._profiler = None
+        self._started = False
+
+    def begin(self) -> bool:
+        if self._started:
+            return False  # endpoint aninhado: já está sendo perfilado
+        self._started = True
+        try:
+            self._profiler = _start(self.mode)
+        except Exception as exc:
+            self.result = f"# Profiler {self.mode} indisponível: {exc}\n"
+            print(f"[PROFILE] Não foi possível iniciar o modo {self.mode}: {exc}")
+        return True
+
+    def end(self) -> None:
+        if self._profiler is not None:
+            self.result = self._profiler.stop()
+            self._profiler = None
+
+
+_session: contextvars.ContextVar[Optional[ProfileSession]] = contextvars.ContextVar("profile_session", default=None)
+
+
+def _profiled(endpoint: Callable) -> Callable:
+    if asyncio.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def run_async(*args, **kwargs):
+            session = _session.get()
+            if session is None or not session.begin():
+                return await endpoint(*args, **kwargs)
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                session.end()
+        return run_async
+
+    @functools.wraps(endpoint)
+    def run(*args, **kwargs):
+        session = _session.get()
+        if session is None or not session.begin():
+            return endpoint(*args, **kwargs)
+        try:
+            return endpoint(*args, **kwargs)
+        finally:
+            session.end()
+    return run
+
+
+class ProfiledRoute(APIRoute):
+    def __init__(self, path: str, endpoint: Callable, **kwargs):
+        super().__init__(path, _profiled(endpoint), **kwargs)
+
+
+def _store(result: str) -> str:
+    profile_id = secrets.token_hex(8)
+    with _results_lock:
+        _results[profile_id] = result
+        while len(_results) > PROFILE_KEEP:
+            _results.popitem(last=False)
+    return profile_id
+
+
+def _check_token(request: Request) -> None:
+    if PROFILING_TOKEN and request.headers.get("X-Profile-Token") != PROFILING_TOKEN:
+        raise HTTPException(status_code=403, detail="Token de profiling inválido.")
+
+
+def install(app: FastAPI) -> None:
+    """
+    Registra middleware e rotas de profiling. Só é chamado se habilitado,
+    antes das rotas da aplicação (que passam a usar ProfiledRoute).
+    """
+    app.router.route_class = ProfiledRoute
+
+    @app.middleware("http")
+    async def profile_request(request: Request, call_next):
+        mode = request.headers.get("X-Profile") or request.query_params.get("profile")
+        if mode not in MODES:
+            return await call_next(request)
+        if PROFILING_TOKEN and request.headers.get("X-Profile-Token") != PROFILING_TOKEN:
+            return await call_next(request)
+
+        if not _session_lock.acquire(blocking=False):
+            return JSONResponse(status_code=409, content={"detail": "Já existe um profiling em andamento."})
+        session = ProfileSession(mode)
+        token = _session.set(session)
+        try:
+            response = await call_next(request)
+        finally:
+            _session.reset(token)
+            _session_lock.release()
+        response.headers["X-Profile-Id"] = _store(session.result)
+        return response
+
+    @app.get("/debug/profiles/{profile_id}", response_class=PlainTextResponse)
+    async def get_profile(profile_id: str, request: Request):
+        _check_token(request)
+        with _results_lock:
+            result = _results.get(profile_id)
+        if result is None:
+            raise HTTPException(status_code=404, detail="Profile não encontrado.")
+        return result
+
+    @app.post("/debug/profile", response_class=PlainTextResponse)
+    async def profile_process(request: Request, seconds: float = 10.0, interval_ms: float = PROFILE_SAMPLE_INTERVAL_MS):
+        _check_token(request)
+        if not 0 < seconds <= PROFILE_MAX_SECONDS:
+            raise HTTPException(status_code=400, detail=f"seconds deve estar entre 0 e {PROFILE_MAX_SECONDS:g}.")
+        if not _session_lock.acquire(blocking=False):
+            raise HTTPException(status_code=409, detail="Já existe um profiling em andamento.")
+        try:
+            sampler = Sampler(interval_ms=interval_ms).start()
+            await asyncio.sleep(seconds)
+            return sampler.stop()
+        finally:
+            _session_lock.release()
@@ -0,0 +1,378 @@
+"""
+QR Code rasterizado no servidor, para impressoras sem o comando nativo
+GS ( k (modelos não Epson) ou lentas para gerar QR longos.
+
+Codificador em Python/NumPy (modo byte, versões 1 a 40, correção
+L/M/Q/H, escolha de máscara pela penalidade da norma ISO/IEC 18004). A
+matriz é ampliada para `module_dots` pontos por módulo, ganha a zona de
+silêncio e é empacotada direto em GS v 0 (faixas de escpos_image).
+
+O resultado fica num LRU limitado (QR_RASTER_CACHE_SIZE) por URL, tamanho
+do módulo e nível de correção: reimpressões e contas divididas reutilizam
+o raster sem recodificar.
+"""
+import os
+from functools import lru_cache
+from typing import List
+
+import numpy as np
+from dotenv import load_dotenv
+
+import escpos_image
+
+load_dotenv()
+
+QR_RASTER_CACHE_SIZE = int(os.getenv("QR_RASTER_CACHE_SIZE", "256"))
+
+QUIET_ZONE_MODULES = 4
+ERROR_LEVELS = "LMQH"
+# Bits de formato de cada nível (L=01, M=00, Q=11, H=10)
+_FORMAT_BITS = {"L": 1, "M": 0, "Q": 3, "H": 2}
+
+# Tabelas da norma, indexadas por versão (posição 0 sem uso)
+_ECC_CODEWORDS_PER_BLOCK = {
+    "L": (-1, 7, 10, 15, 20, 26, 18, 20, 24, 30, 18, 20, 24, 26, 30, 22, 24, 28, 30, 28, 28,
+          28, 28, 30, 30, 26, 28, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30),
+    "M": (-1, 10, 16, 26, 18, 24, 16, 18, 22, 22, 26, 30, 22, 22, 24, 24, 28, 28, 26, 26, 26,
+          26, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28),
+    "Q": (-1, 13, 22, 18, 26, 18, 24, 18, 22, 20, 24, 28, 26, 24, 20, 30, 24, 28, 28, 26, 30,
+          28, 30, 30, 30, 30, 28, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30),
+    "H": (-1, 17, 28, 22, 16, 22, 28, 26, 26, 24, 28, 24, 28, 22, 24, 24, 30, 28, 28, 26, 28,
+          30, 24, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30),
+}
+_NUM_ERROR_CORRECTION_BLOCKS = {
+    "L": (-1, 1, 1, 1, 1, 1, 2, 2, 2, 2, 4, 4, 4, 4, 4, 6, 6, 6, 6, 7, 8,
+          8, 9, 9, 10, 12, 12, 12, 13, 14, 15, 16, 17, 18, 19, 19, 20, 21, 22, 24, 25),
+    "M": (-1, 1, 1, 1, 2, 2, 4, 4, 4, 5, 5, 5, 8, 9, 9, 10, 10, 11, 13, 14, 16,
+          17, 17, 18, 20, 21, 23, 25, 26, 28, 29, 31, 33, 35, 37, 38, 40, 43, 45, 47, 49),
+    "Q": (-1, 1, 1, 2, 2, 4, 4, 6, 6, 8, 8, 8, 10, 12, 16, 12, 17, 16, 18, 21, 20,
+          23, 23, 25, 27, 29, 34, 34, 35, 38, 40, 43, 45, 48, 51, 53, 56, 59, 62, 65, 68),
+    "H": (-1, 1, 1, 2, 4, 4, 4, 5, 6, 8, 8, 11, 11, 16, 16, 18, 16, 19, 21, 25, 25,
+          25, 34, 30, 32, 35, 37, 40, 42, 45, 48, 51, 54, 57, 60, 63, 66, 70, 74, 77, 81),
+}
+
+# Penalidades das regras N1..N4
+_N1, _N2, _N3, _N4 = 3, 3, 40, 10
+_FINDER_LIKE = (
+    np.array([1, 0, 1, 1, 1, 0, 1, 0, 0, 0, 0], dtype=bool),
+    np.array([0, 0, 0, 0, 1, 0, 1, 1, 1, 0, 1], dtype=bool),
+)
+
+
+class QrDataTooLong(ValueError):
+    pass
+
+
+# --- Reed-Solomon em GF(256), polinômio 0x11D ---
+
+_GF_EXP = [0] * 512
+_GF_LOG = [0] * 256
+_value = 1
+for _i in range(255):
+    _GF_EXP[_i] = _value
+    _GF_LOG[_value] = _i
+    _value <<= 1
+    if _value & 0x100:
+        _value ^= 0x11D
+for _i in range(255, 512):
+    _GF_EXP[_i] = _GF_EXP[_i - 255]
+
+
+def _gf_mul(a: int, b: int) -> int:
+    if a == 0 or b == 0:
+        return 0
+    return _GF_EXP[_GF_LOG[a] + _GF_LOG[b]]
+
+
+@lru_cache(maxsize=None)
+def _rs_divisor(degree: int) -> tuple:
+    result = [0] * (degree - 1) + [1]
+    root = 1
+    for _ in range(degree):
+        for j in range(degree):
+            result[j] = _gf_mul(result[j], root)
+            if j + 1 < degree:
+                result[j] ^= result[j + 1]
+        root = _gf_mul(root, 2)
+    return tuple(result)
+
+
+def _rs_remainder(data: List[int], degree: int) -> List[int]:
+    divisor = _rs_divisor(degree)
+    result = [0] * degree
+    for byte in data:
+        factor = byte ^ result.pop(0)
+        result.append(0)
+        for j, coef in enumerate(divisor):
+            result[j] ^= _gf_mul(coef, factor)
+    return result
+
+
+# --- Capacidade e montagem dos codewords ---
+
+def _num_raw_data_modules(version: int) -> int:
+    result = (16 * version + 128) * version + 64
+    if version >= 2:
+        num_align = version // 7 + 2
+        result -= (25 * num_align - 10) * num_align - 55
+        if version >= 7:
+            result -= 36
+    return result
+
+
+def _num_data_codewords(version: int, level: str) -> int:
+    return (
+        _num_raw_data_modules(version) // 8
+        - _ECC_CODEWORDS_PER_BLOCK[level][version] * _NUM_ERROR_CORRECTION_BLOCKS[level][version]
+    )
+
+
+def _choose_version(length: int, level: str) -> int:
+    for version in range(1, 41):
+        count_bits = 8 if version <= 9 else 16
+        if 4 + count_bits + 8 * length <= _num_data_codewords(version, level) * 8:
+            return version
+    raise QrDataTooLong(f"Dados do QR longos demais ({length} bytes) para o nível {level}.")
+
+
+def _data_codewords(data: bytes, version: int, level: str) -> List[int]:
+    count_bits = 8 if version <= 9 else 16
+    bits = [0, 1, 0, 0]  # modo byte
+    bits += [(len(data) >> i) & 1 for i in reversed(range(count_bits))]
+    for byte in data:
+        bits += [(byte >> i) & 1 for i in reversed(range(8))]
+
+    capacity = _num_data_codewords(version, level) * 8
+    bits += [0] * min(4, capacity - len(bits))  # terminador
+    bits += [0] * (-len(bits) % 8)
+    codewords = [int("".join(map(str, bits[i:i + 8])), 2) for i in range(0, len(bits), 8)]
+    pad = 0xEC
+    while len(codewords) < capacity // 8:
+        codewords.append(pad)
+        pad ^= 0xEC ^ 0x11
+    return codewords
+
+
+def _interleave(data: List[int], version: int, level: str) -> List[int]:
+    num_blocks = _NUM_ERROR_CORRECTION_BLOCKS[level][version]
+    ecc_len = _ECC_CODEWORDS_PER_BLOCK[level][version]
+    raw_codewords = _num_raw_data_modules(version) // 8
+    num_short = num_blocks - raw_codewords % num_blocks
+    short_len = raw_codewords // num_blocks
+
+    blocks = []
+    offset = 0
+    for i in range(num_blocks):
+        size = short_len - ecc_len + (0 if i < num_short else 1)
+        block = data[offset:offset + size]
+        offset += size
+        ecc = _rs_remainder(block, ecc_len)
+        if i < num_short:
+            block = block + [0]  # posição vazia para alinhar com os blocos longos
+        blocks.append(block + ecc)
+
+    result = []
+    for i in range(len(blocks[0])):
+        for j, block in enumerate(blocks):
+            if i != short_len - ecc_len or j >= num_short:
+                result.append(block[i])
+    return result
+
+
+# --- Matriz ---
+
+def _alignment_positions(version: int) -> List[int]:
+    if version == 1:
+        return []
+    size = version * 4 + 17
+    num_align = version // 7 + 2
+    step = (version * 8 + num_align * 3 + 5) // (num_align * 4 - 4) * 2
+    return [6] + sorted(size - 7 - i * step for i in range(num_align - 1))
+
+
+def _format_bits(level: str, mask: int) -> int:
+    data = _FORMAT_BITS[level] << 3 | mask
+    rem = data
+    for _ in range(10):
+        rem = (rem << 1) ^ ((rem >> 9) * 0x537)
+    return (data << 10 | rem) ^ 0x5412
+
+
+def _draw_format(modules: np.ndarray, level: str, mask: int) -> None:
+    size = modules.shape[0]
+    bits = _format_bits(level, mask)
+    bit = [bool((bits >> i) & 1) for i in range(15)]
+    # modules[y, x]: y = linha, x = coluna
+    for i in range(6):
+        modules[i, 8] = bit[i]
+    modules[7, 8] = bit[6]
+    modules[8, 8] = bit[7]
+    modules[8, 7] = bit[8]
+    for i in range(9, 15):
+        modules[8, 14 - i] = bit[i]
+    for i in range(8):
+        modules[8, size - 1 - i] = bit[i]
+    for i in range(8, 15):
+        modules[size - 15 + i, 8] = bit[i]
+    modules[size - 8, 8] = True  # módulo escuro fixo
+
+
+def _function_patterns(version: int, level: str):
+    size = version * 4 + 17
+    modules = np.zeros((size, size), dtype=bool)
+    is_function = np.zeros((size, size), dtype=bool)
+
+    def put(y: int, x: int, dark: bool) -> None:
+        modules[y, x] = dark
+        is_function[y, x] = True
+
+    for i in range(size):
+        put(6, i, i % 2 == 0)
+        put(i, 6, i % 2 == 0)
+
+    for cy, cx in ((3, 3), (3, size - 4), (size - 4, 3)):
+        for dy in range(-4, 5):
+            for dx in range(-4, 5):
+                y, x = cy + dy, cx + dx
+                if 0 <= y < size and 0 <= x < size:
+                    put(y, x, max(abs(dx), abs(dy)) not in (2, 4))
+
+    positions = _alignment_positions(version)
+    last = len(positions) - 1
+    for i, cy in enumerate(positions):
+        for j, cx in enumerate(positions):
+            if (i, j) in ((0, 0), (0, last), (last, 0)):
+                continue
+            for dy in range(-2, 3):
+                for dx in range(-2, 3):
+                    put(cy + dy, cx + dx, max(abs(dx), abs(dy)) != 1)
+
+    # Reserva a área de formato (desenhada de verdade depois da máscara)
+    _draw_format(modules, level, 0)
+    is_function[:9, 8] = is_function[8, :9] = True
+    is_function[8, size - 8:] = is_function[size - 8:, 8] = True
+
+    if version >= 7:
+        rem = version
+        for _ in range(12):
+            rem = (rem << 1) ^ ((rem >> 11) * 0x1F25)
+        bits = version << 12 | rem
+        for i in range(18):
+            dark = bool((bits >> i) & 1)
+            a, b = size - 11 + i % 3, i // 3
+            put(b, a, dark)
+            put(a, b, dark)
+
+    return modules, is_function
+
+
+def _draw_codewords(modules: np.ndarray, is_function: np.ndarray, codewords: List[int]) -> None:
+    size = modules.shape[0]
+    total_bits = len(codewords) * 8
+    i = 0
+    right = size - 1
+    while right >= 1:
+        if right == 6:
+            right = 5
+        upward = ((right + 1) & 2) == 0
+        for vert in range(size):
+            y = size - 1 - vert if upward else vert
+            for x in (right, right - 1):
+                if not is_function[y, x] and i < total_bits:
+                    modules[y, x] = bool((codewords[i >> 3] >> (7 - (i & 7))) & 1)
+                    i += 1
+        right -= 2
+
+
+def _mask_pattern(size: int, mask: int) -> np.ndarray:
+    y, x = np.indices((size, size))
+    if mask == 0:
+        return (x + y) % 2 == 0
+    if mask == 1:
+        return y % 2 == 0
+    if mask == 2:
+        return x % 3 == 0
+    if mask == 3:
+        return (x + y) % 3 == 0
+    if mask == 4:
+        return (x // 3 + y // 2) % 2 == 0
+    if mask == 5:
+        return x * y % 2 + x * y % 3 == 0
+    if mask == 6:
+        return (x * y % 2 + x * y % 3) % 2 == 0
+    return ((x + y) % 2 + x * y % 3) % 2 == 0
+
+
+def _run_penalty(lines: np.ndarray) -> int:
+    score = 0
+    for line in lines:
+        changes = np.flatnonzero(np.diff(line.astype(np.int8))) + 1
+        runs = np.diff(np.concatenate(([0], changes, [len(line)])))
+        long_runs = runs[runs >= 5]
+        score += int((_N1 + long_runs - 5).sum())
+    return score
+
+
+def _finder_like_penalty(lines: np.ndarray) -> int:
+    # Borda clara de 4 módulos: a zona de silêncio conta como módulos claros
+    padded = np.pad(lines, ((0, 0), (4, 4)), constant_values=False)
+    windows = np.lib.stride_tricks.sliding_window_view(padded, 11, axis=1)
+    count = sum(int(np.all(windows == pattern, axis=2).sum()) for pattern in _FINDER_LIKE)
+    return count * _N3
+
+
+def _penalty(modules: np.ndarray) -> int:
+    score = _run_penalty(modules) + _run_penalty(modules.T)
+    same = (modules[:-1, :-1] == modules[1:, :-1]) & (modules[:-1, :-1] == modules[:-1, 1:]) \
+        & (modules[:-1, :-1] == modules[1:, 1:])
+    score += int(same.sum()) * _N2
+    score += _finder_like_penalty(modules) + _finder_like_penalty(modules.T)
+    total = modules.size
+    dark = int(modules.sum())
+    k = (abs(dark * 20 - total * 10) + total - 1) // total - 1
+    return score + k * _N4
+
+
+def encode(data: str, level: str = "M") -> np.ndarray:
+    """Matriz do QR (True = módulo escuro), sem zona de silêncio."""
+    if level not in ERROR_LEVELS:
+        raise ValueError(f"Nível de correção inválido: {level}")
+    payload = data.encode("utf-8")
+    version = _choose_version(len(payload), level)
+    codewords = _interleave(_data_codewords(payload, version, level), version, level)
+
+    base, is_function = _function_patterns(version, level)
+    _draw_codewords(base, is_function, codewords)
+
+    best = None
+    best_score = None
+    for mask in range(8):
+        candidate = base ^ (_mask_pattern(base.shape[0], mask) & ~is_function)
+        _draw_format(candidate, level, mask)
+        score = _penalty(candidate)
+        if best_score is None or score < best_score:
+            best, best_score = candidate, score
+    return best
+
+
+def fit_module_dots(modules: int, module_dots: int, max_width_dots: int) -> int:
+    """Reduz o módulo até o QR (com zona de silêncio) caber na largura do papel."""
+    total = modules + 2 * QUIET_ZONE_MODULES
+    return max(1, min(module_dots, max_width_dots // total))
+
+
+@lru_cache(maxsize=QR_RASTER_CACHE_SIZE)
+def qr_raster_escpos(data: str, module_dots: int = 6, level: str = "M",
+                     max_width_dots: int = escpos_image.DEFAULT_MAX_WIDTH_DOTS) -> bytes:
+    """QR pronto em comandos GS v 0 (faixas), sem alinhamento nem quebra de linha."""
+    matrix = encode(data, level)
+    module_dots = fit_module_dots(matrix.shape[0], module_dots, max_width_dots)
+    matrix = np.pad(matrix, QUIET_ZONE_MODULES, constant_values=False)
+    mask = np.kron(matrix, np.ones((module_dots, module_dots), dtype=bool))
+    mask = np.pad(mask, ((0, 0), (0, -mask.shape[1] % 8)), constant_values=False)
+    return b"".join(escpos_image.iter_raster_bands(mask))
+
+
+def cache_info() -> dict:
+    info = qr_raster_escpos.cache_info()
+    return {"hits": info.hits, "misses": info.misses, "size": info.currsize, "max_size": info.maxsize}
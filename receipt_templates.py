@@ -0,0 +1,255 @@
+"""
+Templates de comprovante pré-compilados.
+
+Um layout é compilado uma única vez em segmentos de bytes já
+transliterados/codificados e em slots para os campos variáveis.
+Renderizar passa a ser apenas juntar buffers prontos com os poucos
+campos que mudam a cada pedido.
+"""
+import os
+from functools import lru_cache
+from typing import Callable, Iterable, Iterator, Optional, Tuple, Union
+
+from dotenv import load_dotenv
+from unidecode import unidecode
+
+from printer_profiles import PrinterProfile
+
+load_dotenv()
+
+# Tamanho máximo de cada WritePrinter quando o documento é enviado em streaming
+PRINT_CHUNK_BYTES = int(os.getenv("PRINT_CHUNK_BYTES", "4096"))
+
+
+def encode_text(text: str) -> bytes:
+    return unidecode(text or "").encode("utf-8")
+
+
+class Slot:
+    """
+    Campo variável do template. Sem formatter o valor já deve vir em bytes
+    (ex.: bloco de itens renderizado à parte).
+    """
+
+    __slots__ = ("name", "formatter")
+
+    def __init__(self, name: str, formatter: Optional[Callable[[str], bytes]] = None):
+        self.name = name
+        self.formatter = formatter
+
+    def render(self, value) -> bytes:
+        if self.formatter is None:
+            return value or b""
+        return self.formatter("" if value is None else str(value))
+
+    def __repr__(self):
+        return f"Slot({self.name!r})"
+
+
+Segment = Union[bytes, Slot]
+
+
+class CompiledTemplate:
+    __slots__ = ("segments", "slot_names")
+
+    def __init__(self, segments: Tuple[Segment, ...]):
+        self.segments = segments
+        self.slot_names = tuple(seg.name for seg in segments if isinstance(seg, Slot))
+
+    def render(self, **values) -> bytes:
+        missing = [name for name in self.slot_names if name not in values]
+        if missing:
+            raise KeyError(f"Campos ausentes no template: {', '.join(missing)}")
+        return b"".join(
+            seg if isinstance(seg, bytes) else seg.render(values[seg.name])
+            for seg in self.segments
+        )
+
+    def iter_render(self, **values) -> Iterator[bytes]:
+        """
+        Como render(), mas emite segmento a segmento. Slots sem formatter
+        aceitam também um iterável de bytes (ex.: itens gerados sob demanda).
+        """
+        missing = [name for name in self.slot_names if name not in values]
+        if missing:
+            raise KeyError(f"Campos ausentes no template: {', '.join(missing)}")
+        for seg in self.segments:
+            if isinstance(seg, bytes):
+                yield seg
+                continue
+            value = values[seg.name]
+            if seg.formatter is None and value is not None and not isinstance(value, (bytes, bytearray)):
+                yield from value
+            else:
+                yield seg.render(value)
+
+    @property
+    def static_size(self) -> int:
+        return sum(len(seg) for seg in self.segments if isinstance(seg, bytes))
+
+
+def compile_template(parts: Iterable[Segment]) -> CompiledTemplate:
+    """Funde bytes estáticos adjacentes para que o render faça o mínimo de joins."""
+    segments = []
+    pending = []
+    for part in parts:
+        if isinstance(part, Slot):
+            if pending:
+                segments.append(b"".join(pending))
+                pending = []
+            segments.append(part)
+        else:
+            pending.append(bytes(part))
+    if pending:
+        segments.append(b"".join(pending))
+    return CompiledTemplate(tuple(segments))
+
+
+def chunked(parts: Iterable[bytes], size: int = PRINT_CHUNK_BYTES) -> Iterator[bytes]:
+    """
+    Junta pedaços pequenos e corta os grandes: cada chunk tem no máximo
+    `size` bytes e sai assim que fica cheio, então a impressora começa a
+    receber enquanto o resto do documento ainda está sendo renderizado.
+    """
+    buffer = bytearray()
+    for part in parts:
+        if not part:
+            continue
+        buffer += part
+        while len(buffer) >= size:
+            yield bytes(buffer[:size])
+            del buffer[:size]
+    if buffer:
+        yield bytes(buffer)
+
+
+def sliced(parts: Iterable[bytes], size: int = PRINT_CHUNK_BYTES) -> Iterator[memoryview]:
+    """
+    Para documentos já prontos (ex.: resultado do pool): corta cada pedaço
+    em fatias de até `size` bytes com memoryview, sem copiar o conteúdo.
+    """
+    for part in parts:
+        if not part:
+            continue
+        view = memoryview(part)
+        for start in range(0, len(view), size):
+            yield view[start:start + size]
+
+
+# ---------------------------------------------------------------------------
+# Comandas de pedido (copa/cozinha)
+# ---------------------------------------------------------------------------
+
+@lru_cache(maxsize=32)
+def order_header_template(titulo: str, profile: PrinterProfile) -> CompiledTemplate:
+    return compile_template([
+        b'\x1B\x40',  # Resetar a impressora (ESC @)
+        b'\x1B\x61\x01',  # Centralizar texto (ESC a 1)
+        b'\x1B\x21\x20',  # Fonte média
+        encode_text(f'#{titulo} '),
+        Slot("order_id", encode_text),
+        b'\n',
+        b'\x1B\x61\x00',  # Alinhar à esquerda (ESC a 0)
+        b'\x1B\x21\x00',  # Fonte pequena (ESC ! 0)
+        b'Data: ',
+        Slot("date_time", encode_text),
+        b'\nAtendente: ',
+        Slot("waiter", encode_text),
+        b'\n\n\n',
+    ])
+
+
+@lru_cache(maxsize=8)
+def order_dish_template(profile: PrinterProfile) -> CompiledTemplate:
+    return compile_template([
+        b'\x1B\x21\x30',  # Fonte muito grande (ESC ! 48)
+        b'\x1B\x45\x01',  # Ativar negrito (ESC E 1)
+        b' ',
+        Slot("amount", encode_text),
+        b' - ',
+        Slot("dish_name", encode_text),
+        b'\n\n',
+        b'\x1B\x45\x00',  # Desativar negrito (ESC E 0)
+        b'\x1B\x21\x20',  # Fonte média
+        b'\x1B\x61\x01',  # Centralizar texto (ESC a 1)
+        Slot("dish_note", encode_text),
+    ])
+
+
+@lru_cache(maxsize=8)
+def order_footer_template(profile: PrinterProfile) -> CompiledTemplate:
+    return compile_template([
+        b'\x1B\x61\x01',  # Centralizar texto (ESC a 1)
+        b'====\n\n',
+        Slot("order_note", encode_text),
+        b'\x1B\x45\x01',  # Ativar negrito (ESC E 1)
+        b'\x1B\x2D\x01',  # Ativa sublinhado
+        b'\x1B\x21\x30',  # Fonte muito grande (ESC ! 48)
+        b'* Mesa ',
+        Slot("table_label", encode_text),
+        b' *\n\n\n',
+        b'\x1B\x2D\x00',  # Desativa sublinhado
+        b'\x1B\x45\x00',  # Desativar negrito (ESC E 0)
+        b'\x1B\x61\x00',  # Alinhar à esquerda (ESC a 0)
+        b'\n----------------\n\n\n',
+    ])
+
+
+def format_amount(amount) -> str:
+    if amount == 0.5:
+        return 'Meio'
+    if amount > 0.5 and amount % 1 != 0:
+        return str(int(amount)) + ' e meio'
+    return str(int(amount))
+
+
+def render_order_header(order_id, date_time, waiter, titulo, profile: PrinterProfile) -> bytes:
+    return order_header_template(titulo, profile).render(
+        order_id=order_id, date_time=date_time, waiter=waiter
+    )
+
+
+def render_order_dish(dish_name, amount, dish_note, profile: PrinterProfile) -> bytes:
+    return order_dish_template(profile).render(
+        amount=format_amount(amount),
+        dish_name=dish_name,
+        dish_note=dish_note + '\n\n' if dish_note is not None else '',
+    )
+
+
+def render_order_delta_dish(line: dict, profile: PrinterProfile) -> bytes:
+    """
+    Linha de comanda incremental (ver order_state.diff): pratos novos saem
+    como na comanda normal; aumentos como "+N" e reduções/cancelamentos
+    como "CANCELAR N", com a quantidade que fica.
+    """
+    change = line["change"]
+    dish_note = line["dish_note"]
+    if change == "added":
+        return render_order_dish(line["dish_name"], line["amount"], dish_note, profile)
+    if change == "increased":
+        label = '+' + format_amount(line["difference"])
+        remark = f'(total {format_amount(line["amount"])})'
+    else:
+        label = 'CANCELAR ' + format_amount(line["difference"])
+        remark = '(cancelado)' if change == "cancelled" else f'(fica {format_amount(line["amount"])})'
+    if dish_note:
+        remark += '\n' + dish_note
+    return order_dish_template(profile).render(
+        amount=label,
+        dish_name=line["dish_name"],
+        dish_note=remark + '\n\n',
+    )
+
+
+def render_order_footer(order_note, table_number, is_outside, profile: PrinterProfile) -> bytes:
+    return order_footer_template(profile).render(
+        order_note=order_note + '\n\n' if order_note else '\n',
+        table_label='R' + str(table_number) if is_outside else str(table_number),
+    )
+
+
+def clear_caches() -> None:
+    order_header_template.cache_clear()
+    order_dish_template.cache_clear()
+    order_footer_template.cache_clear()
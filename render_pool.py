@@ -0,0 +1,87 @@
+"""
+Pool de processos para renderizações pesadas.
+
+Conta com logo (redimensionar + dithering), QR e muitas linhas, e o
+relatório do dashboard com foto, são CPU puro e disputam o GIL quando
+chegam juntos. Com RENDER_POOL_WORKERS > 0, documentos com pelo menos
+RENDER_POOL_MIN_ITEMS itens são renderizados num ProcessPoolExecutor; os
+menores (comandas da copa/cozinha) continuam na própria thread, sem custo
+de IPC. O resultado volta como os próprios bytes do documento, que vão
+direto para o WritePrinter.
+
+Se o pool quebrar (worker morto) ou não responder em RENDER_POOL_TIMEOUT,
+a renderização é refeita na thread.
+"""
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Optional
+
+from dotenv import load_dotenv
+
+import job_tracing
+
+load_dotenv()
+
+RENDER_POOL_WORKERS = int(os.getenv("RENDER_POOL_WORKERS", "0"))
+RENDER_POOL_MIN_ITEMS = int(os.getenv("RENDER_POOL_MIN_ITEMS", "40"))
+RENDER_POOL_TIMEOUT = float(os.getenv("RENDER_POOL_TIMEOUT", "30"))
+
+_executor: Optional[ProcessPoolExecutor] = None
+_lock = threading.Lock()
+
+
+def get_executor() -> Optional[ProcessPoolExecutor]:
+    global _executor
+    if RENDER_POOL_WORKERS <= 0:
+        return None
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ProcessPoolExecutor(max_workers=RENDER_POOL_WORKERS)
+    return _executor
+
+
+def shutdown() -> None:
+    global _executor
+    with _lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def should_offload(size: int) -> bool:
+    return RENDER_POOL_WORKERS > 0 and size >= RENDER_POOL_MIN_ITEMS
+
+
+def render(func: Callable, *args, size: int = 0):
+    """
+    Executa `func(*args)` no pool quando o documento é grande o bastante.
+    `func` precisa ser uma função de módulo (picklable) e devolver bytes
+    ou estruturas simples com bytes.
+    """
+    executor = get_executor() if should_offload(size) else None
+    if executor is None:
+        return func(*args)
+    with job_tracing.span("render_pool", size=size):
+        future = executor.submit(func, *args)
+        try:
+            return future.result(timeout=RENDER_POOL_TIMEOUT)
+        except BrokenProcessPool:
+            print("[RENDER] Pool de renderização quebrado, renderizando na thread.")
+            shutdown()
+        except FutureTimeoutError:
+            # Se já estiver rodando o worker termina sozinho; o resultado é descartado
+            future.cancel()
+            print(f"[RENDER] Pool sem resposta em {RENDER_POOL_TIMEOUT:g}s, renderizando na thread.")
+            job_tracing.set_attributes(render_pool_timeout=True)
+    return func(*args)
+
+
+def stats() -> dict:
+    return {
+        "workers": RENDER_POOL_WORKERS,
+        "min_items": RENDER_POOL_MIN_ITEMS,
+        "started": _executor is not None,
+    }
@@ -0,0 +1,234 @@
+"""
+Cache de fragmentos ESC/POS compartilhado entre workers do uvicorn.
+
+Cada entrada é um arquivo no diretório SHARED_CACHE_DIR, com nome igual
+ao hash (BLAKE2b) do conteúdo de entrada: namespace, versão do formato e
+os parâmetros que determinam os bytes. Entradas a partir de
+SHARED_CACHE_MMAP_MIN_KB saem como memoryview sobre o mmap do arquivo,
+sem copiar: todos os processos leem as mesmas páginas do cache do sistema.
+As menores (o logo, por exemplo) são copiadas e o arquivo é fechado na hora.
+Cada processo guarda até SHARED_CACHE_LOCAL_ENTRIES entradas abertas (LRU),
+então os acertos seguintes não fazem syscall. O cache continua quente
+depois de um restart.
+
+- No Windows um arquivo mapeado não pode ser removido nem substituído:
+  o mapa local é liberado antes de evict()/put() mexerem no arquivo e
+  nenhum processo segura mapas indefinidamente.
+
+- Escrita atômica (arquivo temporário + os.replace): não precisa de lock
+  entre processos; duas gravações da mesma chave produzem bytes iguais.
+- Cabeçalho com magic, versão e tamanho; entrada inválida é ignorada.
+- LRU pelo mtime, limitado a SHARED_CACHE_MAX_MB. O mtime de uma entrada
+  é atualizado no máximo a cada SHARED_CACHE_TOUCH_SECONDS.
+
+Sem SHARED_CACHE_DIR o cache fica desligado e get_or_create só chama a
+função que gera os bytes.
+"""
+import hashlib
+import mmap
+import os
+import secrets
+import struct
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple, Union
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SHARED_CACHE_DIR = os.getenv("SHARED_CACHE_DIR", "")
+SHARED_CACHE_MAX_MB = float(os.getenv("SHARED_CACHE_MAX_MB", "64"))
+SHARED_CACHE_TOUCH_SECONDS = float(os.getenv("SHARED_CACHE_TOUCH_SECONDS", "300"))
+SHARED_CACHE_MMAP_MIN_KB = float(os.getenv("SHARED_CACHE_MMAP_MIN_KB", "256"))
+SHARED_CACHE_LOCAL_ENTRIES = int(os.getenv("SHARED_CACHE_LOCAL_ENTRIES", "32"))
+
+# 2: dithering Floyd-Steinberg corrigido (logos gravados antes ficam de fora)
+FORMAT_VERSION = 2
+ENTRY_MAGIC = b"GSC1"
+ENTRY_HEADER = struct.Struct("<4sHQ")  # magic, versão, tamanho
+
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "evictions": 0}
+# chave -> (mmap ou None, conteúdo); ordem = uso mais recente no fim
+_entries: "OrderedDict[str, Tuple[Optional[mmap.mmap], Union[bytes, memoryview]]]" = OrderedDict()
+_touched: Dict[str, float] = {}
+
+
+def cache_key(namespace: str, *parts) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{namespace}\0{FORMAT_VERSION}".encode("utf-8"))
+    for part in parts:
+        digest.update(b"\0" + repr(part).encode("utf-8"))
+    return f"{namespace}-{digest.hexdigest()}"
+
+
+def _path(key: str) -> str:
+    return os.path.join(SHARED_CACHE_DIR, key + ".bin")
+
+
+def _count(field: str) -> None:
+    with _lock:
+        _stats[field] += 1
+
+
+def _load_entry(key: str) -> Optional[Tuple[Optional[mmap.mmap], Union[bytes, memoryview]]]:
+    mapped = None
+    try:
+        with open(_path(key), "rb") as fh:
+            if os.fstat(fh.fileno()).st_size >= SHARED_CACHE_MMAP_MIN_KB * 1024:
+                raw = mapped = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                raw = fh.read()
+    except (OSError, ValueError):
+        return None
+    valid = len(raw) >= ENTRY_HEADER.size
+    if valid:
+        magic, version, size = ENTRY_HEADER.unpack_from(raw)
+        valid = magic == ENTRY_MAGIC and version == FORMAT_VERSION and len(raw) == ENTRY_HEADER.size + size
+    if not valid:
+        if mapped is not None:
+            mapped.close()
+        return None
+    if mapped is None:
+        return None, raw[ENTRY_HEADER.size:]
+    # O memoryview mantém o mmap vivo enquanto houver quem o use
+    return mapped, memoryview(mapped)[ENTRY_HEADER.size:]
+
+
+def _close(mapped: Optional[mmap.mmap]) -> None:
+    if mapped is None:
+        return
+    try:
+        mapped.close()
+    except BufferError:
+        pass  # ainda há um memoryview em uso (impressão em andamento); fecha ao ser coletado
+
+
+def _forget(key: str) -> None:
+    """Libera a entrada local antes de remover/substituir o arquivo."""
+    with _lock:
+        entry = _entries.pop(key, None)
+        _touched.pop(key, None)
+    if entry is not None:
+        mapped = entry[0]
+        del entry
+        _close(mapped)
+
+
+def _touch(key: str) -> None:
+    """Marca como usado recentemente (LRU), sem um utime por acerto."""
+    now = time.monotonic()
+    with _lock:
+        if now - _touched.get(key, float("-inf")) < SHARED_CACHE_TOUCH_SECONDS:
+            return
+        _touched[key] = now
+    try:
+        os.utime(_path(key))
+    except OSError:
+        pass
+
+
+def get(key: str) -> Optional[Union[bytes, memoryview]]:
+    """Conteúdo da entrada: memoryview somente leitura (sem cópia) ou bytes, se pequena."""
+    if not SHARED_CACHE_DIR:
+        return None
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None:
+            _entries.move_to_end(key)
+    if entry is None:
+        entry = _load_entry(key)
+        if entry is None:
+            return None
+        dropped = []
+        with _lock:
+            current = _entries.setdefault(key, entry)
+            if current is not entry:
+                dropped.append(entry[0])  # outra thread mapeou primeiro
+                entry = current
+            while len(_entries) > SHARED_CACHE_LOCAL_ENTRIES:
+                dropped.append(_entries.popitem(last=False)[1][0])
+        for mapped in dropped:
+            _close(mapped)
+    _touch(key)
+    return entry[1]
+
+
+def put(key: str, data: bytes) -> None:
+    if not SHARED_CACHE_DIR:
+        return
+    tmp_path = f"{_path(key)}.{os.getpid()}.{secrets.token_hex(4)}.tmp"
+    _forget(key)
+    try:
+        os.makedirs(SHARED_CACHE_DIR, exist_ok=True)
+        with open(tmp_path, "wb") as fh:
+            fh.write(ENTRY_HEADER.pack(ENTRY_MAGIC, FORMAT_VERSION, len(data)))
+            fh.write(data)
+        os.replace(tmp_path, _path(key))
+    except OSError as exc:
+        # No Windows o replace falha se outro worker estiver lendo a mesma chave;
+        # o conteúdo é idêntico, então basta descartar o temporário.
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        print(f"[CACHE] Não foi possível gravar {key}: {exc}")
+        return
+    evict()
+
+
+def get_or_create(key: str, factory: Callable[[], Optional[bytes]]) -> Optional[Union[bytes, memoryview]]:
+    """Lê do cache compartilhado ou gera com `factory` e grava (None não é gravado)."""
+    data = get(key)
+    if data is not None:
+        _count("hits")
+        return data
+    _count("misses")
+    data = factory()
+    if data is not None:
+        put(key, data)
+    return data
+
+
+def evict() -> None:
+    """Remove as entradas menos usadas até caber em SHARED_CACHE_MAX_MB."""
+    limit = int(SHARED_CACHE_MAX_MB * 1024 * 1024)
+    try:
+        entries = []
+        total = 0
+        with os.scandir(SHARED_CACHE_DIR) as it:
+            for entry in it:
+                if not entry.name.endswith(".bin"):
+                    continue
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+    except OSError:
+        return
+    if total <= limit:
+        return
+    entries.sort()
+    for _, size, path in entries:
+        if total <= limit:
+            break
+        # Solta o mapa deste processo primeiro: no Windows, arquivo mapeado não pode ser removido
+        _forget(os.path.basename(path)[:-len(".bin")])
+        try:
+            os.remove(path)
+        except OSError:
+            continue  # em uso por outro worker (Windows)
+        total -= size
+        _count("evictions")
+
+
+def stats() -> dict:
+    with _lock:
+        data = dict(_stats)
+        data["local"] = len(_entries)
+        data["mapped"] = sum(1 for mapped, _ in _entries.values() if mapped is not None)
+    data["enabled"] = bool(SHARED_CACHE_DIR)
+    data["directory"] = SHARED_CACHE_DIR
+    data["max_mb"] = SHARED_CACHE_MAX_MB
+    return data
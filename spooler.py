@@ -0,0 +1,498 @@
+"""
+Ponto único de acesso ao spooler de impressão.
+
+Os módulos de impressão usam `from spooler import win32print` com a mesma
+API do pywin32. Em produção (PRINTER_BACKEND=win32, padrão) tudo é
+repassado ao win32print real; com PRINTER_BACKEND=stub as chamadas vão
+para um spooler em memória, o que permite rodar a API e o gerador de
+carga em Linux sem impressora. PRINTER_BACKEND=tcp envia os bytes RAW
+direto para host:porta (impressora de rede na 9100 ou o emulador
+`escpos_emulator.py`), conforme PRINTER_TCP_MAP / PRINTER_TCP_DEFAULT.
+
+Com TICKET_ARCHIVE_DIR definido, cada documento que passa por aqui é
+também gravado no arquivo de tickets (ver ticket_archive.py).
+"""
+import json
+import os
+import select
+import socket
+import threading
+import time
+from contextvars import ContextVar
+from itertools import count
+from typing import Optional
+
+from dotenv import load_dotenv
+
+import escpos_status
+import job_tracing
+import ticket_archive
+
+load_dotenv()
+
+PRINTER_BACKEND = os.getenv("PRINTER_BACKEND", "win32")
+
+# Situação do último documento enviado nesta requisição:
+# spooled (entregue ao spooler), sending, printed, unconfirmed ou failed
+_job_status: ContextVar[Optional[dict]] = ContextVar("spooler_job_status", default=None)
+
+
+def _set_job_status(status: str, detail: Optional[str] = None) -> None:
+    _job_status.set({"status": status, "detail": detail})
+    job_tracing.set_attributes(print_status=status)
+
+
+def last_job_status() -> Optional[dict]:
+    return _job_status.get()
+
+
+class StubSpooler:
+    """
+    Imita a API do win32print. Cada WritePrinter pode simular o tempo de
+    impressão (bytes_per_sec) e cada job uma latência fixa de spool (job_ms).
+    """
+
+    def __init__(self, bytes_per_sec: float = 0.0, job_ms: float = 0.0):
+        self.bytes_per_sec = bytes_per_sec
+        self.job_ms = job_ms
+        self.offline = set()
+        self._handles = count(1)
+        self._lock = threading.Lock()
+        self.jobs = 0
+        self.bytes_written = 0
+
+    def OpenPrinter(self, printer_name):
+        if not printer_name or printer_name in self.offline:
+            raise OSError(f"Impressora indisponível: {printer_name}")
+        return next(self._handles)
+
+    def GetPrinter(self, handle, level=2):
+        return {"pPrinterName": str(handle), "Status": 0}
+
+    def ClosePrinter(self, handle):
+        return None
+
+    def StartDocPrinter(self, handle, level, doc_info):
+        return handle
+
+    def StartPagePrinter(self, handle):
+        return None
+
+    def WritePrinter(self, handle, data):
+        if self.bytes_per_sec:
+            time.sleep(len(data) / self.bytes_per_sec)
+        with self._lock:
+            self.bytes_written += len(data)
+        return len(data)
+
+    def EndPagePrinter(self, handle):
+        return None
+
+    def AbortPrinter(self, handle):
+        _set_job_status("failed", "job cancelado")
+        return None
+
+    def EndDocPrinter(self, handle):
+        if self.job_ms:
+            time.sleep(self.job_ms / 1000.0)
+        with self._lock:
+            self.jobs += 1
+        _set_job_status("spooled")
+        return None
+
+
+class PrinterStatusError(OSError):
+    pass
+
+
+# Fim de um ticket abortado no meio pela porta RAW (ESC @, aviso, avanço e corte)
+CANCELLED_TRAILER = b"\x1B\x40\x1B\x61\x01\n*** IMPRESSAO CANCELADA ***\n\n\n\n\x1B\x69"
+
+
+class TcpSpooler:
+    """
+    Envia cada documento por uma conexão TCP RAW (estilo porta 9100).
+    O mapeamento nome da impressora -> host:porta vem de PRINTER_TCP_MAP
+    (JSON) ou PRINTER_TCP_DEFAULT para qualquer nome.
+
+    Com status habilitado (padrão) o canal é bidirecional: GetPrinter
+    consulta DLE EOT (papel, tampa, erro), cada job liga o ASB para saber
+    na hora se o papel acabar e termina com GS ( H, cuja resposta confirma
+    que o ticket foi impresso.
+    """
+
+    def __init__(
+        self,
+        address_map=None,
+        default_address=None,
+        timeout: float = 10.0,
+        status_enabled: bool = True,
+        status_timeout: float = 0.5,
+        confirm_timeout: float = 30.0,
+    ):
+        self.address_map = address_map or {}
+        self.default_address = default_address
+        self.timeout = timeout
+        self.status_enabled = status_enabled
+        self.status_timeout = status_timeout
+        self.confirm_timeout = confirm_timeout
+        self._handles = count(1)
+        self._process_ids = count(1)
+        self._open = {}
+        self._lock = threading.Lock()
+
+    def _address(self, printer_name):
+        address = self.address_map.get(printer_name) or self.default_address
+        if not address:
+            raise OSError(f"Impressora sem endereço TCP: {printer_name}")
+        host, _, port = address.rpartition(":")
+        return host or "127.0.0.1", int(port)
+
+    def OpenPrinter(self, printer_name):
+        address = self._address(printer_name)
+        handle = next(self._handles)
+        with self._lock:
+            self._open[handle] = {"name": printer_name, "address": address, "sock": None, "reader": None}
+        return handle
+
+    def query_status(self, address) -> escpos_status.PrinterStatus:
+        reader = escpos_status.StatusReader()
+        with socket.create_connection(address, timeout=self.timeout) as sock:
+            sock.sendall(escpos_status.QUERY_ALL)
+            reader.expect(escpos_status.QUERY_ALL)
+            deadline = time.monotonic() + self.status_timeout
+            while not reader.complete:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not select.select([sock], [], [], remaining)[0]:
+                    break  # impressora sem resposta de status: trata como pronta
+                data = sock.recv(64)
+                if not data:
+                    break
+                reader.feed(data)
+        return reader.status
+
+    def GetPrinter(self, handle, level=2):
+        info = self._open[handle]
+        if not self.status_enabled:
+            # Sonda simples: consegue abrir conexão?
+            with socket.create_connection(info["address"], timeout=self.timeout):
+                pass
+            return {"pPrinterName": info["name"], "Status": 0}
+
+        status = self.query_status(info["address"])
+        problem = status.problem()
+        if problem:
+            raise PrinterStatusError(f"{info['name']}: {problem}")
+        return {"pPrinterName": info["name"], "Status": 0, "Escpos": status.to_dict()}
+
+    def ClosePrinter(self, handle):
+        with self._lock:
+            info = self._open.pop(handle, None)
+        if info and info["sock"]:
+            info["sock"].close()
+
+    def StartDocPrinter(self, handle, level, doc_info):
+        info = self._open[handle]
+        info["sock"] = socket.create_connection(info["address"], timeout=self.timeout)
+        _set_job_status("sending")
+        if self.status_enabled:
+            info["reader"] = escpos_status.StatusReader()
+            info["sock"].sendall(escpos_status.enable_asb())
+        return handle
+
+    def StartPagePrinter(self, handle):
+        return None
+
+    def _poll_status(self, info) -> None:
+        sock, reader = info["sock"], info["reader"]
+        while select.select([sock], [], [], 0)[0]:
+            data = sock.recv(256)
+            if not data:
+                break
+            reader.feed(data)
+        problem = reader.status.problem()
+        if problem:
+            _set_job_status("failed", problem)
+            raise PrinterStatusError(f"{info['name']}: {problem}")
+
+    def WritePrinter(self, handle, data):
+        info = self._open[handle]
+        if info["reader"] is not None:
+            self._poll_status(info)
+        info["sock"].sendall(data)
+        return len(data)
+
+    def EndPagePrinter(self, handle):
+        return None
+
+    def AbortPrinter(self, handle):
+        """
+        O que já foi enviado pela porta RAW não volta: fecha o ticket com um
+        aviso de cancelado e corte, sem esperar confirmação.
+        """
+        info = self._open[handle]
+        sock = info["sock"]
+        info["sock"] = None
+        _set_job_status("failed", "job cancelado")
+        if not sock:
+            return
+        try:
+            sock.sendall(CANCELLED_TRAILER)
+        except OSError:
+            pass
+        finally:
+            sock.close()
+
+    def _wait_printed(self, sock, reader, process_id: bytes) -> None:
+        deadline = time.monotonic() + self.confirm_timeout
+        while process_id not in reader.completed_ids:
+            problem = reader.status.problem()
+            if problem:
+                _set_job_status("failed", problem)
+                return
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([sock], [], [], remaining)[0]:
+                _set_job_status("unconfirmed", "sem confirmação da impressora")
+                return
+            data = sock.recv(256)
+            if not data:
+                problem = reader.status.problem()
+                _set_job_status("failed" if problem else "unconfirmed", problem or "conexão encerrada")
+                return
+            reader.feed(data)
+        _set_job_status("printed")
+
+    def EndDocPrinter(self, handle):
+        info = self._open[handle]
+        sock = info["sock"]
+        info["sock"] = None
+        if not sock:
+            return
+        try:
+            if info["reader"] is not None:
+                process_id = escpos_status.make_process_id(next(self._process_ids))
+                sock.sendall(escpos_status.process_id_request(process_id))
+                sock.shutdown(socket.SHUT_WR)
+                self._wait_printed(sock, info["reader"], process_id)
+            else:
+                sock.shutdown(socket.SHUT_WR)
+                _set_job_status("spooled")
+        finally:
+            sock.close()
+
+
+def _load_backend(name: str):
+    if os.getenv("CLUSTER_ENABLED", "0") == "1":
+        import cluster
+
+        return cluster.ClusterSpooler(_load_device_backend(name))
+    return _load_device_backend(name)
+
+
+def _load_device_backend(name: str):
+    if name == "stub":
+        return StubSpooler(
+            bytes_per_sec=float(os.getenv("STUB_PRINTER_BYTES_PER_SEC", "0") or 0),
+            job_ms=float(os.getenv("STUB_PRINTER_JOB_MS", "0") or 0),
+        )
+    if name == "tcp":
+        return TcpSpooler(
+            address_map=json.loads(os.getenv("PRINTER_TCP_MAP", "") or "{}"),
+            default_address=os.getenv("PRINTER_TCP_DEFAULT") or None,
+            timeout=float(os.getenv("PRINTER_TCP_TIMEOUT", "10") or 10),
+            status_enabled=os.getenv("PRINTER_TCP_STATUS", "1") == "1",
+            status_timeout=float(os.getenv("PRINTER_STATUS_TIMEOUT", "0.5") or 0.5),
+            confirm_timeout=float(os.getenv("PRINTER_CONFIRM_TIMEOUT", "30") or 30),
+        )
+    from win32 import win32print as real_win32print
+
+    return real_win32print
+
+
+# Chamadas do spooler que viram spans quando há um job sendo rastreado
+TRACED_CALLS = {
+    "OpenPrinter", "GetPrinter", "StartDocPrinter", "WritePrinter",
+    "EndPagePrinter", "EndDocPrinter", "AbortPrinter", "ClosePrinter",
+}
+
+
+def _traced(name, func):
+    def wrapper(*args):
+        attributes = {"bytes": len(args[1])} if name == "WritePrinter" else {}
+        with job_tracing.span(f"spool.{name}", **attributes):
+            return func(*args)
+
+    return wrapper
+
+
+# Chamadas acompanhadas para gravar o documento no arquivo de tickets
+ARCHIVED_CALLS = {"OpenPrinter", "StartDocPrinter", "WritePrinter", "EndDocPrinter", "AbortPrinter", "ClosePrinter"}
+
+# Reimpressões e jobs recebidos de outro nó do cluster já estão arquivados
+_archive_enabled: ContextVar[bool] = ContextVar("spooler_archive_enabled", default=True)
+_open_printers = {}
+_documents = {}
+
+
+def _archive_document(document: dict) -> None:
+    writer = document["writer"]
+    if not writer.size:
+        writer.abort()
+        return
+    trace = job_tracing.current_trace()
+    attributes = trace.attributes if trace is not None else {}
+    job = last_job_status() or {}
+    try:
+        entry = writer.commit(
+            order_id=attributes.get("order_id"),
+            table=attributes.get("table"),
+            access_key=attributes.get("access_key"),
+            endpoint=attributes.get("endpoint"),
+            print_status=job.get("status"),
+        )
+    except OSError as exc:
+        print(f"[ARQUIVO] Falha ao arquivar {document['doc']}: {exc}")
+        return
+    job_tracing.set_attributes(archive_job_id=entry["job_id"])
+
+
+def _archived(name, func):
+    def wrapper(*args):
+        if name == "EndDocPrinter":
+            document = _documents.pop(args[0], None)
+            try:
+                return func(*args)
+            finally:
+                if document is not None:
+                    _archive_document(document)
+        result = func(*args)
+        if name == "OpenPrinter":
+            _open_printers[result] = args[0]
+        elif name == "StartDocPrinter":
+            doc_info = args[2] if len(args) > 2 else None
+            doc_name = doc_info[0] if doc_info else ""
+            _documents[args[0]] = {
+                "doc": doc_name,
+                # Comprime cada pedaço no WritePrinter: o documento inteiro nunca fica em memória
+                "writer": ticket_archive.get_archive().writer(_open_printers.get(args[0]), doc_name),
+            }
+        elif name == "WritePrinter" and args[0] in _documents:
+            _documents[args[0]]["writer"].write(args[1])
+        elif name == "AbortPrinter":
+            # Job cancelado: não vai para o arquivo
+            document = _documents.pop(args[0], None)
+            if document is not None:
+                document["writer"].abort()
+        elif name == "ClosePrinter":
+            _open_printers.pop(args[0], None)
+            document = _documents.pop(args[0], None)
+            if document is not None:
+                document["writer"].abort()
+        return result
+
+    return wrapper
+
+
+class _SpoolerProxy:
+    """Repassa os atributos ao backend atual (permite trocar em runtime)."""
+
+    def __getattr__(self, name):
+        attr = getattr(get_backend(), name)
+        if name in TRACED_CALLS and job_tracing.current_trace() is not None:
+            attr = _traced(name, attr)
+        if name in ARCHIVED_CALLS and _archive_enabled.get() and ticket_archive.TICKET_ARCHIVE_DIR:
+            attr = _archived(name, attr)
+        return attr
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = _load_backend(PRINTER_BACKEND)
+    return _backend
+
+
+def set_backend(backend) -> None:
+    global _backend
+    with _backend_lock:
+        _backend = backend
+
+
+win32print = _SpoolerProxy()
+
+
+def backend_printer_status(backend, printer_name: str) -> dict:
+    try:
+        if hasattr(backend, "query_status"):
+            status = backend.query_status(backend._address(printer_name))
+            return {"printer": printer_name, "reachable": True, **status.to_dict()}
+        handle = backend.OpenPrinter(printer_name)
+        try:
+            backend.GetPrinter(handle, 2)
+        finally:
+            backend.ClosePrinter(handle)
+        return {"printer": printer_name, "reachable": True, "ready": True}
+    except Exception as exc:
+        return {"printer": printer_name, "reachable": False, "ready": False, "error": str(exc)}
+
+
+def printer_status(printer_name: str) -> dict:
+    """Status atual de uma impressora (DLE EOT quando o backend suporta)."""
+    backend = get_backend()
+    if hasattr(backend, "printer_status"):
+        return backend.printer_status(printer_name)
+    return backend_printer_status(backend, printer_name)
+
+
+def print_raw(printer_name: str, doc_name: str, data, archive: bool = True) -> dict:
+    """
+    Envia um documento ESC/POS já renderizado como um único job RAW.
+    `data` pode ser bytes ou um iterável de pedaços (escritos um a um).
+    Com archive=False o documento não é gravado de novo no arquivo.
+    """
+    chunks = (data,) if isinstance(data, (bytes, bytearray, memoryview)) else data
+    archive_token = _archive_enabled.set(archive and _archive_enabled.get())
+    hPrinter = None
+    doc_started = False
+    page_started = False
+    try:
+        hPrinter = win32print.OpenPrinter(printer_name)
+        win32print.StartDocPrinter(hPrinter, 1, (doc_name, None, "RAW"))
+        doc_started = True
+        win32print.StartPagePrinter(hPrinter)
+        page_started = True
+        for chunk in chunks:
+            win32print.WritePrinter(hPrinter, chunk)
+    except Exception:
+        if doc_started and hPrinter:
+            # Documento incompleto: cancela em vez de finalizar
+            try:
+                win32print.AbortPrinter(hPrinter)
+            except Exception:
+                pass
+            doc_started = page_started = False
+        raise
+    finally:
+        if page_started and hPrinter:
+            try:
+                win32print.EndPagePrinter(hPrinter)
+            except Exception:
+                pass
+        if doc_started and hPrinter:
+            try:
+                win32print.EndDocPrinter(hPrinter)
+            except Exception:
+                pass
+        if hPrinter:
+            try:
+                win32print.ClosePrinter(hPrinter)
+            except Exception:
+                pass
+        _archive_enabled.reset(archive_token)
+    return last_job_status() or {"status": "spooled", "detail": None}
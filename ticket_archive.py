@@ -0,0 +1,383 @@
+"""
+Arquivo comprimido dos documentos ESC/POS já renderizados.
+
+Cada documento enviado ao spooler é comprimido à medida que os pedaços
+chegam ao WritePrinter (zstd quando o pacote `zstandard` está instalado,
+senão zlib) e gravado em segmentos diários append-only. Um índice jsonl,
+também append-only, guarda job id, pedido, mesa, data, impressora e chave
+de acesso NFC-e. As leituras usam mmap dos segmentos, então reimprimir é
+só descomprimir e enviar os bytes, sem renderizar de novo.
+
+Com vários workers do uvicorn, cada processo escreve só nos seus arquivos
+(`segment_AAAAMMDD_<pid>.bin` e `index_<pid>.jsonl`), sem lock entre
+processos. Os índices dos outros workers são lidos incrementalmente numa
+busca ou quando um job id não é encontrado.
+
+Habilitado quando TICKET_ARCHIVE_DIR está definido. Segmentos mais antigos
+que TICKET_ARCHIVE_RETENTION_DAYS são apagados.
+"""
+import json
+import mmap
+import os
+import secrets
+import shutil
+import struct
+import tempfile
+import threading
+import zlib
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterator, List, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+try:
+    import zstandard
+except ImportError:  # opcional
+    zstandard = None
+
+TICKET_ARCHIVE_DIR = os.getenv("TICKET_ARCHIVE_DIR", "")
+TICKET_ARCHIVE_RETENTION_DAYS = int(os.getenv("TICKET_ARCHIVE_RETENTION_DAYS", "30"))
+TICKET_ARCHIVE_CODEC = os.getenv("TICKET_ARCHIVE_CODEC", "zstd" if zstandard else "zlib")
+
+RECORD_MAGIC = b"GTA1"
+RECORD_HEADER = struct.Struct("<4sBII")  # magic, codec, tamanho comprimido, tamanho original
+CODEC_ZLIB = 1
+CODEC_ZSTD = 2
+CODEC_IDS = {"zlib": CODEC_ZLIB, "zstd": CODEC_ZSTD}
+STREAM_CHUNK = 16 * 1024
+# Documento comprimido acima disso vai para arquivo temporário até o EndDocPrinter
+SPOOL_MEMORY_BYTES = 256 * 1024
+
+INDEX_FIELDS = ("order_id", "table", "date", "access_key")
+
+
+class ArchiveEntry(dict):
+    """Linha do índice (dict simples para serializar direto em JSON)."""
+
+
+def _segment_date(segment: str) -> str:
+    return segment[len("segment_"):len("segment_") + 8]
+
+
+class DocumentWriter:
+    """Documento sendo arquivado: cada pedaço é comprimido assim que chega."""
+
+    def __init__(self, archive: "TicketArchive", printer: str, doc_name: str):
+        self.archive = archive
+        self.printer = printer
+        self.doc_name = doc_name
+        self.size = 0
+        self._compressor = archive._compressor()
+        self._buffer = tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY_BYTES)
+
+    def write(self, data) -> None:
+        self.size += len(data)
+        compressed = self._compressor.compress(data)
+        if compressed:
+            self._buffer.write(compressed)
+
+    def commit(self, **metadata) -> "ArchiveEntry":
+        try:
+            self._buffer.write(self._compressor.flush())
+            return self.archive._append(self._buffer, self.size, self.printer, self.doc_name, metadata)
+        finally:
+            self._buffer.close()
+
+    def abort(self) -> None:
+        self._buffer.close()
+
+
+class TicketArchive:
+    def __init__(self, directory: str, retention_days: int = 30, codec: str = "zlib"):
+        self.directory = directory
+        self.retention_days = retention_days
+        if codec == "zstd" and zstandard is None:
+            print("[ARQUIVO] zstandard não instalado, usando zlib.")
+            codec = "zlib"
+        self.codec = CODEC_IDS.get(codec, CODEC_ZLIB)
+        self.entries: Dict[str, ArchiveEntry] = {}
+        self.by_field: Dict[str, Dict[str, List[str]]] = {field: {} for field in INDEX_FIELDS}
+        self._maps: Dict[str, mmap.mmap] = {}
+        self._index_offsets: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._last_prune: Optional[date] = None
+        os.makedirs(directory, exist_ok=True)
+        self._refresh_index()
+        self.prune()
+
+    # -- índice --------------------------------------------------------------
+
+    @property
+    def index_path(self) -> str:
+        return os.path.join(self.directory, f"index_{os.getpid()}.jsonl")
+
+    def _index_files(self) -> List[str]:
+        # index.jsonl é o índice único das versões anteriores
+        return sorted(
+            os.path.join(self.directory, name)
+            for name in os.listdir(self.directory)
+            if name.startswith("index") and name.endswith(".jsonl")
+        )
+
+    def _refresh_index(self) -> None:
+        """Lê as linhas novas dos índices (dos outros workers e dos antigos)."""
+        with self._lock:
+            for path in self._index_files():
+                # O próprio índice só é lido na carga; depois só este processo escreve nele
+                if path == self.index_path and path in self._index_offsets:
+                    continue
+                self._read_index(path)
+
+    def _read_index(self, path: str) -> None:
+        offset = self._index_offsets.get(path, 0)
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        if size < offset:
+            offset = 0  # compactado pelo worker dono; _add_to_index ignora repetidos
+        if size == offset:
+            return
+        with open(path, "rb") as fh:
+            fh.seek(offset)
+            data = fh.read(size - offset)
+        # Linha sem \n ainda está sendo escrita (ou foi truncada): fica para a próxima
+        complete = data.rfind(b"\n") + 1
+        self._index_offsets[path] = offset + complete
+        for line in data[:complete].splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                self._add_to_index(ArchiveEntry(json.loads(line)))
+            except ValueError:
+                continue  # linha truncada por queda de energia
+
+    def _add_to_index(self, entry: ArchiveEntry) -> None:
+        if entry["job_id"] in self.entries:
+            return
+        self.entries[entry["job_id"]] = entry
+        for field in INDEX_FIELDS:
+            value = entry.get(field)
+            if value not in (None, ""):
+                self.by_field[field].setdefault(str(value), []).append(entry["job_id"])
+
+    # -- escrita -------------------------------------------------------------
+
+    def _compressor(self):
+        if self.codec == CODEC_ZSTD:
+            return zstandard.ZstdCompressor(level=3).compressobj()
+        return zlib.compressobj(6)
+
+    def writer(self, printer: str, doc_name: str) -> DocumentWriter:
+        return DocumentWriter(self, printer, doc_name)
+
+    def store(self, data: bytes, printer: str, doc_name: str, **metadata) -> ArchiveEntry:
+        writer = self.writer(printer, doc_name)
+        writer.write(data)
+        return writer.commit(**metadata)
+
+    def _append(self, payload, size: int, printer: str, doc_name: str, metadata: dict) -> ArchiveEntry:
+        now = datetime.now()
+        compressed = payload.tell()
+        payload.seek(0)
+        segment = f"segment_{now:%Y%m%d}_{os.getpid()}.bin"
+        entry = ArchiveEntry(
+            job_id=secrets.token_hex(6),
+            segment=segment,
+            codec=self.codec,
+            size=size,
+            compressed=compressed,
+            printer=printer,
+            doc_name=doc_name,
+            created_at=now.isoformat(timespec="seconds"),
+            date=now.date().isoformat(),
+            **{key: value for key, value in metadata.items() if value not in (None, "")},
+        )
+        with self._lock:
+            # Segmento e índice são só deste processo: o offset do tell() é confiável
+            path = os.path.join(self.directory, segment)
+            with open(path, "ab") as fh:
+                entry["offset"] = fh.tell() + RECORD_HEADER.size
+                fh.write(RECORD_HEADER.pack(RECORD_MAGIC, self.codec, compressed, size))
+                shutil.copyfileobj(payload, fh, STREAM_CHUNK)
+            with open(self.index_path, "a", encoding="utf-8") as fh:
+                fh.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self._add_to_index(entry)
+        if self._last_prune != now.date():
+            self.prune()
+        return entry
+
+    # -- leitura -------------------------------------------------------------
+
+    def _segment_view(self, segment: str, end: int) -> mmap.mmap:
+        mapped = self._maps.get(segment)
+        if mapped is None or len(mapped) < end:
+            # O mapa antigo não é fechado aqui: uma reimpressão em andamento pode
+            # ainda ter um memoryview dele. O GC o fecha quando o último view sair.
+            with open(os.path.join(self.directory, segment), "rb") as fh:
+                mapped = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[segment] = mapped
+        return mapped
+
+    def iter_document(self, entry: ArchiveEntry, chunk_size: int = STREAM_CHUNK) -> Iterator[bytes]:
+        """Descomprime em streaming: a memória fica limitada ao tamanho do pedaço."""
+        start = entry["offset"]
+        end = start + entry["compressed"]
+        with self._lock:
+            view = memoryview(self._segment_view(entry["segment"], end))[start:end]
+        try:
+            if entry["codec"] == CODEC_ZSTD:
+                reader = zstandard.ZstdDecompressor().stream_reader(view)
+                while True:
+                    chunk = reader.read(chunk_size)
+                    if not chunk:
+                        return
+                    yield chunk
+            decompressor = zlib.decompressobj()
+            for offset in range(0, len(view), chunk_size):
+                chunk = decompressor.decompress(view[offset:offset + chunk_size])
+                if chunk:
+                    yield chunk
+            tail = decompressor.flush()
+            if tail:
+                yield tail
+        finally:
+            view.release()
+
+    def read(self, entry: ArchiveEntry) -> bytes:
+        return b"".join(self.iter_document(entry))
+
+    def get(self, job_id: str) -> Optional[ArchiveEntry]:
+        entry = self.entries.get(job_id)
+        if entry is None:
+            # Pode ter sido gravado por outro worker
+            self._refresh_index()
+            entry = self.entries.get(job_id)
+        return entry
+
+    def search(self, limit: int = 50, **filters) -> List[ArchiveEntry]:
+        self._refresh_index()
+        candidates = None
+        for field, value in filters.items():
+            if value in (None, "") or field not in self.by_field:
+                continue
+            ids = set(self.by_field[field].get(str(value), ()))
+            candidates = ids if candidates is None else candidates & ids
+        if candidates is None:
+            selected = list(self.entries.values())
+        else:
+            selected = [self.entries[job_id] for job_id in candidates if job_id in self.entries]
+        printer = filters.get("printer")
+        if printer:
+            selected = [entry for entry in selected if entry.get("printer") == printer]
+        selected.sort(key=lambda entry: (entry["created_at"], entry["offset"]), reverse=True)
+        return selected[:limit]
+
+    def resolve(self, job_or_order_id: str, printer: Optional[str] = None) -> Optional[ArchiveEntry]:
+        """Aceita um job id ou um id de pedido (retorna o job mais recente)."""
+        entry = self.get(job_or_order_id)
+        if entry is not None:
+            return entry
+        found = self.search(limit=1, order_id=job_or_order_id, printer=printer)
+        return found[0] if found else None
+
+    # -- retenção ------------------------------------------------------------
+
+    def prune(self) -> int:
+        """Apaga segmentos fora da retenção e compacta o índice deste processo."""
+        self._last_prune = date.today()
+        if self.retention_days <= 0:
+            return 0
+        cutoff_day = date.today() - timedelta(days=self.retention_days)
+        cutoff = f"{cutoff_day:%Y%m%d}"
+        removed = 0
+        with self._lock:
+            for name in os.listdir(self.directory):
+                if not name.startswith("segment_") or _segment_date(name) >= cutoff:
+                    continue
+                mapped = self._maps.pop(name, None)
+                if mapped is not None:
+                    try:
+                        mapped.close()
+                    except BufferError:
+                        pass  # ainda lido por uma reimpressão; o GC fecha depois
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                    removed += 1
+                except OSError:
+                    pass  # já apagado por outro worker ou ainda mapeado (Windows)
+            expired = {job_id for job_id, entry in self.entries.items() if _segment_date(entry["segment"]) < cutoff}
+            if not removed and not expired:
+                return 0
+            kept = [entry for job_id, entry in self.entries.items() if job_id not in expired]
+            self.entries = {}
+            self.by_field = {field: {} for field in INDEX_FIELDS}
+            for entry in kept:
+                self._add_to_index(entry)
+            self._compact_indexes(cutoff, cutoff_day)
+        print(f"[ARQUIVO] {removed} segmento(s) expirado(s) removido(s).")
+        return removed
+
+    def _compact_indexes(self, cutoff: str, cutoff_day: date) -> None:
+        for path in self._index_files():
+            if path != self.index_path:
+                # Índice de outro worker (ou de um processo antigo): só apaga quando
+                # a última linha já está fora da retenção
+                try:
+                    if date.fromtimestamp(os.path.getmtime(path)) < cutoff_day:
+                        os.remove(path)
+                        self._index_offsets.pop(path, None)
+                except OSError:
+                    pass
+                continue
+            with open(path, "r", encoding="utf-8") as fh:
+                lines = [line for line in fh if line.strip()]
+            kept = []
+            for line in lines:
+                try:
+                    if _segment_date(json.loads(line)["segment"]) < cutoff:
+                        continue
+                except (ValueError, KeyError):
+                    continue
+                kept.append(line if line.endswith("\n") else line + "\n")
+            tmp_path = path + ".tmp"
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as fh:
+                    fh.writelines(kept)
+                os.replace(tmp_path, path)
+            except OSError as exc:
+                print(f"[ARQUIVO] Não foi possível compactar {path}: {exc}")
+                continue
+            self._index_offsets[path] = os.path.getsize(path)
+
+    def stats(self) -> dict:
+        self._refresh_index()
+        size = sum(entry["size"] for entry in self.entries.values())
+        compressed = sum(entry["compressed"] for entry in self.entries.values())
+        return {
+            "directory": self.directory,
+            "documents": len(self.entries),
+            "bytes": size,
+            "compressed_bytes": compressed,
+            "ratio": round(compressed / size, 3) if size else None,
+            "retention_days": self.retention_days,
+            "codec": "zstd" if self.codec == CODEC_ZSTD else "zlib",
+        }
+
+
+_archive: Optional[TicketArchive] = None
+_archive_lock = threading.Lock()
+
+
+def get_archive() -> Optional[TicketArchive]:
+    global _archive
+    if not TICKET_ARCHIVE_DIR:
+        return None
+    if _archive is None:
+        with _archive_lock:
+            if _archive is None:
+                _archive = TicketArchive(TICKET_ARCHIVE_DIR, TICKET_ARCHIVE_RETENTION_DAYS, TICKET_ARCHIVE_CODEC)
+    return _archive
@@ -0,0 +1,215 @@
+"""
+Aquecimento na inicialização e estado de prontidão (/ready).
+
+Depois de um restart a primeira conta pagaria o import do Pillow/NumPy,
+o processamento do logo, a compilação dos templates e a abertura do
+spooler; a primeira comanda de cada impressora pagaria a checagem
+offline. O aquecimento faz tudo isso numa thread logo no startup,
+checando as impressoras em paralelo, e /ready só responde 200 quando
+terminou, para o gerenciador de serviço e o POS só mandarem tráfego a
+uma instância quente.
+
+Impressoras que falharam na checagem são checadas de novo a cada
+WARMUP_RECHECK_SECONDS até responderem. No modo cluster só as impressoras
+locais deste nó são checadas; as remotas ficam com o heartbeat do cluster.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "1") == "1"
+# Com 1, /ready espera todas as impressoras responderem
+WARMUP_REQUIRE_PRINTERS = os.getenv("WARMUP_REQUIRE_PRINTERS", "0") == "1"
+WARMUP_RECHECK_SECONDS = float(os.getenv("WARMUP_RECHECK_SECONDS", "10"))
+
+SAMPLE_ORDER = {
+    "id": 0,
+    "date_time": "2024-01-01T12:00:00.000Z",
+    "table_number": 0,
+    "waiter": "Aquecimento",
+    "order_note": "",
+    "is_outside": False,
+    "order_dishes": [
+        {"dish": {"dish_name": "Prato de aquecimento", "department": "kitchen"}, "amount": 1, "dish_note": None, "unit_price": 1.0},
+    ],
+    "subtotal": 1.0,
+    "service_fee": 0.0,
+    "final_value": 1.0,
+    "qr_url": "https://example.com/nfce",
+}
+
+SAMPLE_REPORT = {
+    "start_date": "2024-01-01",
+    "end_date": "2024-01-01",
+    "total_additions": 0,
+    "total_tables": 0,
+    "daily_breakdown": [{"date": "2024-01-01", "total_additions": 0, "total_tables": 0}],
+}
+
+
+class WarmupState:
+    def __init__(self):
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.steps: Dict[str, dict] = {}
+        self.printers: Dict[str, dict] = {}
+        self._done = threading.Event()
+
+    @property
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    @property
+    def ready(self) -> bool:
+        if not self.done:
+            return False
+        if WARMUP_REQUIRE_PRINTERS:
+            return all(status.get("ready") or status.get("remote") for status in list(self.printers.values()))
+        return True
+
+    def to_dict(self) -> dict:
+        return {
+            "ready": self.ready,
+            "done": self.done,
+            "duration_ms": round((self.finished_at - self.started_at) * 1000, 1)
+            if self.finished_at and self.started_at else None,
+            "steps": self.steps,
+            "printers": self.printers,
+        }
+
+
+state = WarmupState()
+_started = False
+_lock = threading.Lock()
+
+
+def _step(name: str, func) -> None:
+    started = time.perf_counter()
+    try:
+        func()
+        state.steps[name] = {"ok": True, "ms": round((time.perf_counter() - started) * 1000, 1)}
+    except Exception as exc:
+        state.steps[name] = {"ok": False, "ms": round((time.perf_counter() - started) * 1000, 1), "error": str(exc)}
+        print(f"[WARMUP] Falha em {name}: {exc}")
+
+
+def _renderers() -> None:
+    import print_bill
+    import print_dashboard
+    import print_kitchen
+    import receipt_templates
+
+    print_bill.build_bill_payload(SAMPLE_ORDER)
+    print_dashboard.build_summary_payload(SAMPLE_REPORT)
+    receipt_templates.render_order_header(0, "01-01-2024 12:00:00", "Aquecimento", "Cozinha", print_kitchen.PROFILE)
+    receipt_templates.render_order_dish("Prato", 1, None, print_kitchen.PROFILE)
+    receipt_templates.render_order_footer("", 0, False, print_kitchen.PROFILE)
+
+
+def _logo() -> None:
+    import print_bill
+
+    print_bill.logo_escpos()
+
+
+def _render_pool() -> None:
+    import print_bill
+    import render_pool
+
+    executor = render_pool.get_executor()
+    if executor is not None:
+        # Sobe todos os workers e já importa os renderizadores neles
+        list(executor.map(print_bill.build_bill_payload, [SAMPLE_ORDER] * render_pool.RENDER_POOL_WORKERS))
+
+
+def _archive() -> None:
+    import ticket_archive
+
+    ticket_archive.get_archive()
+
+
+def _local_printers(printers: Dict[str, Optional[str]]) -> Dict[str, str]:
+    import cluster
+
+    configured = {role: name for role, name in printers.items() if name}
+    if not cluster.CLUSTER_ENABLED:
+        return configured
+    local = {}
+    for role, name in configured.items():
+        if name in cluster.LOCAL_PRINTERS:
+            local[role] = name
+        else:
+            state.printers[role] = {"printer": name, "remote": True}
+    return local
+
+
+def _probe(printers: Dict[str, str], log: bool = True) -> None:
+    import spooler
+
+    with ThreadPoolExecutor(max_workers=len(printers)) as executor:
+        results = dict(zip(printers, executor.map(spooler.printer_status, printers.values())))
+    state.printers.update(results)
+    for role, status in results.items():
+        if log and not status.get("ready"):
+            print(f"[WARMUP] Impressora {role} ({status.get('printer')}) indisponível: {status.get('error', '')}")
+
+
+def _printers(printers: Dict[str, Optional[str]]) -> None:
+    import spooler
+
+    spooler.get_backend()
+    local = _local_printers(printers)
+    if local:
+        _probe(local)
+
+
+def _recheck() -> None:
+    """Checa de novo as impressoras que falharam, até todas responderem."""
+    while True:
+        pending = {
+            role: status["printer"]
+            for role, status in list(state.printers.items())
+            if not status.get("ready") and not status.get("remote")
+        }
+        if not pending:
+            return
+        time.sleep(WARMUP_RECHECK_SECONDS)
+        _probe(pending, log=False)
+        for role in pending:
+            if state.printers[role].get("ready"):
+                print(f"[WARMUP] Impressora {role} ({pending[role]}) disponível.")
+
+
+def run(printers: Dict[str, Optional[str]]) -> None:
+    state.started_at = time.time()
+    try:
+        _step("renderers", _renderers)
+        _step("logo", _logo)
+        _step("printers", lambda: _printers(printers))
+        _step("render_pool", _render_pool)
+        _step("ticket_archive", _archive)
+    finally:
+        state.finished_at = time.time()
+        state._done.set()
+    print(f"[WARMUP] Concluído em {state.to_dict()['duration_ms']} ms.")
+    _recheck()
+
+
+def start(printers: Dict[str, Optional[str]]) -> None:
+    """Dispara o aquecimento em background (uma vez por processo)."""
+    global _started
+    with _lock:
+        if _started:
+            return
+        _started = True
+    if not WARMUP_ENABLED:
+        state.started_at = state.finished_at = time.time()
+        state._done.set()
+        return
+    threading.Thread(target=run, args=(printers,), name="warmup", daemon=True).start()